@@ -0,0 +1,57 @@
+import json
+import time
+import numpy as np
+import ujson
+
+from geode.google.distance_matrix import decode_distance_matrix_response, map_from_distance_matrix_response
+from geode.google.models import GoogleDistanceMatrixResponse
+from geode.utils import marshall_to
+
+SIZE = 25
+RUNS = 200
+
+
+def response_body(olen, dlen):
+    meters = np.random.randint(1000, 500000, size=(olen, dlen))
+    return ujson.dumps({
+        'destination_addresses': ['Somewhere, USA'] * dlen,
+        'origin_addresses': ['Elsewhere, USA'] * olen,
+        'rows': [
+            {'elements': [
+                {
+                    'distance': {'text': f'{m / 1000:.1f} km', 'value': int(m)},
+                    'duration': {'text': f'{m // 1800} mins', 'value': int(m // 30)},
+                    'status': 'OK'
+                } for m in row
+            ]} for row in meters
+        ],
+        'status': 'OK'
+    }).encode()
+
+
+def dataclasses(body):
+    return map_from_distance_matrix_response(marshall_to(GoogleDistanceMatrixResponse, json.loads(body)))
+
+
+def arrays(body):
+    return decode_distance_matrix_response(body).distances
+
+
+def timed(fn, *args):
+    s = time.time()
+    for _ in range(RUNS):
+        fn(*args)
+    return (time.time() - s) / RUNS
+
+
+def main():
+    body = response_body(SIZE, SIZE)
+    np.testing.assert_array_equal(dataclasses(body).meters, arrays(body).meters)
+
+    for name, fn in [('dataclasses', dataclasses), ('arrays', arrays)]:
+        t = timed(fn, body)
+        print('%dx%d %-12s %8.3fms  %10.0f elements/s' % (SIZE, SIZE, name, t * 1000, SIZE * SIZE / t))
+
+
+if __name__ == '__main__':
+    main()
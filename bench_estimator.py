@@ -0,0 +1,55 @@
+import time
+import numpy as np
+import pandas as pd
+
+from geode import dist_metrics
+from geode.estimator import Estimator
+from geode.utils import point_keys
+
+SIZES = [100, 1000, 3000]
+
+
+def random_locs(n):
+    return np.random.rand(n, 2) * [20, 20] + [25, -100]
+
+
+def cached_rows(n):
+    """Provider like rows, detour and speed drift with longitude."""
+    origins = random_locs(n)
+    destinations = random_locs(n)
+    line = dist_metrics.pairwise('haversine', origins, destinations)
+    detour = 1.2 + (origins[:, 1] + 100) / 100 + np.random.rand(n) * 0.1
+    return pd.DataFrame({
+        'okey': point_keys(origins),
+        'dkey': point_keys(destinations),
+        'meters': line * detour,
+        'seconds': line * detour / 25,
+    })
+
+
+def timed(fn, *args):
+    s = time.time()
+    fn(*args)
+    return time.time() - s
+
+
+def main():
+    rows = cached_rows(10 ** 6)
+    estimator = Estimator()
+    t = timed(estimator.fit, rows)
+    print('fit %d rows in %d buckets  %9.1fms' % (len(rows), len(estimator.codes), t * 1000))
+
+    for n in SIZES:
+        origins = random_locs(n)
+        destinations = random_locs(n)
+
+        for label, fn in [
+            ('gc_manhattan', lambda u, v: dist_metrics.matrix('gc_manhattan', u, v)),
+            ('estimator', estimator.matrix),
+        ]:
+            t = timed(fn, origins, destinations)
+            print('%5d x %-5d %-13s %9.1fms  %12.0f cells/s' % (n, n, label, t * 1000, n * n / t))
+
+
+if __name__ == '__main__':
+    main()
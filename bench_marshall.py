@@ -0,0 +1,67 @@
+import time
+import ujson
+from typing import List
+
+from geode.google.models import GoogleDistanceMatrixResponse, GoogleGeocodingResponse
+from geode.smarty.models import SAMPLE_RESULTS, SmartyGeocodingResponse
+from geode.utils import marshall_to, marshall_to_reflective
+
+RUNS = 500
+
+GEOCODE_RESULT = {
+    'address_components': [
+        {'long_name': '1600', 'short_name': '1600', 'types': ['street_number']},
+        {'long_name': 'Amphitheatre Parkway', 'short_name': 'Amphitheatre Pkwy', 'types': ['route']},
+        {'long_name': 'Mountain View', 'short_name': 'Mountain View', 'types': ['locality', 'political']},
+        {'long_name': 'Santa Clara County', 'short_name': 'Santa Clara County', 'types': ['administrative_area_level_2', 'political']},
+        {'long_name': 'California', 'short_name': 'CA', 'types': ['administrative_area_level_1', 'political']},
+        {'long_name': 'United States', 'short_name': 'US', 'types': ['country', 'political']},
+        {'long_name': '94043', 'short_name': '94043', 'types': ['postal_code']},
+    ],
+    'formatted_address': '1600 Amphitheatre Parkway, Mountain View, CA 94043, USA',
+    'geometry': {
+        'location': {'lat': 37.4224764, 'lng': -122.0842499},
+        'location_type': 'ROOFTOP',
+        'viewport': {
+            'northeast': {'lat': 37.4238253802915, 'lng': -122.0829009197085},
+            'southwest': {'lat': 37.4211274197085, 'lng': -122.0855988802915},
+        },
+    },
+    'partial_match': False,
+    'place_id': 'ChIJ2eUgeAK6j4ARbn5u_wAGqWA',
+    'types': ['street_address'],
+}
+
+RESPONSES = [
+    ('google geocode', GoogleGeocodingResponse, {'results': [GEOCODE_RESULT] * 3, 'status': 'OK'}),
+    ('google matrix', GoogleDistanceMatrixResponse, {
+        'destination_addresses': ['a'] * 25,
+        'origin_addresses': ['b'] * 25,
+        'rows': [{'elements': [
+            {'distance': {'text': '1 km', 'value': 1000}, 'duration': {'text': '1 min', 'value': 60}, 'status': 'OK'}
+        ] * 25}] * 25,
+        'status': 'OK'
+    }),
+    # one full street-address POST
+    ('smarty batch', List[SmartyGeocodingResponse], [ujson.loads(SAMPLE_RESULTS)] * 100),
+]
+
+
+def timed(fn, *args):
+    s = time.time()
+    for _ in range(RUNS):
+        fn(*args)
+    return (time.time() - s) / RUNS
+
+
+def main():
+    for name, cls, data in RESPONSES:
+        assert marshall_to(cls, data) == marshall_to_reflective(cls, data)
+
+        for label, fn in [('reflective', marshall_to_reflective), ('compiled', marshall_to)]:
+            t = timed(fn, cls, data)
+            print('%-15s %-11s %8.1fus  %9.0f responses/s' % (name, label, t * 10 ** 6, 1 / t))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+import time
+import numpy as np
+
+from geode import dist_metrics
+
+# previous distance_pairs estimate, one python call per coordinate
+# was np.vectorize(spatial.distance.euclidean), which newer scipy rejects for scalars
+VEC_DIST = np.vectorize(lambda u, v: np.sqrt((u - v) ** 2))
+
+SIZES = [10 ** 4, 10 ** 5, 10 ** 6]
+
+
+def random_locs(n):
+    return np.random.rand(n, 2) * [20, 20] + [25, -100]
+
+
+def legacy(origins, destinations):
+    return np.sqrt(np.square(
+        VEC_DIST(
+            np.radians(origins),
+            np.radians(destinations)
+        )
+    ).sum(axis=1)) * dist_metrics.R_EARTH
+
+
+def timed(fn, *args):
+    s = time.time()
+    fn(*args)
+    return time.time() - s
+
+
+def main():
+    for n in SIZES:
+        origins = random_locs(n)
+        destinations = random_locs(n)
+
+        t = timed(legacy, origins, destinations)
+        print('%8d pairs  %-13s %9.1fms  %12.0f pairs/s' % (n, 'vectorize', t * 1000, n / t))
+
+        for metric in dist_metrics.METRICS:
+            t = timed(dist_metrics.pairwise, metric, origins, destinations)
+            print('%8d pairs  %-13s %9.1fms  %12.0f pairs/s' % (n, metric, t * 1000, n / t))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+import logging
+import re
+import numpy as np
+import usaddress
+from dataclasses import dataclass
+from typing import Dict, List, Sequence, Tuple
+
+from geode.utils import PRECISION, normalize_address, point_to_str
+
+logger = logging.getLogger()
+
+# USPS abbreviations, common spellings only, see USPS publication 28 appendix C
+STREET_TYPES = {
+    'alley': 'aly', 'allee': 'aly', 'ally': 'aly',
+    'avenue': 'ave', 'av': 'ave', 'aven': 'ave', 'avenu': 'ave', 'avn': 'ave', 'avnue': 'ave',
+    'boulevard': 'blvd', 'boul': 'blvd', 'boulv': 'blvd',
+    'circle': 'cir', 'circ': 'cir', 'circl': 'cir', 'crcl': 'cir',
+    'court': 'ct', 'crt': 'ct',
+    'center': 'ctr', 'centre': 'ctr', 'cent': 'ctr', 'cntr': 'ctr',
+    'drive': 'dr', 'driv': 'dr', 'drv': 'dr',
+    'expressway': 'expy', 'expressw': 'expy', 'expw': 'expy',
+    'freeway': 'fwy', 'frwy': 'fwy',
+    'highway': 'hwy', 'highwy': 'hwy', 'hiway': 'hwy', 'hiwy': 'hwy',
+    'lane': 'ln',
+    'parkway': 'pkwy', 'parkwy': 'pkwy', 'pkway': 'pkwy', 'pky': 'pkwy',
+    'place': 'pl',
+    'plaza': 'plz', 'plza': 'plz',
+    'point': 'pt',
+    'road': 'rd',
+    'route': 'rte',
+    'square': 'sq', 'sqr': 'sq',
+    'street': 'st', 'str': 'st', 'strt': 'st',
+    'terrace': 'ter', 'terr': 'ter',
+    'trail': 'trl', 'trails': 'trl',
+}
+
+DIRECTIONS = {
+    'north': 'n', 'south': 's', 'east': 'e', 'west': 'w',
+    'northeast': 'ne', 'northwest': 'nw', 'southeast': 'se', 'southwest': 'sw',
+}
+
+OCCUPANCY_TYPES = {
+    'apartment': 'apt', 'building': 'bldg', 'floor': 'fl', 'room': 'rm', 'suite': 'ste', 'unit': 'unit', '#': '#',
+}
+
+STATES = {
+    'alabama': 'al', 'alaska': 'ak', 'arizona': 'az', 'arkansas': 'ar', 'california': 'ca', 'colorado': 'co',
+    'connecticut': 'ct', 'delaware': 'de', 'district of columbia': 'dc', 'florida': 'fl', 'georgia': 'ga',
+    'hawaii': 'hi', 'idaho': 'id', 'illinois': 'il', 'indiana': 'in', 'iowa': 'ia', 'kansas': 'ks',
+    'kentucky': 'ky', 'louisiana': 'la', 'maine': 'me', 'maryland': 'md', 'massachusetts': 'ma',
+    'michigan': 'mi', 'minnesota': 'mn', 'mississippi': 'ms', 'missouri': 'mo', 'montana': 'mt',
+    'nebraska': 'ne', 'nevada': 'nv', 'new hampshire': 'nh', 'new jersey': 'nj', 'new mexico': 'nm',
+    'new york': 'ny', 'north carolina': 'nc', 'north dakota': 'nd', 'ohio': 'oh', 'oklahoma': 'ok',
+    'oregon': 'or', 'pennsylvania': 'pa', 'puerto rico': 'pr', 'rhode island': 'ri', 'south carolina': 'sc',
+    'south dakota': 'sd', 'tennessee': 'tn', 'texas': 'tx', 'utah': 'ut', 'vermont': 'vt', 'virginia': 'va',
+    'washington': 'wa', 'west virginia': 'wv', 'wisconsin': 'wi', 'wyoming': 'wy',
+}
+
+# usaddress label -> lookup of its canonical spellings
+LABEL_ABBREVIATIONS = {
+    'StreetNamePreType': STREET_TYPES,
+    'StreetNamePostType': STREET_TYPES,
+    'StreetNamePreDirectional': DIRECTIONS,
+    'StreetNamePostDirectional': DIRECTIONS,
+    'OccupancyType': OCCUPANCY_TYPES,
+    'StateName': STATES,
+}
+
+# separators and trailing dots carry no meaning, '#', '-', '/' do in unit numbers and fractions
+PUNCTUATION = re.compile(r'[.,;:()"]+')
+
+
+def canonical_address(address: str) -> str:
+    """
+    Address with USPS abbreviations, casefolded and without punctuation, for matching spellings of one place.
+    Parts keep their order, labels usaddress tags are only used to pick abbreviations.
+    ZIP+4 is cut to the 5 digit ZIP.
+    """
+    text = normalize_address(address)
+    try:
+        tagged = usaddress.parse(text)
+    except Exception as err:
+        logger.debug('address %r not parsed: %s', address, err)
+        return ' '.join(PUNCTUATION.sub(' ', text).split())
+
+    parts = []
+    # consecutive tokens of a label are one part, for multi word states
+    for label, tokens in _runs(tagged):
+        value = ' '.join(t for t in (PUNCTUATION.sub('', t) for t in tokens) if t)
+        if not value:
+            continue
+
+        if label == 'ZipCode':
+            value = value[:5]
+        else:
+            value = LABEL_ABBREVIATIONS.get(label, {}).get(value, value)
+        parts.append(value)
+
+    return ' '.join(parts)
+
+
+def _runs(tagged):
+    runs = []
+    for token, label in tagged:
+        if runs and runs[-1][0] == label:
+            runs[-1][1].append(token)
+        else:
+            runs.append((label, [token]))
+    return runs
+
+
+@dataclass
+class DedupMetrics:
+    requested: int = 0
+    unique: int = 0
+
+    @property
+    def dedup_ratio(self) -> float:
+        """Share of requested locations served by another location's request."""
+        return 1 - self.unique / self.requested if self.requested else 0.
+
+
+def geocode_key(location) -> str:
+    """Cache key of a geocode request, canonical address or quantized point."""
+    if isinstance(location, str):
+        return canonical_address(location)
+    return point_to_str(location, PRECISION)
+
+
+def dedup_locations(locations: Sequence) -> Tuple[List[str], List, np.ndarray]:
+    """
+    Group locations by geocode key.
+    Each case and whitespace folded spelling is parsed once, parsing is the slow part.
+    :return: unique keys, first location given for each, inverse positions of locations into keys
+    """
+    positions: Dict[str, int] = {}
+    parsed: Dict[str, str] = {}
+    keys: List[str] = []
+    representatives: List = []
+    inverse = np.empty(len(locations), dtype=np.int64)
+
+    for i, loc in enumerate(locations):
+        if isinstance(loc, str):
+            folded = normalize_address(loc)
+            key = parsed.get(folded)
+            if key is None:
+                key = parsed[folded] = canonical_address(folded)
+        else:
+            key = geocode_key(loc)
+
+        pos = positions.get(key)
+        if pos is None:
+            pos = positions[key] = len(keys)
+            keys.append(key)
+            representatives.append(loc)
+        inverse[i] = pos
+
+    return keys, representatives, inverse
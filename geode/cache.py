@@ -1,7 +1,34 @@
+import asyncio
 import asyncpg
+import dataclasses
+import logging
+import sqlite3
+import threading
+import time
+import numpy as np
 import pandas as pd
-from dataclasses import dataclass
-from geode.utils import KEY_COLS
+import ujson
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+import geode.models as m
+from geode.utils import marshall_to, KEY_COLS, PRECISION, quantize, pack_keys, point_keys, key_points, lookup_cells
+
+logger = logging.getLogger()
+
+DISTANCE_COLS = ['okey', 'dkey', 'meters', 'seconds']
+
+# rough footprint of one memory cache row: seven 8 byte columns plus its slot in the hash index
+ENTRY_BYTES = 96
+
+# share of capacity evicted beyond the overflow once the memory cache is full
+EVICT_RATIO = 0.05
+
+# max locations per array parameter, larger lookups are split over several queries
+LOOKUP_CHUNK = 10_000
+
+# rows per frame when scanning every cached row of a provider
+SCAN_ROWS = 100_000
 
 
 def CREATE_DISTANCE_TABLE(provider):
@@ -20,6 +47,7 @@ CREATE UNIQUE INDEX IF NOT EXISTS distances_{provider}_pkey ON distances_{provid
 '''
 
 
+# dropped at commit, pooled connections outlive one write
 def CREATE_DISTANCE_TABLE_TEMP(provider):
     return f'''
 CREATE TEMPORARY TABLE distances_{provider}_tmp (
@@ -30,7 +58,7 @@ CREATE TEMPORARY TABLE distances_{provider}_tmp (
     precision smallint DEFAULT '4'::smallint,
     meters double precision,
     seconds double precision
-);'''
+) ON COMMIT DROP;'''
 
 
 def MERGE_DISTANCES(provider):
@@ -45,17 +73,72 @@ ON CONFLICT DO NOTHING;
 '''
 
 
-def GET_DISTANCES(provider, origins, destinations, pair=False):
-    if pair:
-        return f'''
-SELECT * FROM distances_{provider}
-WHERE (olat, olon, dlat, dlon) IN ({','.join(f'({o[0]},{o[1]},{d[0]},{d[1]})' for o, d in zip(origins, destinations))});
+# results are json lists of geode.models.geocoding.Result, empty when the provider found nothing
+# expires is unix seconds, null never expires
+def CREATE_GEOCODE_TABLE(provider):
+    return f'''
+CREATE TABLE IF NOT EXISTS geocodes_{provider} (
+    key text PRIMARY KEY,
+    results text NOT NULL,
+    expires double precision
+);
+'''
+
+
+def GET_GEOCODES(provider):
+    return f'''
+SELECT key, results, expires FROM geocodes_{provider}
+WHERE key = ANY($1::text[]) AND (expires IS NULL OR expires > $2);
+'''
+
+
+def MERGE_GEOCODES(provider):
+    return f'''
+INSERT INTO geocodes_{provider} (key, results, expires) VALUES ($1, $2, $3)
+ON CONFLICT (key) DO UPDATE SET results = EXCLUDED.results, expires = EXCLUDED.expires;
+'''
+
+
+def GET_LOCATIONS(provider, side):
+    scale = 10 ** PRECISION
+    return f'''
+SELECT DISTINCT ({side}lat * {scale})::int4, ({side}lon * {scale})::int4
+FROM distances_{provider}
+WHERE precision = $1;
 '''
 
+
+def SCAN_DISTANCES(provider):
+    scale = 10 ** PRECISION
     return f'''
-SELECT * FROM distances_{provider}
-WHERE (olat, olon) IN ({','.join(f'({x[0]},{x[1]})' for x in origins)})
-AND (dlat, dlon) IN ({','.join(f'({x[0]},{x[1]})' for x in destinations)});
+SELECT (olat * {scale})::int4, (olon * {scale})::int4, (dlat * {scale})::int4, (dlon * {scale})::int4,
+    meters, seconds
+FROM distances_{provider}
+WHERE precision = $1;
+'''
+
+
+# coordinates go in and out as int grid units, see geode.utils.quantize
+# query text is fixed per provider, so asyncpg reuses the prepared statement on each pooled connection
+def GET_DISTANCES(provider, pair=False):
+    scale = 10 ** PRECISION
+    select = f'''
+SELECT (d.olat * {scale})::int4, (d.olon * {scale})::int4, (d.dlat * {scale})::int4, (d.dlon * {scale})::int4,
+    d.meters, d.seconds
+FROM distances_{provider} d'''
+
+    if pair:
+        return f'''{select}
+JOIN unnest($1::int4[], $2::int4[], $3::int4[], $4::int4[]) AS p(olat, olon, dlat, dlon)
+    ON d.olat = p.olat::numeric / {scale} AND d.olon = p.olon::numeric / {scale}
+    AND d.dlat = p.dlat::numeric / {scale} AND d.dlon = p.dlon::numeric / {scale}
+WHERE d.precision = $5;
+'''
+
+    return f'''{select}
+WHERE d.precision = $5
+AND (d.olat, d.olon) IN (SELECT lat::numeric / {scale}, lon::numeric / {scale} FROM unnest($1::int4[], $2::int4[]) AS o(lat, lon))
+AND (d.dlat, d.dlon) IN (SELECT lat::numeric / {scale}, lon::numeric / {scale} FROM unnest($3::int4[], $4::int4[]) AS d(lat, lon));
 '''
 
 
@@ -66,46 +149,1076 @@ class PostgresCache:
     password: str
     database: str
     port: int = 5432
+    min_size: int = 1
+    max_size: int = 10
+
+    pool: Any = field(default=None, init=False, repr=False)
+    # tables are created once per provider
+    tables: set = field(default_factory=set, init=False, repr=False)
+    _pool_loop: Any = field(default=None, init=False, repr=False)
+    _pool_task: Any = field(default=None, init=False, repr=False)
+
+    async def init(self, providers=('google',)):
+        """Create connection pool and any missing provider tables, safe to call again."""
+        pool = await self.get_pool()
+
+        missing = [p for p in providers if p not in self.tables]
+        if missing:
+            async with pool.acquire() as conn:
+                for provider in missing:
+                    await conn.execute(CREATE_DISTANCE_TABLE(provider))
+                    await conn.execute(CREATE_GEOCODE_TABLE(provider))
+            self.tables.update(missing)
+
+        return self
+
+    async def get_pool(self):
+        loop = asyncio.get_running_loop()
+
+        # pool is bound to the loop that made it
+        if self.pool is not None and self._pool_loop is not loop:
+            self._drop_pool()
+
+        if self.pool is None:
+            # callers arriving while the pool is being made wait on the same creation
+            if self._pool_task is None or self._pool_task.get_loop() is not loop:
+                self._pool_task = asyncio.ensure_future(asyncpg.create_pool(
+                    user=self.user, password=self.password, database=self.database, host=self.host,
+                    port=self.port, min_size=self.min_size, max_size=self.max_size
+                ))
+
+            task = self._pool_task
+            try:
+                pool = await asyncio.shield(task)
+            finally:
+                # a cancelled waiter leaves the creation for the next caller
+                if self._pool_task is task and task.done():
+                    self._pool_task = None
+
+            if self.pool is None:
+                self.pool = pool
+                self._pool_loop = loop
+
+        return self.pool
+
+    async def close(self):
+        if self.pool is not None:
+            if self._pool_loop is asyncio.get_running_loop():
+                await self.pool.close()
+                self.pool = None
+            else:
+                self._drop_pool()
+
+    def _drop_pool(self):
+        try:
+            self.pool.terminate()
+        except RuntimeError:
+            # owning loop already closed, nothing left to shut down cleanly
+            pass
+        self.pool = None
+
+    async def get_distances(self, origins, destinations, provider=None, pair=False, precision=PRECISION):
+        """
+        :param precision: Tier of cached rows, locations are passed rounded to it
+        """
+        ogrid = quantize(origins)
+        dgrid = quantize(destinations)
+
+        if pair:
+            chunks = [
+                (ogrid[i:i + LOOKUP_CHUNK], dgrid[i:i + LOOKUP_CHUNK])
+                for i in range(0, len(ogrid), LOOKUP_CHUNK)
+            ]
+        else:
+            chunks = [
+                (ogrid[i:i + LOOKUP_CHUNK], dgrid[j:j + LOOKUP_CHUNK])
+                for i in range(0, len(ogrid), LOOKUP_CHUNK)
+                for j in range(0, len(dgrid), LOOKUP_CHUNK)
+            ]
+
+        query = GET_DISTANCES(provider, pair)
+        results = await asyncio.gather(*[self.fetch(query, o, d, precision) for o, d in chunks])
+
+        return grid_distances([r for res in results for r in res])
+
+    async def iter_distances(self, provider, precision=PRECISION, chunk_rows=SCAN_ROWS):
+        """
+        Every row cached at precision, read through a server side cursor.
+        :return: async iterator of DataFrames of okey, dkey, meters, seconds, up to chunk_rows long
+        """
+        pool = await self.get_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                cursor = await conn.cursor(SCAN_DISTANCES(provider), precision)
+                while True:
+                    rows = await cursor.fetch(chunk_rows)
+                    if not rows:
+                        break
+                    yield grid_distances(rows)
+
+    async def fetch(self, query, ogrid, dgrid, precision=PRECISION):
+        pool = await self.get_pool()
+        async with pool.acquire() as conn:
+            return await conn.fetch(
+                query,
+                ogrid[:, 0].tolist(), ogrid[:, 1].tolist(),
+                dgrid[:, 0].tolist(), dgrid[:, 1].tolist(),
+                precision
+            )
+
+    async def set_distances(self, distances, provider, precision=PRECISION):
+        """
+        :param distances: DataFrame of okey, dkey, meters, seconds
+        :param precision: Tier the rows are cached at, keys are of locations rounded to it
+        """
+        if distances is None or distances.empty:
+            return
+
+        distances = pd.DataFrame(
+            np.hstack((key_points(distances.okey.values), key_points(distances.dkey.values))),
+            columns=KEY_COLS
+        ).assign(
+            precision=precision,
+            meters=distances.meters.values,
+            seconds=distances.seconds.values
+        )
+
+        pool = await self.get_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(CREATE_DISTANCE_TABLE_TEMP(provider))
+
+                await conn.copy_records_to_table(
+                    f'distances_{provider}_tmp',
+                    records=distances.itertuples(index=False),
+                    columns=[x for x in distances]
+                )
+
+                await conn.execute(MERGE_DISTANCES(provider))
+
+        return
+
+    async def get_locations(self, provider):
+        """
+        :return: distinct origin keys, distinct destination keys of cached cells
+        """
+        pool = await self.get_pool()
+        async with pool.acquire() as conn:
+            rows = [await conn.fetch(GET_LOCATIONS(provider, side), PRECISION) for side in 'od']
+
+        return tuple(pack_keys(np.array([tuple(r) for r in res], dtype=np.int64).reshape(-1, 2)) for res in rows)
+
+    async def get_geocodes(self, keys, provider):
+        """
+        :return: (key, results json, expires) rows of unexpired keys found
+        """
+        pool = await self.get_pool()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(GET_GEOCODES(provider), list(keys), time.time())
+        return [tuple(r) for r in rows]
+
+    async def set_geocodes(self, rows, provider):
+        """
+        :param rows: (key, results json, expires) tuples
+        """
+        pool = await self.get_pool()
+        async with pool.acquire() as conn:
+            await conn.executemany(MERGE_GEOCODES(provider), rows)
+
 
-    async def connection(self):
-        conn = await asyncpg.connect(user=self.user, password=self.password, database=self.database, host=self.host, port=self.port)
+def grid_distances(rows) -> pd.DataFrame:
+    """
+    :param rows: olat, olon, dlat, dlon grid units, meters, seconds records
+    :return: DataFrame of okey, dkey, meters, seconds
+    """
+    rows = np.array([tuple(r) for r in rows], dtype=float).reshape(-1, 6)
 
-        # TODO: loop thru valid providers
-        await conn.execute(CREATE_DISTANCE_TABLE('google'))
+    return pd.DataFrame({
+        'okey': pack_keys(rows[:, 0:2]),
+        'dkey': pack_keys(rows[:, 2:4]),
+        'meters': rows[:, 4],
+        'seconds': rows[:, 5],
+    })
 
-        return conn
 
-    async def get_distances(self, origins, destinations, provider=None, pair=False):
-        conn = await self.connection()
-        results = await conn.fetch(GET_DISTANCES(provider, origins, destinations, pair))
+def CREATE_SQLITE_DISTANCE_TABLE(provider):
+    return f'''
+CREATE TABLE IF NOT EXISTS distances_{provider} (
+    precision INTEGER NOT NULL,
+    okey INTEGER NOT NULL,
+    dkey INTEGER NOT NULL,
+    meters REAL,
+    seconds REAL,
+    PRIMARY KEY (precision, okey, dkey)
+) WITHOUT ROWID;
+'''
+
+
+def CREATE_SQLITE_GEOCODE_TABLE(provider):
+    return f'''
+CREATE TABLE IF NOT EXISTS geocodes_{provider} (
+    key TEXT PRIMARY KEY,
+    results TEXT NOT NULL,
+    expires REAL
+);
+'''
+
+
+SQLITE_KEY_TABLES = '''
+CREATE TEMP TABLE IF NOT EXISTS lookup_okeys (key INTEGER PRIMARY KEY);
+CREATE TEMP TABLE IF NOT EXISTS lookup_dkeys (key INTEGER PRIMARY KEY);
+CREATE TEMP TABLE IF NOT EXISTS lookup_pairs (okey INTEGER, dkey INTEGER, PRIMARY KEY (okey, dkey)) WITHOUT ROWID;
+CREATE TEMP TABLE IF NOT EXISTS lookup_geocodes (key TEXT PRIMARY KEY);
+'''
+
+
+# CROSS JOIN pins the key tables as outer loop, planner has no stats on them
+def GET_SQLITE_DISTANCES(provider, pair=False):
+    if pair:
+        return f'''
+SELECT d.okey, d.dkey, d.meters, d.seconds
+FROM lookup_pairs p
+CROSS JOIN distances_{provider} d ON d.precision = ? AND d.okey = p.okey AND d.dkey = p.dkey;
+'''
 
-        await conn.close()
+    return f'''
+SELECT d.okey, d.dkey, d.meters, d.seconds
+FROM lookup_okeys o
+CROSS JOIN distances_{provider} d ON d.precision = ? AND d.okey = o.key
+WHERE d.dkey IN (SELECT key FROM lookup_dkeys);
+'''
+
+
+# keyset paging, each page starts after the last key of the one before
+def SCAN_SQLITE_DISTANCES(provider):
+    return f'''
+SELECT okey, dkey, meters, seconds
+FROM distances_{provider}
+WHERE precision = ? AND (okey, dkey) > (?, ?)
+ORDER BY okey, dkey
+LIMIT ?;
+'''
+
+
+def MERGE_SQLITE_DISTANCES(provider):
+    return f'''
+INSERT OR IGNORE INTO distances_{provider} (precision, okey, dkey, meters, seconds) VALUES (?, ?, ?, ?, ?);
+'''
+
+
+def GET_SQLITE_GEOCODES(provider):
+    return f'''
+SELECT g.key, g.results, g.expires
+FROM lookup_geocodes l
+CROSS JOIN geocodes_{provider} g ON g.key = l.key
+WHERE g.expires IS NULL OR g.expires > ?;
+'''
 
-        distf = pd.DataFrame(
-            results,
-            columns=[*KEY_COLS, 'precision', 'meters', 'seconds']).drop('precision', 1)
-        distf[KEY_COLS] = distf[KEY_COLS].astype(pd.np.float)
-        distf.set_index(KEY_COLS, drop=True, inplace=True)
 
-        return distf
+def MERGE_SQLITE_GEOCODES(provider):
+    return f'''
+INSERT OR REPLACE INTO geocodes_{provider} (key, results, expires) VALUES (?, ?, ?);
+'''
 
-    async def set_distances(self, origins, destinations, distances, provider):
+
+def sqlite_distances(rows) -> pd.DataFrame:
+    return pd.DataFrame.from_records(rows, columns=DISTANCE_COLS).astype({
+        'okey': np.int64, 'dkey': np.int64, 'meters': np.float64, 'seconds': np.float64
+    })
+
+
+@dataclass
+class SqliteCache:
+    """
+    Single file distance cache, no server needed.
+    Rows are keyed by packed origin, destination keys, see geode.utils.pack_keys.
+    Blocking sqlite calls run on the default executor, one at a time over a shared connection.
+    """
+    path: str = 'geode.sqlite'
+    timeout: float = 30.0  # seconds to wait on a file lock held by another process
+
+    conn: Any = field(default=None, init=False, repr=False)
+    tables: set = field(default_factory=set, init=False, repr=False)
+    lock: Any = field(default_factory=threading.Lock, init=False, repr=False)
+
+    async def init(self, providers=('google',)):
+        missing = [p for p in providers if p not in self.tables]
+        if missing:
+            await self.run(self._create_tables, missing)
+        return self
+
+    async def run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, self._locked, fn, *args)
+
+    def _locked(self, fn, *args):
+        with self.lock:
+            if self.conn is None:
+                self.conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+                self.conn.execute('PRAGMA journal_mode=WAL')
+                self.conn.execute('PRAGMA synchronous=NORMAL')
+                self.conn.executescript(SQLITE_KEY_TABLES)
+            return fn(self.conn, *args)
+
+    def _create_tables(self, conn, providers):
+        for provider in providers:
+            conn.executescript(CREATE_SQLITE_DISTANCE_TABLE(provider))
+            conn.executescript(CREATE_SQLITE_GEOCODE_TABLE(provider))
+        self.tables.update(providers)
+
+    async def close(self):
+        if self.conn is not None:
+            await self.run(lambda conn: conn.close())
+            self.conn = None
+
+    async def get_distances(self, origins, destinations, provider=None, pair=False, precision=PRECISION):
+        rows = await self.run(
+            self._get_distances, point_keys(origins), point_keys(destinations), provider, pair, precision)
+
+        return sqlite_distances(rows)
+
+    async def iter_distances(self, provider, precision=PRECISION, chunk_rows=SCAN_ROWS):
+        """
+        Every row cached at precision, a page of chunk_rows per call so writes go on in between.
+        :return: async iterator of DataFrames of okey, dkey, meters, seconds
+        """
+        after = (np.iinfo(np.int64).min, np.iinfo(np.int64).min)
+        while True:
+            rows = await self.run(self._scan_distances, provider, precision, after, chunk_rows)
+            if not rows:
+                break
+            yield sqlite_distances(rows)
+            after = rows[-1][:2]
+
+    def _scan_distances(self, conn, provider, precision, after, limit):
+        return conn.execute(SCAN_SQLITE_DISTANCES(provider), (precision, *after, limit)).fetchall()
+
+    def _get_distances(self, conn, okeys, dkeys, provider, pair, precision):
+        with conn:
+            if pair:
+                conn.execute('DELETE FROM lookup_pairs')
+                conn.executemany('INSERT OR IGNORE INTO lookup_pairs VALUES (?, ?)', zip(okeys.tolist(), dkeys.tolist()))
+            else:
+                conn.execute('DELETE FROM lookup_okeys')
+                conn.execute('DELETE FROM lookup_dkeys')
+                conn.executemany('INSERT OR IGNORE INTO lookup_okeys VALUES (?)', ((k,) for k in okeys.tolist()))
+                conn.executemany('INSERT OR IGNORE INTO lookup_dkeys VALUES (?)', ((k,) for k in dkeys.tolist()))
+
+            return conn.execute(GET_SQLITE_DISTANCES(provider, pair), (precision,)).fetchall()
+
+    async def set_distances(self, distances, provider, precision=PRECISION):
+        """
+        :param distances: DataFrame of okey, dkey, meters, seconds
+        """
         if distances is None or distances.empty:
             return
 
-        distances = distances.drop('source', axis=1).reset_index()
+        records = zip(
+            [precision] * len(distances),
+            distances.okey.values.tolist(),
+            distances.dkey.values.tolist(),
+            distances.meters.values.tolist(),
+            distances.seconds.values.tolist()
+        )
+        await self.run(self._set_distances, records, provider)
 
-        conn = await self.connection()
+    def _set_distances(self, conn, records, provider):
+        with conn:
+            conn.executemany(MERGE_SQLITE_DISTANCES(provider), records)
 
-        await conn.execute(CREATE_DISTANCE_TABLE_TEMP(provider))
+    async def get_locations(self, provider):
+        """
+        :return: distinct origin keys, distinct destination keys of cached cells
+        """
+        return await self.run(self._get_locations, provider)
 
-        await conn.copy_records_to_table(
-            f'distances_{provider}_tmp',
-            records=distances.itertuples(index=False),
-            columns=[x for x in distances]
+    def _get_locations(self, conn, provider):
+        return tuple(
+            np.array(conn.execute(
+                f'SELECT DISTINCT {col} FROM distances_{provider} WHERE precision = ?', (PRECISION,)
+            ).fetchall(), dtype=np.int64).reshape(-1)
+            for col in ('okey', 'dkey')
         )
 
-        await conn.execute(MERGE_DISTANCES(provider))
-        await conn.close()
+    async def get_geocodes(self, keys, provider):
+        """
+        :return: (key, results json, expires) rows of unexpired keys found
+        """
+        return await self.run(self._get_geocodes, list(keys), provider)
 
-        return
+    def _get_geocodes(self, conn, keys, provider):
+        with conn:
+            conn.execute('DELETE FROM lookup_geocodes')
+            conn.executemany('INSERT OR IGNORE INTO lookup_geocodes VALUES (?)', ((k,) for k in keys))
+            return conn.execute(GET_SQLITE_GEOCODES(provider), (time.time(),)).fetchall()
+
+    async def set_geocodes(self, rows, provider):
+        """
+        :param rows: (key, results json, expires) tuples
+        """
+        await self.run(self._set_geocodes, rows, provider)
+
+    def _set_geocodes(self, conn, rows, provider):
+        with conn:
+            conn.executemany(MERGE_SQLITE_GEOCODES(provider), rows)
+
+
+class DistanceTable:
+    """
+    Cached rows of one provider and precision, in columns.
+    Location keys are interned to ids, so a cell is one int64 code, oid << 32 | did, found through a hash index.
+    """
+
+    def __init__(self):
+        # location key -> id by position, renumbered when rows are dropped
+        self.locations = pd.Index([], dtype=np.int64)
+        self.codes = np.empty(0, dtype=np.int64)
+        self.okey = np.empty(0, dtype=np.int64)
+        self.dkey = np.empty(0, dtype=np.int64)
+        self.meters = np.empty(0)
+        self.seconds = np.empty(0)
+        self.expires = np.empty(0)  # monotonic seconds, inf without ttl
+        self.used = np.empty(0, dtype=np.int64)  # MemoryCache clock at last read or write
+        self._index = None
+
+    def __len__(self):
+        return len(self.codes)
+
+    def ids(self, keys, add=False) -> np.ndarray:
+        """:return: id of each location key, -1 for keys not seen unless add"""
+        ids = self.locations.get_indexer(keys)
+        if add and (ids < 0).any():
+            self.locations = self.locations.append(pd.Index(np.unique(keys[ids < 0])))
+            ids = self.locations.get_indexer(keys)
+        return ids.astype(np.int64)
+
+    def index(self) -> pd.Index:
+        if self._index is None:
+            self._index = pd.Index(self.codes)
+        return self._index
+
+    def find(self, okeys, dkeys) -> np.ndarray:
+        """:return: row of each cell, -1 where not cached"""
+        oids = self.ids(okeys)
+        dids = self.ids(dkeys)
+        known = (oids >= 0) & (dids >= 0)
+
+        pos = np.full(len(okeys), -1, dtype=np.int64)
+        pos[known] = self.index().get_indexer((oids[known] << 32) | dids[known])
+        return pos
+
+    def find_matrix(self, okeys, dkeys) -> np.ndarray:
+        """:return: rows of cached cells among okeys x dkeys"""
+        oids = self.ids(okeys)
+        dids = self.ids(dkeys)
+        oids = oids[oids >= 0]
+        dids = dids[dids >= 0]
+
+        if len(oids) * len(dids) > len(self):
+            # fewer rows than candidate cells, scan rows instead
+            return np.flatnonzero(np.isin(self.okey, okeys) & np.isin(self.dkey, dkeys))
+
+        pos = self.index().get_indexer(((oids[:, np.newaxis] << 32) | dids[np.newaxis, :]).ravel())
+        return pos[pos >= 0]
+
+    def put(self, okeys, dkeys, meters, seconds, expires, used):
+        """Overwrite cached cells, append the rest. Cells repeated in the batch keep their last row."""
+        codes = (self.ids(okeys, add=True) << 32) | self.ids(dkeys, add=True)
+        last = ~pd.Index(codes).duplicated(keep='last')
+        codes, okeys, dkeys, meters, seconds, used = (
+            x[last] for x in (codes, okeys, dkeys, meters, seconds, used))
+
+        pos = self.index().get_indexer(codes)
+        old = pos >= 0
+        at = pos[old]
+        self.meters[at] = meters[old]
+        self.seconds[at] = seconds[old]
+        self.expires[at] = expires
+        self.used[at] = used[old]
+
+        new = ~old
+        if new.any():
+            self.codes = np.concatenate((self.codes, codes[new]))
+            self.okey = np.concatenate((self.okey, okeys[new]))
+            self.dkey = np.concatenate((self.dkey, dkeys[new]))
+            self.meters = np.concatenate((self.meters, meters[new]))
+            self.seconds = np.concatenate((self.seconds, seconds[new]))
+            self.expires = np.concatenate((self.expires, np.full(new.sum(), expires)))
+            self.used = np.concatenate((self.used, used[new]))
+            self._index = None
+
+    def keep(self, mask):
+        """Drop rows outside mask, and the locations only they used."""
+        for name in ('okey', 'dkey', 'meters', 'seconds', 'expires', 'used'):
+            setattr(self, name, getattr(self, name)[mask])
+
+        self.locations = pd.Index(pd.unique(np.concatenate((self.okey, self.dkey))), dtype=np.int64)
+        self.codes = (self.ids(self.okey) << 32) | self.ids(self.dkey)
+        self._index = None
+
+
+@dataclass
+class MemoryCache:
+    """
+    In process LRU of distances keyed by provider, precision and quantized origin, destination keys.
+    Reads and writes work on whole batches of cells, recency is kept as a clock value per row.
+    """
+    max_entries: int = 1_000_000
+    max_bytes: Optional[int] = None
+    ttl: Optional[float] = None  # seconds
+
+    # (provider, precision) -> rows
+    tables: Dict[Any, DistanceTable] = field(default_factory=dict, init=False, repr=False)
+    # counts cells read or written, rows with the lowest values are least recently used
+    clock: int = field(default=0, init=False, repr=False)
+    hits: int = field(default=0, init=False)
+    misses: int = field(default=0, init=False)
+
+    def __len__(self):
+        return sum(map(len, self.tables.values()))
+
+    @property
+    def capacity(self):
+        if self.max_bytes is None:
+            return self.max_entries
+        return min(self.max_entries, self.max_bytes // ENTRY_BYTES)
+
+    def lookup(self, okeys, dkeys, provider=None, precision=PRECISION) -> pd.DataFrame:
+        """
+        :param okeys: Origin key of each cell
+        :param dkeys: Destination key of each cell
+        :return: DataFrame of okey, dkey, meters, seconds for cells found
+        """
+        table = self.tables.get((provider, precision))
+        if table is None:
+            self.misses += len(okeys)
+            return pd.DataFrame(columns=DISTANCE_COLS)
+
+        pos = table.find(okeys, dkeys)
+        return self._read(table, pos[pos >= 0], len(okeys))
+
+    async def get_distances(self, origins, destinations, provider=None, pair=False, precision=PRECISION):
+        okeys = point_keys(origins)
+        dkeys = point_keys(destinations)
+
+        if pair:
+            return self.lookup(okeys, dkeys, provider, precision)
+
+        table = self.tables.get((provider, precision))
+        if table is None:
+            self.misses += len(okeys) * len(dkeys)
+            return pd.DataFrame(columns=DISTANCE_COLS)
+
+        return self._read(table, table.find_matrix(okeys, dkeys), len(okeys) * len(dkeys))
+
+    async def get_locations(self, provider):
+        table = self.tables.get((provider, PRECISION))
+        if table is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return np.unique(table.okey), np.unique(table.dkey)
+
+    async def iter_distances(self, provider, precision=PRECISION, chunk_rows=SCAN_ROWS):
+        """
+        Unexpired rows cached at precision, scanning does not count as use.
+        """
+        table = self.tables.get((provider, precision))
+        if table is None:
+            return
+
+        # columns as of the start, writes in between are not seen
+        live = np.flatnonzero(table.expires >= time.monotonic())
+        okey, dkey, meters, seconds = table.okey, table.dkey, table.meters, table.seconds
+        for i in range(0, len(live), chunk_rows):
+            pos = live[i:i + chunk_rows]
+            yield pd.DataFrame({'okey': okey[pos], 'dkey': dkey[pos], 'meters': meters[pos], 'seconds': seconds[pos]})
+
+    async def set_distances(self, distances, provider, precision=PRECISION):
+        if distances is None or distances.empty:
+            return
+
+        table = self.tables.setdefault((provider, precision), DistanceTable())
+        expires = time.monotonic() + self.ttl if self.ttl is not None else np.inf
+        table.put(
+            distances.okey.values.astype(np.int64), distances.dkey.values.astype(np.int64),
+            distances.meters.values.astype(float), distances.seconds.values.astype(float),
+            expires, self._tick(len(distances))
+        )
+        self._evict()
+
+    def _read(self, table, pos, asked) -> pd.DataFrame:
+        expired = table.expires[pos] < time.monotonic()
+        gone = pos[expired]
+        pos = pos[~expired]
+
+        rows = self._rows(table, pos)
+        table.used[pos] = self._tick(len(pos))
+        if len(gone):
+            keep = np.ones(len(table), dtype=bool)
+            keep[gone] = False
+            table.keep(keep)
+
+        self.hits += len(rows)
+        self.misses += asked - len(rows)
+        return rows
+
+    def _rows(self, table, pos) -> pd.DataFrame:
+        return pd.DataFrame({
+            'okey': table.okey[pos], 'dkey': table.dkey[pos],
+            'meters': table.meters[pos], 'seconds': table.seconds[pos],
+        })
+
+    def _tick(self, n) -> np.ndarray:
+        used = np.arange(self.clock, self.clock + n, dtype=np.int64)
+        self.clock += n
+        return used
+
+    def _evict(self):
+        size = len(self)
+        capacity = self.capacity
+        if size <= capacity:
+            return
+
+        # evict a little extra, so a full cache is not compacted on every write
+        drop = size - capacity + int(capacity * EVICT_RATIO)
+        used = np.concatenate([t.used for t in self.tables.values()])
+        cutoff = np.partition(used, drop - 1)[drop - 1] if drop < size else used.max()
+        for table in self.tables.values():
+            table.keep(table.used > cutoff)
+
+
+@dataclass
+class TieredCache:
+    """
+    Memory tier in front of an optional persistent backend.
+    Reads go through memory first, backend rows fill memory on the way out.
+    Writes go to both.
+    """
+    memory: MemoryCache
+    backend: Any = None
+
+    async def init(self, providers=('google',)):
+        if self.backend:
+            await self.backend.init(providers)
+        return self
+
+    async def close(self):
+        if self.backend:
+            await self.backend.close()
+
+    async def get_distances(self, origins, destinations, provider=None, pair=False, precision=PRECISION):
+        hits = await self.memory.get_distances(
+            origins, destinations, provider=provider, pair=pair, precision=precision)
+        if self.backend is None:
+            return hits
+
+        okeys = point_keys(origins)
+        dkeys = point_keys(destinations)
+
+        if pair:
+            # pairs may repeat
+            missing = ~pd.MultiIndex.from_arrays([okeys, dkeys]).isin(
+                pd.MultiIndex.from_arrays([hits.okey.values, hits.dkey.values]))
+
+            if not missing.any():
+                return hits
+
+            rows = await self.backend.get_distances(
+                origins[missing], destinations[missing], provider=provider, pair=True, precision=precision
+            )
+        else:
+            missing = np.ones((len(okeys), len(dkeys)), dtype=bool)
+            codes = lookup_cells(okeys, dkeys, hits.okey.values, hits.dkey.values)
+            missing.ravel()[codes[codes >= 0]] = False
+
+            if not missing.any():
+                return hits
+
+            # rectangle around missing cells, may refetch a few memory hits
+            rows = await self.backend.get_distances(
+                origins[missing.any(axis=1)], destinations[missing.any(axis=0)], provider=provider,
+                precision=precision
+            )
+
+        await self.memory.set_distances(rows, provider, precision)
+
+        distances = pd.concat([hits, rows], ignore_index=True)
+        return distances[~distances.duplicated(['okey', 'dkey'], keep='last')]
+
+    async def get_locations(self, provider):
+        # memory only holds a subset of backend rows
+        return await (self.backend or self.memory).get_locations(provider)
+
+    async def iter_distances(self, provider, precision=PRECISION, chunk_rows=SCAN_ROWS):
+        async for rows in (self.backend or self.memory).iter_distances(provider, precision, chunk_rows):
+            yield rows
+
+    async def set_distances(self, distances, provider, precision=PRECISION):
+        await self.memory.set_distances(distances, provider, precision)
+
+        if self.backend:
+            await self.backend.set_distances(distances, provider, precision)
+
+
+def select_distances(distances, origins, destinations, pair=False):
+    """Rows of distances frame covering the requested origins x destinations, or pairs."""
+    okeys = point_keys(origins)
+    dkeys = point_keys(destinations)
+
+    if pair:
+        mask = pd.MultiIndex.from_arrays([distances.okey.values, distances.dkey.values]).isin(
+            pd.MultiIndex.from_arrays([okeys, dkeys]))
+    else:
+        mask = distances.okey.isin(okeys).values & distances.dkey.isin(dkeys).values
+
+    return distances[mask]
+
+
+@dataclass
+class WriteBehindMetrics:
+    enqueued_rows: int = 0
+    flushed_rows: int = 0
+    flushed_batches: int = 0
+    failed_rows: int = 0
+    failed_batches: int = 0
+    # rows given up on after max_attempts failed writes
+    dropped_rows: int = 0
+    backpressure_waits: int = 0
+    last_error: Optional[BaseException] = None
+
+
+@dataclass
+class WriteBehindCache:
+    """
+    Queues writes in memory and persists them to backend in large batches from a background task.
+    Flushes when batch_rows are pending or flush_interval seconds pass, whichever first.
+    Writers wait once max_pending_rows are queued. Queued rows are still visible to reads.
+    A failed batch is queued again and retried a flush_interval later, rows are dropped after max_attempts.
+    """
+    backend: Any
+    batch_rows: int = 50_000
+    flush_interval: float = 5.0  # seconds
+    max_pending_rows: int = 1_000_000
+    max_attempts: int = 5
+
+    # queued frames per (provider, precision)
+    pending: Dict[Any, List[pd.DataFrame]] = field(default_factory=dict, init=False, repr=False)
+    pending_rows: int = field(default=0, init=False)
+    # batches handed to backend but not yet committed
+    flushing: Dict[Any, List[pd.DataFrame]] = field(default_factory=dict, init=False, repr=False)
+    # failed writes in a row per (provider, precision)
+    attempts: Dict[Any, int] = field(default_factory=dict, init=False, repr=False)
+    metrics: WriteBehindMetrics = field(default_factory=WriteBehindMetrics, init=False)
+
+    _worker: Any = field(default=None, init=False, repr=False)
+    _worker_loop: Any = field(default=None, init=False, repr=False)
+    _wake: Any = field(default=None, init=False, repr=False)
+    _drained: Any = field(default=None, init=False, repr=False)
+
+    async def init(self, providers=('google',)):
+        await self.backend.init(providers)
+        return self
+
+    async def get_distances(self, origins, destinations, provider=None, pair=False, precision=PRECISION):
+        rows = await self.backend.get_distances(
+            origins, destinations, provider=provider, pair=pair, precision=precision)
+
+        space = (provider, precision)
+        queued = self.flushing.get(space, []) + self.pending.get(space, [])
+        if not queued:
+            return rows
+
+        queued = select_distances(pd.concat(queued, ignore_index=True), origins, destinations, pair)
+        rows = pd.concat([rows, queued], ignore_index=True)
+        return rows[~rows.duplicated(['okey', 'dkey'], keep='last')]
+
+    async def get_locations(self, provider):
+        okeys, dkeys = await self.backend.get_locations(provider)
+
+        space = (provider, PRECISION)
+        queued = self.flushing.get(space, []) + self.pending.get(space, [])
+        if not queued:
+            return okeys, dkeys
+
+        queued = pd.concat(queued, ignore_index=True)
+        return np.union1d(okeys, queued.okey.values), np.union1d(dkeys, queued.dkey.values)
+
+    async def iter_distances(self, provider, precision=PRECISION, chunk_rows=SCAN_ROWS):
+        """
+        Queued rows first, then backend rows not queued again.
+        """
+        space = (provider, precision)
+        queued = self.flushing.get(space, []) + self.pending.get(space, [])
+        keys = None
+        if queued:
+            queued = pd.concat(queued, ignore_index=True)
+            queued = queued[~queued.duplicated(['okey', 'dkey'], keep='last')]
+            keys = pd.MultiIndex.from_arrays([queued.okey.values, queued.dkey.values])
+            for i in range(0, len(queued), chunk_rows):
+                yield queued.iloc[i:i + chunk_rows]
+
+        async for rows in self.backend.iter_distances(provider, precision, chunk_rows):
+            if keys is not None:
+                rows = rows[~pd.MultiIndex.from_arrays([rows.okey.values, rows.dkey.values]).isin(keys)]
+            if len(rows):
+                yield rows
+
+    async def set_distances(self, distances, provider, precision=PRECISION):
+        if distances is None or distances.empty:
+            return
+
+        self._ensure_worker()
+
+        while self.pending_rows >= self.max_pending_rows:
+            self.metrics.backpressure_waits += 1
+            self._drained.clear()
+            self._wake.set()
+            await self._drained.wait()
+
+        self.pending.setdefault((provider, precision), []).append(distances[DISTANCE_COLS])
+        self.pending_rows += len(distances)
+        self.metrics.enqueued_rows += len(distances)
+
+        if self.pending_rows >= self.batch_rows:
+            self._wake.set()
+
+    async def flush(self) -> bool:
+        """:return: whether every batch was persisted"""
+        batches, self.pending, self.pending_rows = self.pending, {}, 0
+        ok = True
+
+        for space, frames in batches.items():
+            provider, precision = space
+            batch = pd.concat(frames, ignore_index=True)
+            batch = batch[~batch.duplicated(['okey', 'dkey'], keep='last')]
+
+            self.flushing.setdefault(space, []).append(batch)
+            try:
+                await self.backend.set_distances(batch, provider, precision)
+            except Exception as err:
+                logger.exception(f'write behind flush of {len(batch)} rows to distances_{provider} failed')
+                ok = False
+                self.metrics.failed_batches += 1
+                self.metrics.failed_rows += len(batch)
+                self.metrics.last_error = err
+                self._requeue(space, batch)
+            else:
+                self.attempts.pop(space, None)
+                self.metrics.flushed_batches += 1
+                self.metrics.flushed_rows += len(batch)
+            finally:
+                self.flushing[space].remove(batch)
+
+        if self._drained is not None:
+            self._drained.set()
+        return ok
+
+    def _requeue(self, space, batch):
+        attempts = self.attempts[space] = self.attempts.get(space, 0) + 1
+        if attempts >= self.max_attempts:
+            logger.error(f'dropping {len(batch)} rows for distances_{space[0]} after {attempts} failed writes')
+            self.attempts.pop(space)
+            self.metrics.dropped_rows += len(batch)
+            return
+
+        # ahead of rows queued since, newer rows win the dedup on the next flush
+        self.pending.setdefault(space, []).insert(0, batch)
+        self.pending_rows += len(batch)
+
+    async def close(self):
+        """Stop background task, persist everything still queued, close backend."""
+        if self._worker is not None and self._worker_loop is asyncio.get_running_loop():
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        self._worker = None
+
+        if not await self.flush():
+            logger.error(f'{self.pending_rows} rows not persisted on close')
+            self.metrics.dropped_rows += self.pending_rows
+            self.pending, self.pending_rows = {}, 0
+        await self.backend.close()
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self._worker is not None and self._worker_loop is loop and not self._worker.done():
+            return
+
+        self._wake = asyncio.Event()
+        self._drained = asyncio.Event()
+        self._worker_loop = loop
+        self._worker = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        flushing = None
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+
+                if self.pending_rows:
+                    # shielded so cancellation never drops a batch mid copy
+                    flushing = asyncio.ensure_future(self.flush())
+                    if not await asyncio.shield(flushing):
+                        # backend is down, give it a flush_interval before retrying
+                        await asyncio.sleep(self.flush_interval)
+        except asyncio.CancelledError:
+            # loop is shutting down, last chance to persist
+            if flushing is not None and not flushing.done():
+                await flushing
+            if self.pending_rows:
+                await self.flush()
+            raise
+
+
+def dump_geocode_results(results: List[m.geocoding.Result]) -> str:
+    return ujson.dumps([
+        {
+            'address': dataclasses.asdict(r.address),
+            'point': None if r.point is None else list(r.point),
+            'confidence': r.confidence.name,
+            'precision': r.precision.name,
+        }
+        for r in results
+    ])
+
+
+def load_geocode_results(text: str) -> List[m.geocoding.Result]:
+    return marshall_to(List[m.geocoding.Result], ujson.loads(text))
+
+
+@dataclass
+class GeocodeCache:
+    """
+    Geocode results by provider and geocode key, see geode.address.geocode_key.
+    LRU in memory in front of an optional persistent backend sharing the distance cache database.
+    Lookups without results are cached too, for the shorter negative_ttl.
+    """
+    backend: Any = None
+    max_entries: int = 100_000
+    ttl: Optional[float] = 30 * 86400  # seconds
+    negative_ttl: Optional[float] = 86400  # seconds
+
+    # expiry is wall clock, entries keep it across processes through the backend
+    entries: OrderedDict = field(default_factory=OrderedDict, init=False, repr=False)
+    hits: int = field(default=0, init=False)
+    misses: int = field(default=0, init=False)
+
+    async def get(self, keys, provider=None) -> Dict[str, List[m.geocoding.Result]]:
+        """
+        :return: cached results of keys found, empty list for known misses
+        """
+        now = time.time()
+        found = {}
+        for key in keys:
+            entry = self.entries.get((provider, key))
+            if entry is None:
+                continue
+            results, expires = entry
+            if expires is not None and expires <= now:
+                del self.entries[provider, key]
+                continue
+            self.entries.move_to_end((provider, key))
+            found[key] = results
+
+        missing = [k for k in dict.fromkeys(keys) if k not in found]
+        if missing and self.backend is not None:
+            rows = await self.backend.get_geocodes(missing, provider)
+            loaded = {key: (load_geocode_results(text), expires) for key, text, expires in rows}
+            self._put(loaded, provider)
+            found.update({key: results for key, (results, _) in loaded.items()})
+
+        self.hits += sum(k in found for k in keys)
+        self.misses += sum(k not in found for k in keys)
+        return found
+
+    async def set(self, results: Dict[str, List[m.geocoding.Result]], provider=None):
+        """
+        :param results: Provider results by key, empty list when it found nothing
+        """
+        if not results:
+            return
+
+        now = time.time()
+        entries = {}
+        for key, res in results.items():
+            ttl = self.ttl if res else self.negative_ttl
+            entries[key] = (list(res), None if ttl is None else now + ttl)
+        self._put(entries, provider)
+
+        if self.backend is not None:
+            await self.backend.set_geocodes(
+                [(key, dump_geocode_results(res), expires) for key, (res, expires) in entries.items()],
+                provider
+            )
+
+    def _put(self, entries, provider):
+        for key, entry in entries.items():
+            self.entries[provider, key] = entry
+            self.entries.move_to_end((provider, key))
+
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+def persistent_cache(cache):
+    """Innermost backend under memory and write behind tiers, None without one."""
+    while isinstance(cache, (TieredCache, WriteBehindCache)):
+        cache = cache.backend
+    return cache
+
+
+CACHE_TYPE_MAP = {
+    'postgres': PostgresCache,
+    'sqlite': SqliteCache,
+}
+
+
+def create_cache(opts):
+    """
+    Cache from the caching config block.
+    type_ picks the backend, postgres by default, sqlite for a local file.
+    memory sub-block adds an LRU tier, write_behind sub-block moves backend writes off the critical path.
+    geocode sub-block is read by create_geocode_cache.
+    caching:
+      host: ...
+      memory:
+        max_entries: 1000000
+        ttl: 3600
+      write_behind:
+        batch_rows: 50000
+        flush_interval: 5
+    """
+    opts = dict(opts)
+    opts.pop('geocode', None)
+    memory = opts.pop('memory', None)
+    write_behind = opts.pop('write_behind', None)
+    type_ = opts.pop('type_', 'postgres')
+
+    backend = CACHE_TYPE_MAP[type_](**opts) if opts or type_ != 'postgres' else None
+
+    if backend is not None and write_behind is not None:
+        backend = WriteBehindCache(backend, **write_behind)
+
+    if memory is not None:
+        return TieredCache(MemoryCache(**memory), backend)
+
+    return backend
+
+
+def create_geocode_cache(opts, cache=None):
+    """
+    Geocode cache from the geocode sub-block of the caching config, None without one.
+    Persists to the database of the distance cache when there is one.
+    caching:
+      geocode:
+        max_entries: 100000
+        ttl: 2592000
+        negative_ttl: 86400
+    """
+    if 'geocode' not in opts:
+        return None
+    return GeocodeCache(persistent_cache(cache), **(opts['geocode'] or {}))
@@ -1,20 +1,34 @@
 import aiohttp
 import asyncio
+import logging
 import os
+import threading
+import warnings
 import numpy as np
 import pandas as pd
 import ujson
-from concurrent.futures import ThreadPoolExecutor
-from scipy import spatial
-from typing import Dict, Any
+from typing import Dict, Any, Iterator
 
-from geode import google, dist_metrics
+import geode.models as m
+from geode import google, smarty, dist_metrics
 from geode.config import yaml
-from geode.cache import PostgresCache
-from geode.utils import create_dist_index, grouper, KEY_COLS, first_or_none
+from geode.address import DedupMetrics, dedup_locations, geocode_key
+from geode.cache import create_cache, create_geocode_cache
+from geode.estimator import Estimator
+from geode.planner import CostModel, plan_cells
+from geode.reverse_index import ReverseIndex
+from geode.singleflight import SingleFlight
+from geode.spatial import NO_KEY, SnapIndex
+from geode.utils import (
+    PRECISION, cell_codes, cell_positions, grouper, key_points, lookup_cells, point_keys, split_cells,
+    unique_points, first_or_none
+)
+
+logger = logging.getLogger()
 
 TYPE_MAP = {
     'google': google,
+    'smarty': smarty,
     # 'alk': alk,
     # 'bing': bing
 }
@@ -24,9 +38,34 @@ MAX_METERS = 500000
 MIN_METERS = 100
 MAX_REQUESTS = 20
 
+# straight line metric used for fallback estimates, see dist_metrics.METRICS
+ESTIMATOR = 'gc_manhattan'
+
+# default cells per block when streaming a matrix
+TILE_CELLS = 2 ** 20
+
 CLIENT_TIMEOUT = 20
 
-VEC_DIST = np.vectorize(spatial.distance.euclidean)
+# resolved hosts are kept this long by the dispatcher session
+DNS_CACHE_SECONDS = 300
+
+
+def _ignore_session(session):
+    if session is not None:
+        warnings.warn(
+            'session is deprecated and ignored, provider requests run on the dispatcher session, '
+            'close the dispatcher when done', DeprecationWarning, stacklevel=3
+        )
+
+
+def origin_tiles(olen, dlen, tile_size=None):
+    """
+    :param tile_size: Origins per tile, defaults to fit TILE_CELLS
+    :return: slices over origins
+    """
+    tile_size = tile_size or max(1, TILE_CELLS // max(dlen, 1))
+    return [slice(i, i + tile_size) for i in range(0, olen, tile_size)]
+
 
 class AsyncDispatcher:
     """
@@ -36,13 +75,29 @@ class AsyncDispatcher:
     - Rate limiting
     - Cache logic
     - High level fallback logic
+
+    Provider requests run on the dispatcher's own http session, since concurrent calls share them
+    and the call that started one may be gone before it finishes. Close the dispatcher, or use it
+    as an async context manager, to release it. Session arguments of the public calls are deprecated
+    and ignored, only the request level methods like distance_rows take one.
     """
     cache = None
-    cache_conn = None
+    geocode_cache = None
+    reverse_index = None
+    snapping = None
+    precision_tiers = None
+    estimator = None
     providers: Dict[str, Any] = {}
     semaphore = None
+    session = None
 
     def __init__(self, config=None):
+        self.providers = {}
+        # provider requests in flight, shared by concurrent calls asking for the same cells or addresses
+        self.flights = SingleFlight()
+        # batch_geocode inputs that turned out to be spellings of another address
+        self.geocode_dedup = DedupMetrics()
+
         # load default configs from home path config
         if not config:
             home = os.path.expanduser('~')
@@ -59,92 +114,224 @@ class AsyncDispatcher:
 
         # initialize cache
         if 'caching' in config:
-            self.cache = PostgresCache(**config['caching'])
+            self.cache = create_cache(config['caching'])
+            self.geocode_cache = create_geocode_cache(config['caching'], self.cache)
+
+        # cached locations answering for cells of nearby points, needs a cache
+        if 'snapping' in config:
+            self.snapping = SnapIndex(**(config['snapping'] or {}))
+
+        # long cells cached at fewer decimals, needs a cache
+        if 'precision_tiers' in config:
+            self.precision_tiers = dist_metrics.PrecisionTiers(**(config['precision_tiers'] or {}))
+
+        # distances fit from cached results, replaces straight line estimates
+        if 'estimator' in config:
+            self.estimator = Estimator(**(config['estimator'] or {}))
+
+        # known addresses answering reverse geocodes of nearby points
+        if 'reverse_index' in config:
+            self.reverse_index = ReverseIndex(**(config['reverse_index'] or {}))
+
+        # weights for laying out provider requests, see geode.planner
+        self.cost_model = CostModel(**(config.get('planner') or {}))
 
     @classmethod
     async def init(cls, config=None):
         instance = cls(config)
         if instance.cache:
-            instance.cache_conn = await instance.cache.connection()
+            # pool and tables are set up once, shared by all calls on this dispatcher
+            await instance.cache.init(providers=list(instance.providers) or ['google'])
         return instance
 
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+        if self.cache:
+            await self.cache.close()
+        if self.reverse_index is not None and self.reverse_index.path:
+            self.reverse_index.save()
+
+    async def get_session(self):
+        # made on the loop it is used from
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                json_serialize=ujson.dumps,
+                timeout=aiohttp.ClientTimeout(total=CLIENT_TIMEOUT),
+                connector=aiohttp.TCPConnector(ttl_dns_cache=DNS_CACHE_SECONDS)
+            )
+        return self.session
+
     async def geocode(self, address, sem=None, session=None, provider=None):
+        _ignore_session(session)
         sem = sem or asyncio.BoundedSemaphore(MAX_REQUESTS)
 
-        return await self.throttled_geocode(address, sem, session=session, provider=provider)
+        return await self.throttled_geocode(address, sem, provider=provider)
 
-    async def throttled_geocode(self, address, sem, session=None, provider=None):
-        client = self.providers.get(provider)
+    async def throttled_geocode(self, address, sem, provider=None):
+        key = geocode_key(address)
+        return (await self.resolve_geocodes({key: address}, sem, provider=provider))[key] or []
 
-        async with sem:
-            return await client.geocode(address, session=session)
+    async def resolve_geocodes(self, locations, sem, provider=None):
+        """
+        Results from the geocode cache, then the reverse index for points, then the provider.
+        :param locations: Location by geocode key
+        :return: results by key, None where the provider failed
+        """
+        # one cache round trip for all keys, one write for what was fetched
+        found = await self.geocode_cache.get(list(locations), provider) if self.geocode_cache else {}
 
-    async def batch_geocode(self, locations, sem=None, session=None, provider=None):
-        sem = sem or asyncio.BoundedSemaphore(MAX_REQUESTS)
-        # TODO: check here if client has batch
-        return list(map(first_or_none, await asyncio.gather(*[
-            self.throttled_geocode(loc, sem, session=session, provider=provider)
-            for loc in locations]
-        )))
+        if self.reverse_index is not None:
+            points = {k: loc for k, loc in locations.items() if k not in found and not isinstance(loc, str)}
+            if points:
+                nearby = self.reverse_index.lookup(list(points.values()))
+                found.update({k: [r] for k, r in zip(points, nearby) if r is not None})
 
-    async def distance_matrix(self, origins, destinations, max_meters=MAX_METERS, sem=None, session=None, provider=None, return_inverse=False):
-        sem = sem or asyncio.BoundedSemaphore(MAX_REQUESTS)
+        missing = {k: loc for k, loc in locations.items() if k not in found}
+        if not missing:
+            return found
 
-        # prepare parameters and indices
-        origins, oinv = np.unique(origins.round(4), axis=0, return_inverse=True)
-        destinations, dinv = np.unique(destinations.round(4), axis=0, return_inverse=True)
+        fetched = await self.fetch_geocodes(missing, sem, provider=provider)
+        if self.geocode_cache:
+            await self.geocode_cache.set({k: v for k, v in fetched.items() if v is not None}, provider)
+        if self.reverse_index is not None:
+            self.reverse_index.add([r for res in fetched.values() if res for r in res])
 
-        idx = create_dist_index(origins, destinations)
+        return {**found, **fetched}
 
-        # kick off cache request
-        if self.cache:
-            cache_future = asyncio.ensure_future(
-                self.cache.get_distances(
-                    origins, destinations, provider=provider
-                )
-            )
+    async def fetch_geocodes(self, locations, sem, provider=None):
+        """
+        Provider results, shared with concurrent requests for the same keys.
+        :param locations: Location by geocode key
+        :return: results by key, None where the provider failed so the miss is not cached
+        """
+        keys = list(locations)
+        flight_keys = [('geocode', provider, key) for key in keys]
+
+        free, flights = self.flights.split(flight_keys)
+        if free:
+            flights.append(self.flights.launch(
+                [flight_keys[i] for i in free],
+                self.request_geocodes(
+                    {keys[i]: locations[keys[i]] for i in free}, sem, session=await self.get_session(), provider=provider)
+            ))
+
+        results = {}
+        for fetched in await asyncio.gather(*[asyncio.shield(f) for f in flights]):
+            results.update(fetched)
+        return {key: results.get(key) for key in keys}
+
+    async def request_geocodes(self, locations, sem, session=None, provider=None):
+        """
+        Results by key, in batches of client.batch_max for providers that take several addresses per request.
+        """
+        client = self.providers.get(provider)
+        keys = list(locations)
 
-        estimates = spatial.distance.cdist(
-            np.radians(origins),
-            np.radians(destinations)
-        ) * dist_metrics.R_EARTH
+        if hasattr(client, 'batch_geocode'):
+            chunks = [keys[i:i + client.batch_max] for i in range(0, len(keys), client.batch_max)]
+        else:
+            chunks = [[key] for key in keys]
+
+        async def fetch(chunk):
+            async with sem:
+                try:
+                    if hasattr(client, 'batch_geocode'):
+                        results = await client.batch_geocode([locations[k] for k in chunk], session=session)
+                    else:
+                        results = [await client.geocode(locations[chunk[0]], session=session)]
+                except m.geocoding.GeocodeError as err:
+                    logger.warning('geocode of %d locations failed: %s', len(chunk), err)
+                    results = [None] * len(chunk)
+            return dict(zip(chunk, results))
+
+        fetched = {}
+        for res in await asyncio.gather(*map(fetch, chunks)):
+            fetched.update(res)
+        return fetched
 
-        estimate_df = pd.DataFrame(estimates.ravel(), columns=['meters'], index=idx.index)
-        estimate_df['seconds'] = estimate_df.meters / 30
-        estimate_df['source'] = 'gc_manhattan'
+    async def batch_geocode(self, locations, sem=None, session=None, provider=None):
+        """
+        Geocode each distinct address once, see geode.address.canonical_address.
+        :return: first result or None, for each location
+        """
+        _ignore_session(session)
+        sem = sem or asyncio.BoundedSemaphore(MAX_REQUESTS)
+        keys, unique, inverse = dedup_locations(locations)
 
-        out_of_range = estimate_df.index[(estimate_df.meters > max_meters) | (estimate_df.meters < MIN_METERS)]
+        self.geocode_dedup.requested += len(locations)
+        self.geocode_dedup.unique += len(keys)
+        logger.info('geocoding %d locations as %d distinct (%.1f%% deduped)',
+                    len(locations), len(keys), 100 * (1 - len(keys) / max(len(locations), 1)))
 
-        # wait on cache request
-        if self.cache:
-            cache_df = await cache_future
-            cache_df['source'] = 'google'
+        results = await self.resolve_geocodes(dict(zip(keys, unique)), sem, provider=provider)
+        firsts = [first_or_none(results[key] or []) for key in keys]
+        return [firsts[i] for i in inverse]
 
-            missing = pd.DataFrame(
-                index=idx.index.difference(out_of_range).difference(cache_df.index)
-            )
-        else:
-            missing = pd.DataFrame(
-                index=idx.index.difference(out_of_range)
-            )
+    async def distance_matrix(self, origins, destinations, max_meters=MAX_METERS, sem=None, session=None, provider=None, return_inverse=False, estimator=ESTIMATOR, as_frame=True, store=None):
+        """
+        :param store: geode.matrix_store.MatrixStore to read known cells from, and write fetched cells to if opened writable
+        """
+        _ignore_session(session)
+        sem = sem or asyncio.BoundedSemaphore(MAX_REQUESTS)
 
-        res_df = await self.distance_rows(missing, sem, session=session, provider=provider)
+        # prepare parameters and indices
+        origins, _, oinv = unique_points(origins)
+        destinations, _, dinv = unique_points(destinations)
 
-        if self.cache:
-            await self.cache.set_distances(
-                origins, destinations, res_df, provider=provider
-            )
+        # full cross product, cell code is its own position
+        cells = np.arange(len(origins) * len(destinations), dtype=np.int64)
 
-            merged_df = pd.concat([estimate_df, cache_df, res_df], sort=False)
-        else:
-            merged_df = pd.concat([estimate_df, res_df], sort=False)
+        res = await self.distance_cells(
+            origins, destinations, cells, max_meters=max_meters, sem=sem,
+            provider=provider, estimator=estimator, store=store
+        )
 
-        merged_df = merged_df[~merged_df.index.duplicated(keep='last')].reindex(index=idx.index, copy=False)
+        if as_frame:
+            res = res.to_frame()
 
         if return_inverse:
-            return merged_df, oinv.reshape(oinv.size, -1) * np.size(destinations, 0) + dinv
+            return res, cell_codes(oinv.reshape(oinv.size, -1), dinv.ravel(), len(destinations))
 
-        return merged_df
+        return res
+
+    async def distance_matrix_stream(self, origins, destinations, tile_size=None, max_meters=MAX_METERS, sem=None, session=None, provider=None, estimator=ESTIMATOR, as_frame=True, store=None):
+        """
+        Same as distance_matrix but yields finished blocks of origin tiles x all destinations,
+        each block does its own estimates, cache lookup, provider requests and cache write.
+        The next block is fetched while the caller works on the current one,
+        memory is bound by tile size instead of full matrix size.
+        """
+        _ignore_session(session)
+        sem = sem or asyncio.BoundedSemaphore(MAX_REQUESTS)
+
+        origins, _, _ = unique_points(origins)
+        destinations, _, _ = unique_points(destinations)
+
+        def fetch(tile):
+            return asyncio.ensure_future(self.distance_matrix(
+                origins[tile], destinations, max_meters=max_meters, sem=sem,
+                provider=provider, estimator=estimator, as_frame=as_frame, store=store
+            ))
+
+        tiles = origin_tiles(len(origins), len(destinations), tile_size)
+        pending = fetch(tiles[0]) if tiles else None
+        try:
+            for i in range(len(tiles)):
+                res = await pending
+                pending = fetch(tiles[i + 1]) if i + 1 < len(tiles) else None
+                yield res
+        finally:
+            # consumer stopped early
+            if pending is not None:
+                pending.cancel()
 
     async def throttled_distance_matrix(self, origins, destinations, sem, session=None, provider=None):
         client = self.providers.get(provider)
@@ -152,51 +339,307 @@ class AsyncDispatcher:
         async with sem:
             return await client.distance_matrix(origins, destinations, session=session)
 
-    async def distance_rows(self, missing, sem, session=None, provider=None):
-        odim = [0, 1]
-        ddim = [2, 3]
-        ogroups = missing.groupby(level=odim, sort=False)
-        dgroups = missing.groupby(level=ddim, sort=False)
-
-        if ogroups.ngroups <= dgroups.ngroups:
-            # fewer origins, iterate origin-major
-            idx = ogroups
-            res = await asyncio.gather(*[
-                self.throttled_distance_matrix(
-                    origins=[o],
-                    destinations=ds.index.to_frame(index=False).values[:, ddim],
-                    sem=sem,
-                    session=session,
-                    provider=provider
-                ) for o, ds in idx
-            ])
+    async def billed_rows(self, origins, destinations, missing, sem, session=None, provider=None) -> pd.DataFrame:
+        """
+        Query provider for missing cells, in blocks laid out by geode.planner.
+        Blocks may cover cells that were not asked for, their answers are paid for and returned too.
+        :param missing: Cell codes into origins x destinations
+        :return: distances of every cell fetched, indexed by cell code, sorted
+        """
+        client = self.providers.get(provider)
+        if client is None:
+            raise ValueError(f'unknown provider {provider!r}, expected one of {list(self.providers)}')
+        dlen = len(destinations)
+
+        plan = plan_cells(missing, dlen, client.area_max, client.factor_max, self.cost_model)
+        logger.debug(
+            f'{len(missing)} cells in {len(plan.blocks)} blocks, '
+            f'{plan.elements} elements over {plan.requests} requests, waste {plan.waste:.1%}'
+        )
+
+        res = await asyncio.gather(*[
+            self.throttled_distance_matrix(
+                origins=origins[oidx],
+                destinations=destinations[didx],
+                sem=sem,
+                session=session,
+                provider=provider
+            ) for oidx, didx in plan.blocks
+        ])
+
+        blocks = [(b, r) for b, r in zip(plan.blocks, res) if len(r.distances)]
+        if not blocks:
+            return pd.DataFrame(columns=['meters', 'seconds'], index=pd.Index([], dtype=np.int64, name='cell'))
+
+        codes = np.concatenate([cell_codes(oidx[:, None], didx[None, :], dlen).ravel() for (oidx, didx), _ in blocks])
+        distances = np.concatenate([r.distances.ravel() for _, r in blocks])
+
+        codes, first = np.unique(codes, return_index=True)
+        return pd.DataFrame.from_records(distances[first], index=pd.Index(codes, name='cell'))
+
+    async def distance_rows(self, origins, destinations, missing, sem, session=None, provider=None) -> pd.DataFrame:
+        """
+        Query provider for missing cells, see billed_rows.
+        :param missing: Cell codes into origins x destinations
+        :return: distances of missing cells indexed by cell code, sorted
+        """
+        res_df = await self.billed_rows(origins, destinations, missing, sem, session=session, provider=provider)
+        return res_df[np.isin(res_df.index.values, missing)]
+
+    async def fetch_cells(self, origins, destinations, missing, sem, session=None, provider=None) -> pd.DataFrame:
+        """
+        Query provider for missing cells and write them to cache, with the extra cells their blocks covered.
+        :return: distances of missing cells with okey, dkey columns, so callers with other location arrays can pick their cells
+        """
+        res_df = await self.billed_rows(origins, destinations, missing, sem, session=session, provider=provider)
+        oidx, didx = split_cells(res_df.index.values, len(destinations))
+
+        fetched = pd.DataFrame({
+            'okey': point_keys(origins)[oidx],
+            'dkey': point_keys(destinations)[didx],
+            'meters': res_df.meters.values,
+            'seconds': res_df.seconds.values,
+            'precision': PRECISION,
+        })
+
+        if self.precision_tiers is not None:
+            fetched['precision'] = self.precision_tiers.precision(origins[oidx], destinations[didx])
+
+        if self.cache:
+            # failed elements come back nan, leave them to be retried
+            ok = fetched.meters.notna().values
+            for precision in np.unique(fetched.precision.values[ok]).tolist():
+                tier = ok & (fetched.precision.values == precision)
+                rows = fetched[tier]
+                if precision != PRECISION:
+                    # long cells are cached under their locations rounded to the tier
+                    rows = rows.assign(
+                        okey=point_keys(np.round(origins[oidx[tier]], precision)),
+                        dkey=point_keys(np.round(destinations[didx[tier]], precision)),
+                    ).drop_duplicates(['okey', 'dkey'])
+                await self.cache.set_distances(rows, provider=provider, precision=precision)
+
+        # extra cells are cached only, callers may have their own answer for them
+        return fetched[np.isin(res_df.index.values, missing)]
+
+    async def distance_cells(self, origins, destinations, cells, max_meters=MAX_METERS, sem=None, provider=None, estimator=ESTIMATOR, store=None) -> m.distance_matrix.Cells:
+        """
+        Fill cells from estimates, matrix store, cache and provider.
+        With an estimator configured, only cells it is not confident about are looked up.
+        :param origins: Unique quantized origins
+        :param destinations: Unique quantized destinations
+        :param cells: Sorted unique cell codes into origins x destinations
+        :param store: Optional geode.matrix_store.MatrixStore
+        """
+        sem = sem or asyncio.BoundedSemaphore(MAX_REQUESTS)
+        dlen = len(destinations)
+        oidx, didx = split_cells(cells, dlen)
+        full = len(cells) == len(origins) * dlen
+
+        okeys = point_keys(origins)
+        dkeys = point_keys(destinations)
+
+        stored = np.zeros(len(cells), dtype=bool)
+        if store is not None:
+            store_meters, store_seconds = store.get_cells(origins, destinations, oidx, didx)
+            stored = ~np.isnan(store_meters)
+
+        # kick off cache request, not needed when store has every cell
+        use_cache = self.cache and not stored.all()
+        if use_cache:
+            if full:
+                cache_future = asyncio.ensure_future(
+                    self.cache.get_distances(
+                        origins, destinations, provider=provider
+                    )
+                )
+            else:
+                cache_future = asyncio.ensure_future(
+                    self.cache.get_distances(
+                        origins[oidx], destinations[didx], provider=provider, pair=True
+                    )
+                )
+
+        if self.estimator is not None:
+            if full:
+                meters, seconds, confidence = (x.ravel() for x in self.estimator.matrix(origins, destinations))
+            else:
+                meters, seconds, confidence = self.estimator.pairwise(origins[oidx], destinations[didx])
+            estimator = 'estimator'
         else:
-            # fewer destinations, iterate destination-major
-            idx = dgroups
-            res = await asyncio.gather(*[
-                self.throttled_distance_matrix(
-                    origins=ds.index.to_frame(index=False).values[:, odim],
-                    destinations=[o],
-                    sem=sem,
-                    session=session,
-                    provider=provider
-                ) for o, ds in idx
-            ])
-
-        res_df = None
-        res_flat = [row.distances.ravel() for row in res if len(row.distances)]
-        if res_flat:
-            res_df = pd.DataFrame.from_records(
-                np.concatenate(res_flat),
-                # make new index by flat iterate through the groupby index
-                index=pd.MultiIndex.from_tuples((d for _, ds in idx for d in ds.index), names=missing.index.names)
+            if full:
+                meters = dist_metrics.matrix(estimator, origins, destinations).ravel()
+            else:
+                meters = dist_metrics.pairwise(estimator, origins[oidx], destinations[didx])
+            seconds = meters / 30
+            confidence = None
+
+        source = np.zeros(len(cells), dtype=np.int8)
+
+        todo = (meters <= max_meters) & (meters >= MIN_METERS)
+        if confidence is not None:
+            # confident estimates stand in for provider answers
+            todo &= confidence < self.estimator.min_confidence
+
+        if store is not None:
+            meters[stored] = store_meters[stored]
+            seconds[stored] = store_seconds[stored]
+            source[stored] = 1
+            todo[stored] = False
+
+        # wait on cache request
+        if use_cache:
+            cache_df = await cache_future
+            pos, found = cell_positions(cells, lookup_cells(okeys, dkeys, cache_df.okey.values, cache_df.dkey.values))
+            pos = pos[found]
+
+            meters[pos] = cache_df.meters.values[found]
+            seconds[pos] = cache_df.seconds.values[found]
+            source[pos] = 1
+            todo[pos] = False
+
+        # cells answered with distances of other locations, the store keeps exact ones
+        borrowed = np.zeros(len(cells), dtype=bool)
+
+        if self.precision_tiers is not None and self.cache and todo.any():
+            pos, tier_meters, tier_seconds = await self.tier_cells(
+                origins, destinations, cells[todo], provider=provider)
+            pos = np.flatnonzero(todo)[pos]
+
+            meters[pos] = tier_meters
+            seconds[pos] = tier_seconds
+            source[pos] = 1
+            borrowed[pos] = True
+            todo[pos] = False
+
+        snapped = None
+        if self.snapping is not None and self.cache:
+            snapped = np.zeros(len(cells), dtype=bool)
+            if todo.any():
+                pos, snap_meters, snap_seconds = await self.snap_cells(
+                    origins, destinations, cells[todo], provider=provider)
+                pos = np.flatnonzero(todo)[pos]
+
+                meters[pos] = snap_meters
+                seconds[pos] = snap_seconds
+                source[pos] = 1
+                snapped[pos] = True
+                borrowed[pos] = True
+                todo[pos] = False
+
+        # cells other calls are already fetching are awaited, the rest fetched here
+        missing = cells[todo]
+        moidx, mdidx = split_cells(missing, dlen)
+        flight_keys = [('distance', provider, o, d) for o, d in zip(okeys[moidx].tolist(), dkeys[mdidx].tolist())]
+
+        free, flights = self.flights.split(flight_keys)
+        if free:
+            flights.append(self.flights.launch(
+                [flight_keys[i] for i in free],
+                self.fetch_cells(origins, destinations, missing[free], sem, session=await self.get_session(), provider=provider)
+            ))
+
+        for fetched in await asyncio.gather(*[asyncio.shield(f) for f in flights]):
+            if self.snapping is not None and provider in self.snapping:
+                # only locations of exact rows are cached
+                ok = fetched.meters.notna().values & (fetched.precision.values == PRECISION)
+                self.snapping.add(provider, fetched.okey.values[ok], fetched.dkey.values[ok])
+
+            pos, found = cell_positions(cells, lookup_cells(okeys, dkeys, fetched.okey.values, fetched.dkey.values))
+            pos = pos[found]
+
+            meters[pos] = fetched.meters.values[found]
+            seconds[pos] = fetched.seconds.values[found]
+            source[pos] = 1
+
+        if store is not None and store.writable:
+            new = (source == 1) & ~stored & ~borrowed & ~np.isnan(meters)
+            if new.any():
+                store.set_cells(origins, destinations, oidx[new], didx[new], meters[new], seconds[new])
+
+        return m.distance_matrix.Cells(
+            origins=origins,
+            destinations=destinations,
+            cells=cells,
+            meters=meters,
+            seconds=seconds,
+            source=source,
+            sources=[estimator, provider],
+            snapped=snapped
+        )
+
+    async def tier_cells(self, origins, destinations, cells, provider=None):
+        """
+        Cached distances of long cells at their coarser precision, see geode.dist_metrics.PrecisionTiers.
+        :param cells: Cell codes not cached themselves
+        :return: positions into cells answered, their meters, seconds
+        """
+        oidx, didx = split_cells(cells, len(destinations))
+        precision = self.precision_tiers.precision(origins[oidx], destinations[didx])
+
+        async def lookup(p):
+            pos = np.flatnonzero(precision == p)
+            o = np.round(origins[oidx[pos]], p)
+            d = np.round(destinations[didx[pos]], p)
+
+            # nearby cells round onto the same pair, each looked up once
+            pairs = pd.MultiIndex.from_arrays([point_keys(o), point_keys(d)])
+            unique_pairs = pairs.unique()
+            rows = await self.cache.get_distances(
+                key_points(unique_pairs.get_level_values(0).values), key_points(unique_pairs.get_level_values(1).values),
+                provider=provider, pair=True, precision=p
             )
-            res_df['source'] = 'google'
+            rows = rows[rows.meters.notna()].drop_duplicates(['okey', 'dkey'])
+
+            found = pd.MultiIndex.from_arrays([rows.okey.values, rows.dkey.values]).get_indexer(pairs)
+            hit = found >= 0
+            return pos[hit], rows.meters.values[found[hit]], rows.seconds.values[found[hit]]
+
+        tiers = np.unique(precision[precision < PRECISION]).tolist()
+        if not tiers:
+            return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)
+
+        res = await asyncio.gather(*[lookup(p) for p in tiers])
+        return tuple(np.concatenate(x) for x in zip(*res))
+
+    async def snap_cells(self, origins, destinations, cells, provider=None):
+        """
+        Cached distances between the nearest cached origin and destination of each cell, see geode.spatial.SnapIndex.
+        :param cells: Cell codes not cached themselves
+        :return: positions into cells answered, their meters, seconds
+        """
+        if provider not in self.snapping:
+            self.snapping.add(provider, *await self.cache.get_locations(provider))
+
+        oidx, didx = split_cells(cells, len(destinations))
+
+        # each location snapped once
+        ouniq, oinv = np.unique(oidx, return_inverse=True)
+        duniq, dinv = np.unique(didx, return_inverse=True)
+        okeys = self.snapping.snap(provider, origins[ouniq], 'o')[oinv]
+        dkeys = self.snapping.snap(provider, destinations[duniq], 'd')[dinv]
+
+        moved = (okeys != NO_KEY) & (dkeys != NO_KEY) & (
+            (okeys != point_keys(origins)[oidx]) | (dkeys != point_keys(destinations)[didx]))
+        pos = np.flatnonzero(moved)
+        if not len(pos):
+            return pos, np.empty(0), np.empty(0)
+
+        pairs = pd.MultiIndex.from_arrays([okeys[pos], dkeys[pos]])
+        unique_pairs = pairs.unique()
+        rows = await self.cache.get_distances(
+            key_points(unique_pairs.get_level_values(0).values), key_points(unique_pairs.get_level_values(1).values),
+            provider=provider, pair=True
+        )
+        rows = rows[rows.meters.notna()].drop_duplicates(['okey', 'dkey'])
 
-        return res_df
+        found = pd.MultiIndex.from_arrays([rows.okey.values, rows.dkey.values]).get_indexer(pairs)
+        hit = found >= 0
+        return pos[hit], rows.meters.values[found[hit]], rows.seconds.values[found[hit]]
 
     async def distance_pairs_shim(self, origins, destinations, session=None, provider=None):
         client = self.providers.get(provider)
+        session = session or await self.get_session()
 
         res = await asyncio.gather(*[
             client.distance_matrix(
@@ -208,129 +651,155 @@ class AsyncDispatcher:
 
         return res
 
-    async def distance_pairs(self, origins, destinations, max_meters=MAX_METERS, sem=None, session=None, provider=None, return_inverse=False):
+    async def distance_pairs(self, origins, destinations, max_meters=MAX_METERS, sem=None, session=None, provider=None, return_inverse=False, estimator=ESTIMATOR, as_frame=True):
+        _ignore_session(session)
         sem = sem or asyncio.BoundedSemaphore(MAX_REQUESTS)
 
-        origins = origins.round(4)
-        destinations = destinations.round(4)
-        locs, inv = np.unique(np.hstack((origins, destinations)), axis=0, return_inverse=True)
-        origins = locs[:, 0:2]
-        destinations = locs[:, 2:4]
-
-        idx = pd.DataFrame(locs, columns=KEY_COLS).set_index(KEY_COLS)
-
-        if self.cache:
-            cache_future = asyncio.ensure_future(
-                self.cache.get_distances(
-                    origins, destinations, provider=provider, pair=True
-                )
-            )
-
-        # no vectorized param version of distance functions
-        # this replaces cdist euclidean
-        estimates = np.sqrt(np.square(
-            VEC_DIST(
-                np.radians(origins),
-                np.radians(destinations)
-            )
-        ).sum(axis=1)) * dist_metrics.R_EARTH
+        origins, _, oinv = unique_points(origins)
+        destinations, _, dinv = unique_points(destinations)
 
-        estimate_df = pd.DataFrame(estimates, columns=['meters'], index=idx.index)
-        estimate_df['seconds'] = estimate_df.meters / 30
-        estimate_df['source'] = 'gc_manhattan'
+        # pairs are a sparse set of cells
+        inv, cells = pd.factorize(cell_codes(oinv, dinv, len(destinations)), sort=True)
 
-        out_of_range = estimate_df.index[(estimate_df.meters > max_meters) | (estimate_df.meters < MIN_METERS)]
-
-        if self.cache:
-            cache_df = await cache_future
-            cache_df['source'] = 'google'
-
-            missing = pd.DataFrame(
-                index=idx.index.difference(out_of_range).difference(cache_df.index)
-            )
-        else:
-            missing = pd.DataFrame(
-                index=idx.index.difference(out_of_range)
-            )
-
-        res_df = await self.distance_rows(missing, sem, session=session, provider=provider)
-
-        if self.cache:
-            await self.cache.set_distances(
-                origins, destinations, res_df, provider=provider
-            )
-
-            merged_df = pd.concat([estimate_df, cache_df, res_df], sort=False)
-        else:
-            merged_df = pd.concat([estimate_df, res_df], sort=False)
+        res = await self.distance_cells(
+            origins, destinations, cells, max_meters=max_meters, sem=sem,
+            provider=provider, estimator=estimator
+        )
 
-        merged_df = merged_df[~merged_df.index.duplicated(keep='last')].reindex(index=idx.index, copy=False)
+        if as_frame:
+            res = res.to_frame()
 
         if return_inverse:
-            return merged_df, inv
+            return res, inv
 
-        return merged_df
+        return res
 
 
 class Dispatcher:
-    """Proxy class for easier use in sync environments."""
+    """
+    Proxy class for easier use in sync environments.
+    Owns one event loop, run on a background thread when threaded, on which the dispatcher keeps
+    its keep-alive http session and the cache pool, reused by every call until close().
+    """
     cache = None
-    cache_conn = None
     providers: Dict[str, Any] = {}
-    dispatcher = None
+    dispatcher: Any = None
 
     def __init__(self, config=None, threaded=True):
+        """
+        :param threaded: Run loop on a background thread, works where the caller thread has its own loop, like notebooks
+        """
         self.threaded = threaded
+        self.loop = asyncio.new_event_loop()
+        self.thread = None
+
+        if threaded:
+            self.thread = threading.Thread(target=self.loop.run_forever, name='geode-dispatcher', daemon=True)
+            self.thread.start()
+
         self.dispatcher = self.run(AsyncDispatcher.init(config))
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
     def run(self, coro):
-        if self.threaded:
-            future = ThreadPoolExecutor().submit(asyncio.run, coro)
+        if not self.threaded:
+            return self.loop.run_until_complete(coro)
+
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        try:
             return future.result()
-        else:
-            return asyncio.run(coro)
+        except BaseException:
+            # interrupted caller, stop the work on the loop too
+            future.cancel()
+            raise
+
+    def close(self):
+        """Close session and cache, flushing pending cache writes, then stop the loop."""
+        if self.loop.is_closed():
+            return
+
+        self.run(self.aclose())
 
-    # TODO: find way to consolidate these wrappers
-    async def distance_matrix_with_session(self, *args, **kwargs):
-        async with aiohttp.ClientSession(json_serialize=ujson.dumps, timeout=aiohttp.ClientTimeout(total=CLIENT_TIMEOUT)) as session:
-            return await self.dispatcher.distance_matrix(*args, **kwargs, session=session)
+        if self.thread is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
 
-    async def distance_pairs_with_session(self, *args, **kwargs):
-        async with aiohttp.ClientSession(json_serialize=ujson.dumps, timeout=aiohttp.ClientTimeout(total=CLIENT_TIMEOUT)) as session:
-            return await self.dispatcher.distance_pairs(*args, **kwargs, session=session)
+        self.loop.close()
 
-    async def batch_geocode_with_session(self, *args, **kwargs):
-        async with aiohttp.ClientSession(json_serialize=ujson.dumps, timeout=aiohttp.ClientTimeout(total=CLIENT_TIMEOUT)) as session:
-            return await self.dispatcher.batch_geocode(*args, **kwargs, session=session)
+    async def aclose(self):
+        await self.dispatcher.close()
 
-    async def geocode_with_session(self, *args, **kwargs):
-        async with aiohttp.ClientSession(json_serialize=ujson.dumps, timeout=aiohttp.ClientTimeout(total=CLIENT_TIMEOUT)) as session:
-            return await self.dispatcher.geocode(*args, **kwargs, session=session)
+    async def get_session(self):
+        return await self.dispatcher.get_session()
 
-    def distance_matrix(self, origins, destinations, max_meters=MAX_METERS, provider=None, return_inverse=False) -> pd.DataFrame:
+    def distance_matrix(self, origins, destinations, max_meters=MAX_METERS, provider=None, return_inverse=False, estimator=ESTIMATOR, as_frame=True, store=None) -> pd.DataFrame:
         """
         :param origins: Locations like format [[42.3, -88.7], [40.1, -89.5], ...]
         :param destinations: Locations like format [[42.3, -88.7], [40.1, -89.5], ...]
         :param max_meters: Max distance in meters to send to provider
         :param provider: Service to query
         :param return_inverse: Give back list of indices to re-expand duplicate origin distance pairs.
+        :param estimator: Straight line metric for cells not sent to provider, see dist_metrics.METRICS,
+            unused with an estimator configured
+        :param as_frame: Give back DataFrame indexed by coordinates, otherwise integer coded m.distance_matrix.Cells
+        :param store: geode.matrix_store.MatrixStore of known cells, fetched cells are added if opened writable
         :return: origins x destinations distances.
         """
         return self.run(
-            self.distance_matrix_with_session(origins, destinations, max_meters, provider=provider, return_inverse=return_inverse)
+            self.dispatcher.distance_matrix(origins, destinations, max_meters, provider=provider, return_inverse=return_inverse, estimator=estimator, as_frame=as_frame, store=store)
         )
 
-    def distance_pairs(self, origins, destinations, max_meters=MAX_METERS, provider=None, return_inverse=False) -> pd.DataFrame:
+    def distance_matrix_stream(self, origins, destinations, tile_size=None, max_meters=MAX_METERS, provider=None, estimator=ESTIMATOR, as_frame=True, store=None) -> Iterator[pd.DataFrame]:
+        """
+        :param tile_size: Origins per block, defaults to fit TILE_CELLS
+        :return: origin tile x destinations distances, one block at a time.
+        """
+        blocks = self.dispatcher.distance_matrix_stream(
+            origins, destinations, tile_size, max_meters, provider=provider, estimator=estimator, as_frame=as_frame, store=store
+        )
+
+        async def next_block():
+            try:
+                return await blocks.__anext__()
+            except StopAsyncIteration:
+                return None
+
+        try:
+            # next block keeps fetching on the loop while this one is consumed
+            res = self.run(next_block())
+            while res is not None:
+                yield res
+                res = self.run(next_block())
+        finally:
+            if not self.loop.is_closed():
+                self.run(blocks.aclose())
+
+    def distance_pairs(self, origins, destinations, max_meters=MAX_METERS, provider=None, return_inverse=False, estimator=ESTIMATOR, as_frame=True) -> pd.DataFrame:
+        """
+        :param origins: Locations like format [[42.3, -88.7], [40.1, -89.5], ...]
+        :param destinations: Locations paired row-wise with origins
+        :param max_meters: Max distance in meters to send to provider
+        :param provider: Service to query
+        :param return_inverse: Give back list of indices to re-expand duplicate pairs.
+        :param estimator: Straight line metric for pairs not sent to provider, see dist_metrics.METRICS,
+            unused with an estimator configured
+        :param as_frame: Give back DataFrame indexed by coordinates, otherwise integer coded m.distance_matrix.Cells
+        :return: origin, destination pair distances.
+        """
         return self.run(
-            self.distance_pairs_with_session(origins, destinations, max_meters, provider=provider, return_inverse=return_inverse)
+            self.dispatcher.distance_pairs(origins, destinations, max_meters, provider=provider, return_inverse=return_inverse, estimator=estimator, as_frame=as_frame)
         )
 
     def batch_geocode(self, addresses, provider=None):
         return self.run(
-            self.batch_geocode_with_session(addresses, provider=provider)
+            self.dispatcher.batch_geocode(addresses, provider=provider)
         )
 
     def geocode(self, address, provider=None):
         return self.run(
-            self.geocode_with_session(address, provider=provider)
+            self.dispatcher.geocode(address, provider=provider)
         )
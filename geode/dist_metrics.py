@@ -1,7 +1,14 @@
 import numpy as np
+from typing import Callable, NamedTuple, Sequence
+
+from geode.utils import PRECISION
 
 R_EARTH = 6367000
 
+# max cells evaluated per pass by the broadcasting kernels
+# bounds scratch memory, small enough for scratch buffers to stay in cpu cache
+CHUNK_SIZE = 2 ** 16
+
 
 # accepts 2 arrays of lat lon pairs, use with scipy cdist
 def haversine(u, v, r=R_EARTH):
@@ -26,9 +33,192 @@ def gc_manhattan(u, v, r=R_EARTH):
     )
 
 
+# Broadcasting kernels
+# trig terms are computed once per point, angle differences are expanded with
+# sin(a - b) = sin(a)cos(b) - cos(a)sin(b) so a full matrix only costs products and one arcsin.
+# combine functions write into out and use tmp, tmp2 as scratch, all shaped like the broadcast result.
+
+def _half_angle_terms(p):
+    lat = p[:, 0]
+    lon = p[:, 1]
+    return lat, np.sin(lat / 2), np.cos(lat / 2), np.cos(lat), np.sin(lon / 2), np.cos(lon / 2)
+
+
+def _sin_diff(sa, ca, sb, cb, out, tmp):
+    np.multiply(sa, cb, out=out)
+    np.multiply(ca, sb, out=tmp)
+    return np.subtract(out, tmp, out=out)
+
+
+def _haversine(u, v, r, out, tmp, tmp2):
+    _, uslat, uclat, ucos, uslon, uclon = u
+    _, vslat, vclat, vcos, vslon, vclon = v
+
+    # sin^2(dlat / 2)
+    h = _sin_diff(uslat, uclat, vslat, vclat, out, tmp)
+    np.square(h, out=h)
+
+    # cos(ulat) cos(vlat) sin^2(dlon / 2)
+    t = tmp2
+    _sin_diff(uslon, uclon, vslon, vclon, t, tmp)
+    np.square(t, out=t)
+    np.multiply(t, ucos, out=t)
+    np.multiply(t, vcos, out=t)
+    np.add(h, t, out=h)
+
+    np.minimum(h, 1, out=h)
+    np.sqrt(h, out=h)
+    np.arcsin(h, out=h)
+    return np.multiply(h, 2 * r, out=h)
+
+
+def _gc_manhattan(u, v, r, out, tmp, tmp2):
+    # north-south leg along origin meridian
+    # then east-west leg along mean parallel, same as scalar gc_manhattan
+    ulat, uslat, uclat, _, uslon, uclon = u
+    vlat, vslat, vclat, _, vslon, vclon = v
+
+    # cos((ulat + vlat) / 2) * sin(dlon / 2)
+    t = tmp2
+    np.multiply(uclat, vclat, out=t)
+    np.multiply(uslat, vslat, out=tmp)
+    np.subtract(t, tmp, out=t)
+    s = _sin_diff(uslon, uclon, vslon, vclon, out, tmp)
+    np.multiply(s, t, out=s)
+    np.abs(s, out=s)
+    np.minimum(s, 1, out=s)
+    np.arcsin(s, out=s)
+    np.multiply(s, 2 * r, out=s)
+
+    # meridian arc is exact for |dlat| <= pi
+    np.subtract(ulat, vlat, out=tmp)
+    np.abs(tmp, out=tmp)
+    np.multiply(tmp, r, out=tmp)
+    return np.add(s, tmp, out=s)
+
+
+def _euclidean(u, v, r, out, tmp, tmp2):
+    # flat plane approximation on radians, legacy estimate
+    np.subtract(u[0], v[0], out=out)
+    np.square(out, out=out)
+    np.subtract(u[1], v[1], out=tmp)
+    np.square(tmp, out=tmp)
+    np.add(out, tmp, out=out)
+    np.sqrt(out, out=out)
+    return np.multiply(out, r, out=out)
+
+
+def _point_terms(p):
+    return p[:, 0], p[:, 1]
+
+
+class Metric(NamedTuple):
+    terms: Callable
+    combine: Callable
+
+
+METRICS = {
+    'haversine': Metric(_half_angle_terms, _haversine),
+    'gc_manhattan': Metric(_half_angle_terms, _gc_manhattan),
+    'euclidean': Metric(_point_terms, _euclidean),
+}
+
+
+def get_metric(metric) -> Metric:
+    if isinstance(metric, Metric):
+        return metric
+
+    try:
+        return METRICS[metric]
+    except KeyError:
+        raise ValueError(f'unknown metric {metric!r}, expected one of {list(METRICS)}')
+
+
+def _as_radians(points):
+    return np.radians(np.asarray(points, dtype=float).reshape(-1, 2))
+
+
+def matrix(metric, u, v, r=R_EARTH, chunk_size=CHUNK_SIZE) -> np.ndarray:
+    """
+    :param metric: Name in METRICS
+    :param u: Locations like format [[42.3, -88.7], [40.1, -89.5], ...]
+    :param v: Locations like format [[42.3, -88.7], [40.1, -89.5], ...]
+    :param r: Sphere radius
+    :param chunk_size: Max cells computed per pass
+    :return: len(u) x len(v) distances
+    """
+    metric = get_metric(metric)
+    u = _as_radians(u)
+    v = _as_radians(v)
+
+    out = np.empty((len(u), len(v)))
+    if not out.size:
+        return out
+
+    uterms = [x[:, np.newaxis] for x in metric.terms(u)]
+    vterms = [x[np.newaxis, :] for x in metric.terms(v)]
+
+    # whole origin rows per pass
+    step = max(1, chunk_size // len(v))
+    tmp = np.empty((2, min(step, len(u)), len(v)))
+    for i in range(0, len(u), step):
+        o = out[i:i + step]
+        metric.combine([x[i:i + step] for x in uterms], vterms, r, o, *tmp[:, :len(o)])
+
+    return out
+
+
+def pairwise(metric, u, v, r=R_EARTH, chunk_size=CHUNK_SIZE) -> np.ndarray:
+    """
+    :param metric: Name in METRICS
+    :param u: Locations like format [[42.3, -88.7], [40.1, -89.5], ...]
+    :param v: Locations, same length as u
+    :param r: Sphere radius
+    :param chunk_size: Max pairs computed per pass
+    :return: distance between each u[i] and v[i]
+    """
+    metric = get_metric(metric)
+    u = np.asarray(u, dtype=float).reshape(-1, 2)
+    v = np.asarray(v, dtype=float).reshape(-1, 2)
+
+    if len(u) != len(v):
+        raise ValueError(f'pairwise needs equal lengths, got {len(u)} and {len(v)}')
+
+    out = np.empty(len(u))
+    tmp = np.empty((2, min(chunk_size, len(u))))
+    for i in range(0, len(u), chunk_size):
+        o = out[i:i + chunk_size]
+        metric.combine(
+            metric.terms(_as_radians(u[i:i + chunk_size])),
+            metric.terms(_as_radians(v[i:i + chunk_size])),
+            r, o, *tmp[:, :len(o)]
+        )
+
+    return out
+
+
 PRECISION_THRESHOLD = [
     2_496_000,
     1_248_000,
     642_000,
     321_000
 ]
+
+
+class PrecisionTiers(NamedTuple):
+    """
+    Coarser cache precision for long pairs, one provider answer then serves every pair rounding to the same points.
+    Each threshold a pair's great circle distance reaches drops one decimal, down to coarsest.
+    """
+    thresholds: Sequence[float] = PRECISION_THRESHOLD
+    coarsest: int = 1
+
+    def precision(self, u, v) -> np.ndarray:
+        """
+        :param u: Locations like format [[42.3, -88.7], [40.1, -89.5], ...]
+        :param v: Locations, same length as u
+        :return: decimals each pair is cached at
+        """
+        meters = pairwise('haversine', u, v)
+        passed = (meters[:, np.newaxis] >= np.asarray(self.thresholds, dtype=float)).sum(axis=1)
+        return np.clip(PRECISION - passed, min(self.coarsest, PRECISION), PRECISION)
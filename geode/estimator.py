@@ -0,0 +1,278 @@
+"""
+Distance and duration estimates fit from cached provider results.
+
+Refit offline from a cache and save for dispatchers to load:
+
+    python -m geode.estimator --config ~/.geode/config.yml --provider google --out estimator.json
+"""
+import argparse
+import asyncio
+import os
+import numpy as np
+import pandas as pd
+import ujson
+from typing import Tuple
+
+from geode import dist_metrics
+from geode.cache import SCAN_ROWS, create_cache
+from geode.config import yaml
+from geode.utils import PRECISION, key_points, replace_file
+
+# upper edges of distance bands, meters of straight line distance, the last band is open
+DISTANCE_BANDS = [2_000, 5_000, 10_000, 25_000, 50_000, 100_000, 250_000, 500_000, 1_000_000]
+
+# meters per second used before any fit, the old meters / 30 estimate
+DEFAULT_SPEED = 30.
+
+# straight line distances too short for a meaningful detour factor
+MIN_FIT_METERS = 100
+
+# per bucket statistics, all on logs
+STATS = ['count', 'detour', 'detour_var', 'speed', 'speed_var']
+
+
+class Estimator:
+    """
+    Detour factor and speed per origin grid cell and distance band, on top of a straight line metric.
+    Buckets with few samples lean on their distance band, weighted by prior samples.
+    Confidence of an estimate grows with its bucket's samples and shrinks with their spread.
+    """
+
+    def __init__(self, grid=1., bands=DISTANCE_BANDS, metric='haversine', prior=5, min_confidence=0.7, path=None):
+        """
+        :param grid: Degrees of origin grid cells
+        :param bands: Upper edges of straight line distance bands, meters
+        :param metric: Straight line metric, see dist_metrics.METRICS
+        :param prior: Samples worth of band statistics every bucket starts with
+        :param min_confidence: Cells estimated with less are sent to the provider
+        :param path: File the model is loaded from if it exists, and saved to
+        """
+        self.grid = grid
+        self.bands = np.asarray(bands, dtype=float)
+        self.metric = metric
+        self.prior = prior
+        self.min_confidence = min_confidence
+        self.path = path
+
+        # sorted bucket codes and their stats, band stats by band
+        self.codes = np.empty(0, dtype=np.int64)
+        self.buckets = np.empty((0, len(STATS)))
+        self.band_stats = np.zeros((len(self.bands) + 1, len(STATS)))
+        self.band_stats[:, STATS.index('speed')] = np.log(DEFAULT_SPEED)
+
+        if path and os.path.exists(path):
+            self.load(path)
+
+    def __len__(self):
+        """Samples fit."""
+        return int(self.band_stats[:, 0].sum())
+
+    def grid_cells(self, origins) -> np.ndarray:
+        origins = np.asarray(origins, dtype=float).reshape(-1, 2)
+        cols = int(np.ceil(360 / self.grid))
+        rows = np.floor((origins[:, 0] + 90) / self.grid).astype(np.int64)
+        return rows * cols + np.floor((origins[:, 1] + 180) / self.grid).astype(np.int64) % cols
+
+    def bucket_codes(self, origins, meters) -> np.ndarray:
+        """Grid cell of each origin, times band count, plus band of meters."""
+        return self.grid_cells(origins) * (len(self.bands) + 1) + self.band(meters)
+
+    def band(self, meters) -> np.ndarray:
+        return np.searchsorted(self.bands, meters, side='right')
+
+    def fit(self, distances: pd.DataFrame):
+        """
+        Replace the model with one fit from cached rows.
+        :param distances: DataFrame of okey, dkey, meters, seconds
+        """
+        return self._fit(*self.bucket_stats(distances))
+
+    async def fit_cache(self, cache, provider, chunk_rows=SCAN_ROWS):
+        """Fit from every exact row cached for provider, scanned chunk_rows at a time and pooled per bucket."""
+        codes = np.empty(0, dtype=np.int64)
+        stats = np.empty((0, len(STATS)))
+        async for rows in cache.iter_distances(provider, PRECISION, chunk_rows):
+            more_codes, more = self.bucket_stats(rows.dropna())
+            codes, inverse = np.unique(np.concatenate((codes, more_codes)), return_inverse=True)
+            stats = _pool(inverse.ravel(), np.vstack((stats, more)), len(codes))
+        return self._fit(codes, stats)
+
+    def bucket_stats(self, distances: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :param distances: DataFrame of okey, dkey, meters, seconds
+        :return: sorted bucket codes of the rows, and their unshrunk stats
+        """
+        origins = key_points(distances.okey.values)
+        destinations = key_points(distances.dkey.values)
+        line = dist_metrics.pairwise(self.metric, origins, destinations)
+
+        meters = distances.meters.values.astype(float)
+        seconds = distances.seconds.values.astype(float)
+        ok = (line >= MIN_FIT_METERS) & (meters > 0) & (seconds > 0)
+
+        detour = np.log(meters[ok] / line[ok])
+        speed = np.log(meters[ok] / seconds[ok])
+
+        codes, inverse = np.unique(self.bucket_codes(origins[ok], line[ok]), return_inverse=True)
+        return codes, _stats(inverse.ravel(), detour, speed, len(codes))
+
+    def _fit(self, codes, stats):
+        bands = len(self.bands) + 1
+        band_stats = _pool(codes % bands, stats, bands)
+        total = _pool(np.zeros(bands, dtype=np.int64), band_stats, 1)
+        self.band_stats = _shrink(band_stats, total[np.zeros(bands, dtype=np.int64)], self.prior)
+
+        self.codes = codes
+        self.buckets = _shrink(stats, self.band_stats[codes % bands], self.prior)
+        return self
+
+    def matrix(self, u, v) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        :return: len(u) x len(v) meters, seconds, confidence
+        """
+        line = dist_metrics.matrix(self.metric, u, v)
+        band = self.band(line)
+        detour, pace, confidence = (np.take_along_axis(x, band, axis=1) for x in self.tables(u))
+
+        meters = np.multiply(line, detour, out=detour)
+        seconds = np.multiply(line, pace, out=pace)
+        return meters, seconds, confidence
+
+    def pairwise(self, u, v) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        :return: meters, seconds, confidence between each u[i] and v[i]
+        """
+        return self.predict(u, dist_metrics.pairwise(self.metric, u, v))
+
+    def predict(self, origins, line) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        :param line: Straight line meters from each origin
+        :return: meters, seconds, confidence
+        """
+        rows = np.arange(len(line))
+        band = self.band(line)
+        detour, pace, confidence = (x[rows, band] for x in self.tables(origins))
+        return detour * line, pace * line, confidence
+
+    def tables(self, origins) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Estimates for each origin and distance band, so predictions over many destinations are lookups.
+        :return: len(origins) x bands of detour factor, seconds per straight line meter, confidence
+        """
+        bands = len(self.bands) + 1
+        codes = self.grid_cells(origins)[:, np.newaxis] * bands + np.arange(bands)
+        stats = self.band_stats[np.broadcast_to(np.arange(bands), codes.shape)]
+
+        if len(self.codes):
+            pos = np.minimum(np.searchsorted(self.codes, codes), len(self.codes) - 1)
+            found = self.codes[pos] == codes
+            stats[found] = self.buckets[pos[found]]
+        else:
+            found = np.zeros(codes.shape, dtype=bool)
+
+        count, detour, detour_var, speed, speed_var = np.moveaxis(stats, -1, 0)
+        detour = np.exp(detour)
+
+        # buckets never seen are not trusted, however good their band
+        confidence = np.where(
+            found, count / (count + self.prior) * np.exp(-np.sqrt(detour_var + speed_var)), 0.
+        )
+        return detour, detour / np.exp(speed), confidence
+
+    def save(self, path=None):
+        path = path or self.path
+        model = {
+            'grid': self.grid,
+            'bands': self.bands.tolist(),
+            'metric': self.metric,
+            'prior': self.prior,
+            'codes': self.codes.tolist(),
+            'buckets': self.buckets.tolist(),
+            'band_stats': self.band_stats.tolist(),
+        }
+
+        with replace_file(path) as f:
+            f.write(ujson.dumps(model))
+
+    def load(self, path):
+        with open(path) as f:
+            model = ujson.loads(f.read())
+
+        self.grid = model['grid']
+        self.bands = np.asarray(model['bands'], dtype=float)
+        self.metric = model['metric']
+        self.prior = model['prior']
+        self.codes = np.asarray(model['codes'], dtype=np.int64)
+        self.buckets = np.asarray(model['buckets'], dtype=float).reshape(-1, len(STATS))
+        self.band_stats = np.asarray(model['band_stats'], dtype=float).reshape(-1, len(STATS))
+        return self
+
+
+def _stats(groups, detour, speed, n):
+    """Count, mean and variance of log detour and log speed per group."""
+    count = np.bincount(groups, minlength=n).astype(float)
+    safe = np.maximum(count, 1)
+
+    out = np.zeros((n, len(STATS)))
+    out[:, 0] = count
+    for col, x in ((1, detour), (3, speed)):
+        mean = np.bincount(groups, x, minlength=n) / safe
+        out[:, col] = mean
+        out[:, col + 1] = np.bincount(groups, (x - mean[groups]) ** 2, minlength=n) / safe
+    return out
+
+
+def _pool(groups, stats, n):
+    """Count, mean and variance per group of stats rows, as if their samples were pooled."""
+    count = np.bincount(groups, stats[:, 0], minlength=n)
+    safe = np.maximum(count, 1)
+
+    out = np.zeros((n, len(STATS)))
+    out[:, 0] = count
+    for col in (1, 3):
+        mean = np.bincount(groups, stats[:, 0] * stats[:, col], minlength=n) / safe
+        out[:, col] = mean
+        spread = stats[:, col + 1] + (stats[:, col] - mean[groups]) ** 2
+        out[:, col + 1] = np.bincount(groups, stats[:, 0] * spread, minlength=n) / safe
+    return out
+
+
+def _shrink(stats, parent, prior):
+    """Blend group means and variances with their parent's, as if parent contributed prior samples."""
+    count = stats[:, :1]
+    out = (stats * count + parent * prior) / (count + prior)
+    out[:, 0] = stats[:, 0]
+
+    # spread of group means around the parent counts towards variance
+    for col in (1, 3):
+        out[:, col + 1] += count[:, 0] * prior * (stats[:, col] - parent[:, col]) ** 2 / (count[:, 0] + prior) ** 2
+    return out
+
+
+async def refit(config, provider, out):
+    cache = await create_cache(config['caching']).init([provider])
+    try:
+        estimator = await Estimator(**(config.get('estimator') or {})).fit_cache(cache, provider)
+    finally:
+        await cache.close()
+
+    estimator.save(out)
+    return estimator
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', default=os.path.expanduser(os.path.join('~', '.geode', 'config.yml')))
+    parser.add_argument('--provider', default='google')
+    parser.add_argument('--out', default=None, help='defaults to estimator path in config')
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+
+    out = args.out or (config.get('estimator') or {}).get('path')
+    if not out:
+        parser.error('--out or estimator path in config needed')
+
+    estimator = asyncio.run(refit(config, args.provider, out))
+    print(f'fit {len(estimator)} rows in {len(estimator.codes)} buckets, saved to {out}')
@@ -1,11 +1,14 @@
 import logging
 import numpy as np
-from typing import Sequence
+from typing import Sequence, Union
 from tenacity import retry, wait_random_exponential, retry_if_result
 
 import geode.models as m
+from geode.ratelimit import AdaptiveConcurrency, RateLimiter
 from geode.utils import marshall_to, point_to_str
-from .distance_matrix import map_from_distance_matrix_response
+from .distance_matrix import (
+    GoogleDistanceMatrixArrays, decode_distance_matrix_response, map_from_distance_matrix_response
+)
 from .geocoding import map_from_address
 from .models import GoogleGeocodingResponse, GoogleDistanceMatrixResponse, GoogleStatus
 
@@ -49,13 +52,24 @@ class Client(m.distance_matrix.Client, m.geocoding.Client):
             area_max=625,
             factor_max=380,
             geocode_retry=GEOCODE_RETRY,
-            matrix_retry=MATRIX_RETRY
+            matrix_retry=MATRIX_RETRY,
+            requests_per_second=None,
+            elements_per_second=None,
+            initial_concurrency=10,
+            max_concurrency=100,
+            fast_decode=True
     ):
         self.type_ = type_
         self.base_url = base_url
         self.key = key
         self.area_max = area_max
         self.factor_max = factor_max
+        # matrix responses straight to arrays, False goes through the dataclass models for debugging
+        self.fast_decode = fast_decode
+        # charged per http request, retries included
+        self.limiter = RateLimiter(requests_per_second, elements_per_second)
+        # requests in flight, backs off on OVER_QUERY_LIMIT instead of each retry hammering on its own
+        self.concurrency = AdaptiveConcurrency(initial=initial_concurrency, max_limit=max_concurrency)
         self._geocode = geocode_retry(self._geocode)
         self._distance_matrix = matrix_retry(self._distance_matrix)
 
@@ -69,29 +83,45 @@ class Client(m.distance_matrix.Client, m.geocoding.Client):
         )
 
     async def _geocode(self, location: m.Location, session=None) -> GoogleGeocodingResponse:
-        if isinstance(location, str):
-            res = await self.request(self.geocoding_path, dict(address=location), session=session)
-        else:
-            res = await self.request(self.geocoding_path, dict(address=point_to_str(location)), session=session)
+        await self.limiter.acquire()
+
+        # points are reverse geocoded
+        params = dict(address=location) if isinstance(location, str) else dict(latlng=point_to_str(location))
+
+        async with self.concurrency.slot() as slot:
+            res = await self.request(self.geocoding_path, params, session=session)
+            data = marshall_to(GoogleGeocodingResponse, await res.json())
+            slot.throttled = is_over_query_limit(data)
 
-        return marshall_to(GoogleGeocodingResponse, await res.json())
+        return data
 
     async def geocode(self, location: m.Location, session=None) -> Sequence[m.geocoding.Result]:
         data = await self._geocode(location, session)
+        if data.status not in (GoogleStatus.OK, GoogleStatus.ZERO_RESULTS):
+            raise m.geocoding.GeocodeError(data.status.name)
         return list(map(map_from_address, data.results))
 
     async def _distance_matrix(self, origins: np.ndarray, destinations: np.ndarray,
-                               session=None) -> GoogleDistanceMatrixResponse:
-        res = await self.request(
-            self.distance_matrix_path,
-            dict(
-                origins=self.point_sep.join(map(point_to_str, origins)),
-                destinations=self.point_sep.join(map(point_to_str, destinations))
-            ),
-            session=session
-        )
+                               session=None) -> Union[GoogleDistanceMatrixArrays, GoogleDistanceMatrixResponse]:
+        # called once per partition chunk
+        await self.limiter.acquire(len(origins) * len(destinations))
+
+        async with self.concurrency.slot(len(origins) * len(destinations)) as slot:
+            res = await self.request(
+                self.distance_matrix_path,
+                dict(
+                    origins=self.point_sep.join(map(point_to_str, origins)),
+                    destinations=self.point_sep.join(map(point_to_str, destinations))
+                ),
+                session=session
+            )
+            if self.fast_decode:
+                data = decode_distance_matrix_response(await res.read())
+            else:
+                data = marshall_to(GoogleDistanceMatrixResponse, await res.json())
+            slot.throttled = is_over_query_limit(data)
 
-        return marshall_to(GoogleDistanceMatrixResponse, await res.json())
+        return data
 
     @m.distance_matrix.partition
     async def distance_matrix(self, origins: np.ndarray, destinations: np.ndarray,
@@ -105,7 +135,10 @@ class Client(m.distance_matrix.Client, m.geocoding.Client):
 
         data = await self._distance_matrix(origins, destinations, session)
 
-        result = map_from_distance_matrix_response(data)
+        if isinstance(data, GoogleDistanceMatrixArrays):
+            result = data.distances
+        else:
+            result = map_from_distance_matrix_response(data)
 
         return m.distance_matrix.Result(
             origins=origins,
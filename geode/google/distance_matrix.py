@@ -1,9 +1,14 @@
 import numpy as np
+import ujson
+from dataclasses import dataclass
 from typing import Optional, Tuple
 
 import geode.models as m
 
-from .models import GoogleDistanceMatrixResponse, GoogleDistanceElement, GoogleDistanceElementStatus
+from .models import GoogleDistanceMatrixResponse, GoogleDistanceElement, GoogleDistanceElementStatus, GoogleStatus
+
+ELEMENT_STATUS = {s.name: s.value for s in GoogleDistanceElementStatus}
+ELEMENT_OK = GoogleDistanceElementStatus.OK.value
 
 
 def map_from_elm(elm: GoogleDistanceElement) -> Optional[Tuple[int, int]]:
@@ -27,3 +32,44 @@ def map_from_distance_matrix_response(response: GoogleDistanceMatrixResponse) ->
 
     return results
 
+
+@dataclass
+class GoogleDistanceMatrixArrays:
+    """Distance matrix response decoded straight to arrays, stands in for GoogleDistanceMatrixResponse."""
+    status: GoogleStatus
+    distances: np.ndarray  # RECORD, nan where element not OK
+    element_status: np.ndarray  # int8 GoogleDistanceElementStatus values, 0 if unknown
+
+
+def decode_distance_matrix_response(body: bytes) -> GoogleDistanceMatrixArrays:
+    """
+    Parse raw response body into meters, seconds and element status arrays, no dataclass tree.
+    """
+    data = ujson.loads(body)
+
+    try:
+        status = GoogleStatus[data.get('status')]
+    except KeyError:
+        status = GoogleStatus.UNKNOWN_ERROR
+
+    rows = data.get('rows') or []
+    olen = len(rows)
+    dlen = len(rows[0]['elements']) if olen else 0
+
+    elements = [elm for row in rows for elm in row['elements']]
+    element_status = np.fromiter(
+        (ELEMENT_STATUS.get(elm.get('status'), 0) for elm in elements), dtype=np.int8, count=len(elements)
+    )
+    ok = [elm for elm in elements if elm.get('status') == 'OK']
+
+    distances = np.full(olen * dlen, np.nan, dtype=m.distance_matrix.RECORD)
+    if ok:
+        found = element_status == ELEMENT_OK
+        distances['meters'][found] = [elm['distance']['value'] for elm in ok]
+        distances['seconds'][found] = [elm['duration']['value'] for elm in ok]
+
+    return GoogleDistanceMatrixArrays(
+        status=status,
+        distances=distances.reshape(olen, dlen).view(np.recarray),
+        element_status=element_status.reshape(olen, dlen)
+    )
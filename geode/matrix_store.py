@@ -0,0 +1,251 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+from geode.utils import point_keys, replace_file, unique_points
+
+DTYPE = 'float32'
+
+# bytes per block when filling or rewriting arrays, bounds memory of an extend
+BLOCK_BYTES = 2 ** 26
+
+META = 'meta.json'
+ARRAYS = ('meters', 'seconds')
+
+
+def _replace_npy(path, arr):
+    with replace_file(path, 'wb') as f:
+        np.save(f, arr)
+
+
+class MatrixStore:
+    """
+    Dense origins x destinations meters and seconds in memory-mapped files under one directory.
+    Unknown cells are nan.
+    New origins are appended to the files in place, new destinations rewrite them in row blocks
+    to the next generation of files, switched over when meta.json is replaced.
+    """
+
+    def __init__(self, path, mode='r'):
+        """
+        :param path: Directory made by MatrixStore.create
+        :param mode: 'r' read only, 'r+' to update and extend
+        """
+        self.path = path
+        self.mode = mode
+
+        with open(os.path.join(path, META)) as f:
+            meta = json.load(f)
+
+        self.dtype = np.dtype(meta['dtype'])
+        self.generation = meta['generation']
+        olen, dlen = meta['shape']
+
+        # meta is written last, anything past its shape is from an interrupted extend
+        self.origins = np.load(os.path.join(path, 'origins.npy'))[:olen]
+        self.destinations = np.load(os.path.join(path, 'destinations.npy'))[:dlen]
+
+        self._map()
+
+    @classmethod
+    def create(cls, path, origins, destinations, dtype=DTYPE) -> 'MatrixStore':
+        """
+        New store with all cells unknown.
+        :param origins: Locations like format [[42.3, -88.7], [40.1, -89.5], ...], deduplicated on quantized keys
+        :param destinations: Same as origins
+        """
+        origins, _, _ = unique_points(np.asarray(origins, dtype=float).reshape(-1, 2))
+        destinations, _, _ = unique_points(np.asarray(destinations, dtype=float).reshape(-1, 2))
+
+        os.makedirs(path, exist_ok=True)
+        _replace_npy(os.path.join(path, 'origins.npy'), origins)
+        _replace_npy(os.path.join(path, 'destinations.npy'), destinations)
+
+        dtype = np.dtype(dtype)
+        for name in ARRAYS:
+            with open(os.path.join(path, f'{name}.0.bin'), 'wb') as f:
+                _write_nan_rows(f, len(origins), len(destinations), dtype)
+
+        _write_meta(path, (len(origins), len(destinations)), dtype, 0)
+
+        return cls(path, mode='r+')
+
+    @property
+    def shape(self):
+        return len(self.origins), len(self.destinations)
+
+    @property
+    def writable(self):
+        return self.mode != 'r'
+
+    def _file(self, name, generation=None):
+        return os.path.join(self.path, f'{name}.{self.generation if generation is None else generation}.bin')
+
+    def _map(self):
+        olen, dlen = self.shape
+
+        for name in ARRAYS:
+            if olen * dlen:
+                arr = np.memmap(self._file(name), dtype=self.dtype, mode=self.mode, shape=(olen, dlen))
+            else:
+                # zero sized files can not be mapped
+                arr = np.full((olen, dlen), np.nan, dtype=self.dtype)
+            setattr(self, name, arr)
+
+        self.oindex = pd.Index(point_keys(self.origins))
+        self.dindex = pd.Index(point_keys(self.destinations))
+
+    def flush(self):
+        for name in ARRAYS:
+            arr = getattr(self, name)
+            if isinstance(arr, np.memmap):
+                arr.flush()
+
+    def positions(self, origins, destinations):
+        """
+        :return: row, column of each location, -1 where not in store
+        """
+        return (
+            self.oindex.get_indexer(point_keys(origins)),
+            self.dindex.get_indexer(point_keys(destinations))
+        )
+
+    def submatrix(self, origins, destinations):
+        """
+        :return: meters, seconds of origins x destinations, nan where unknown
+        """
+        rows, cols = self.positions(origins, destinations)
+
+        meters = np.full((len(rows), len(cols)), np.nan)
+        seconds = np.full((len(rows), len(cols)), np.nan)
+
+        ro, co = np.flatnonzero(rows >= 0), np.flatnonzero(cols >= 0)
+        block = np.ix_(ro, co)
+        stored = np.ix_(rows[ro], cols[co])
+
+        meters[block] = self.meters[stored]
+        seconds[block] = self.seconds[stored]
+
+        return meters, seconds
+
+    def get_cells(self, origins, destinations, oidx, didx):
+        """
+        :param oidx: Cell origin positions into origins
+        :param didx: Cell destination positions into destinations
+        :return: meters, seconds per cell, nan where unknown
+        """
+        rows, cols = self.positions(origins, destinations)
+        rows, cols = rows[oidx], cols[didx]
+        found = (rows >= 0) & (cols >= 0)
+
+        meters = np.full(len(rows), np.nan)
+        seconds = np.full(len(rows), np.nan)
+
+        meters[found] = self.meters[rows[found], cols[found]]
+        seconds[found] = self.seconds[rows[found], cols[found]]
+
+        return meters, seconds
+
+    def set_cells(self, origins, destinations, oidx, didx, meters, seconds):
+        """
+        Write cells, extending store with any new locations.
+        """
+        self.extend(origins[np.unique(oidx)], destinations[np.unique(didx)])
+
+        rows, cols = self.positions(origins, destinations)
+        rows, cols = rows[oidx], cols[didx]
+
+        self.meters[rows, cols] = meters
+        self.seconds[rows, cols] = seconds
+
+    def update(self, origins, destinations, meters, seconds):
+        """
+        Write a dense origins x destinations block, extending store with any new locations.
+        """
+        self.extend(origins, destinations)
+
+        rows, cols = self.positions(origins, destinations)
+        block = np.ix_(rows, cols)
+
+        self.meters[block] = meters
+        self.seconds[block] = seconds
+
+    def extend(self, origins=(), destinations=()) -> 'MatrixStore':
+        """
+        Add locations not in store yet, their cells start unknown.
+        """
+        origins = np.asarray(origins, dtype=float).reshape(-1, 2)
+        destinations = np.asarray(destinations, dtype=float).reshape(-1, 2)
+
+        origins, okeys, _ = unique_points(origins)
+        destinations, dkeys, _ = unique_points(destinations)
+
+        new_origins = origins[self.oindex.get_indexer(okeys) < 0]
+        new_destinations = destinations[self.dindex.get_indexer(dkeys) < 0]
+
+        if not len(new_origins) and not len(new_destinations):
+            return self
+
+        if not self.writable:
+            raise ValueError(f'{self.path} is opened read only')
+
+        self.flush()
+
+        if len(new_destinations):
+            self._add_destinations(new_destinations)
+
+        if len(new_origins):
+            self._add_origins(new_origins)
+
+        return self
+
+    def _add_destinations(self, new_destinations):
+        olen, dlen = self.shape
+        width = dlen + len(new_destinations)
+        rows = max(1, BLOCK_BYTES // (width * self.dtype.itemsize))
+        generation = self.generation + 1
+
+        for name in ARRAYS:
+            old = getattr(self, name)
+            with open(self._file(name, generation), 'wb') as f:
+                for i in range(0, olen, rows):
+                    block = np.full((min(rows, olen - i), width), np.nan, dtype=self.dtype)
+                    block[:, :dlen] = old[i:i + rows]
+                    block.tofile(f)
+
+        self.destinations = np.vstack((self.destinations, new_destinations))
+        _replace_npy(os.path.join(self.path, 'destinations.npy'), self.destinations)
+
+        old_files = [self._file(name) for name in ARRAYS]
+        _write_meta(self.path, self.shape, self.dtype, generation)
+
+        self.generation = generation
+        self._map()
+
+        for old in old_files:
+            os.remove(old)
+
+    def _add_origins(self, new_origins):
+        dlen = len(self.destinations)
+
+        for name in ARRAYS:
+            with open(self._file(name), 'ab') as f:
+                _write_nan_rows(f, len(new_origins), dlen, self.dtype)
+
+        self.origins = np.vstack((self.origins, new_origins))
+        _replace_npy(os.path.join(self.path, 'origins.npy'), self.origins)
+
+        _write_meta(self.path, self.shape, self.dtype, self.generation)
+        self._map()
+
+
+def _write_nan_rows(f, olen, dlen, dtype):
+    rows = max(1, BLOCK_BYTES // max(1, dlen * dtype.itemsize))
+    for i in range(0, olen, rows):
+        np.full((min(rows, olen - i), dlen), np.nan, dtype=dtype).tofile(f)
+
+
+def _write_meta(path, shape, dtype, generation):
+    with replace_file(os.path.join(path, META)) as f:
+        json.dump({'shape': list(shape), 'dtype': np.dtype(dtype).name, 'generation': generation}, f)
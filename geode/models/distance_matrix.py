@@ -1,10 +1,12 @@
 import abc
 import asyncio
 import numpy as np
+import pandas as pd
 from functools import partial
 from dataclasses import dataclass
-from typing import NamedTuple, Iterator
+from typing import NamedTuple, Iterator, Optional, Sequence
 
+from geode.utils import create_cell_index
 from . import distance_matrix
 
 RECORD = [('meters', float), ('seconds', float)]
@@ -17,6 +19,38 @@ class Result:
     distances: np.ndarray
 
 
+@dataclass
+class Cells:
+    """
+    Distances addressed by flat cell code, origin position * len(destinations) + destination position.
+    Coordinates stay in the side arrays until to_frame.
+    """
+    origins: np.ndarray
+    destinations: np.ndarray
+    cells: np.ndarray  # sorted int64 codes
+    meters: np.ndarray
+    seconds: np.ndarray
+    source: np.ndarray  # int8 positions into sources
+    sources: Sequence[str]
+    # cells answered with distances of nearby cached locations, None when snapping is off
+    snapped: Optional[np.ndarray] = None
+
+    def to_frame(self) -> pd.DataFrame:
+        # sources may be None, like no provider given, or repeat, categories may not
+        categories = list(dict.fromkeys(s for s in self.sources if s is not None))
+        codes = np.array([-1 if s is None else categories.index(s) for s in self.sources], dtype=np.int8)
+
+        columns = {
+            'meters': self.meters,
+            'seconds': self.seconds,
+            'source': pd.Categorical.from_codes(codes[self.source], categories=categories),
+        }
+        if self.snapped is not None:
+            columns['snapped'] = self.snapped
+
+        return pd.DataFrame(columns, index=create_cell_index(self.origins, self.destinations, self.cells))
+
+
 class Client(abc.ABC):
     async def distance_matrix(self, origins: np.ndarray, destinations: np.ndarray) -> Result:
         pass
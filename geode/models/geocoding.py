@@ -31,6 +31,10 @@ class Result:
     precision: Precision = Precision.APPROXIMATE
 
 
+class GeocodeError(Exception):
+    """Provider failed to answer, unlike an answer without results this is not cached."""
+
+
 class Client(abc.ABC):
     @abc.abstractmethod
     async def geocode(self, location: Location) -> Sequence[Result]: pass
@@ -0,0 +1,200 @@
+import heapq
+import math
+import numpy as np
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+from geode.utils import split_cells
+
+# groups past this many only consider merging with neighbours in destination set order
+FULL_PAIRS_MAX = 128
+WINDOW = 16
+
+
+@dataclass
+class CostModel:
+    """
+    Price of a request plan, in any unit.
+    Defaults weigh one request like a few billed elements, for the round trip and quota it costs.
+    """
+    element_cost: float = 1.
+    request_cost: float = 4.
+
+
+@dataclass
+class Plan:
+    """
+    Blocks of origin positions x destination positions covering all missing cells.
+    """
+    blocks: List[Tuple[np.ndarray, np.ndarray]] = field(default_factory=list)
+    cells: int = 0  # missing cells
+    elements: int = 0  # billed, cells of all blocks
+    requests: int = 0  # estimated, after blocks are split to provider limits
+    cost: float = 0.
+
+    @property
+    def waste(self) -> float:
+        """Share of billed elements that were not missing."""
+        return 1 - self.cells / self.elements if self.elements else 0.
+
+
+def count_requests(olen, dlen, area_max, factor_max) -> int:
+    """Requests to cover olen x dlen block, same tile shape as partition_matrix."""
+    if not olen or not dlen:
+        return 0
+    xmax = min(dlen, area_max, factor_max - 1)
+    ymax = max(1, min(olen, area_max // xmax, factor_max - xmax))
+    return math.ceil(dlen / xmax) * math.ceil(olen / ymax)
+
+
+class _Group:
+    __slots__ = ('rows', 'cols', 'ncols', 'cells', 'cost', 'alive', 'neighbours')
+
+    def __init__(self, rows, cols, ncols, cells):
+        self.rows = rows  # list of row positions
+        self.cols = cols  # column set as int bitmask
+        self.ncols = ncols
+        self.cells = cells
+        self.cost = 0.
+        self.alive = True
+        self.neighbours = set()
+
+
+def plan_rows(rows, cols, area_max, factor_max, cost_model=None) -> Plan:
+    """
+    Cover cells given by row, column positions with blocks.
+    Rows missing the same columns start as one block, then the pair of blocks whose union is cheapest
+    to request compared to requesting both is merged, until no merge lowers cost.
+    :param rows: Row position of each cell
+    :param cols: Column position of each cell
+    :param area_max: Provider max elements per request
+    :param factor_max: Provider max rows + columns per request
+    """
+    cost_model = cost_model or CostModel()
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+
+    costs = {}
+
+    def cost(nrows, ncols):
+        key = (nrows, ncols)
+        if key not in costs:
+            costs[key] = (
+                cost_model.element_cost * nrows * ncols +
+                cost_model.request_cost * count_requests(nrows, ncols, area_max, factor_max)
+            )
+        return costs[key]
+
+    if not len(rows):
+        return Plan()
+
+    # rows with identical column sets
+    order = np.lexsort((cols, rows))
+    rows, cols = rows[order], cols[order]
+    row_starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+    row_ends = np.r_[row_starts[1:], len(rows)]
+
+    by_cols: Dict[bytes, _Group] = {}
+    for s, e in zip(row_starts, row_ends):
+        key = cols[s:e].tobytes()
+        group = by_cols.get(key)
+        if group is None:
+            by_cols[key] = _Group([rows[s]], _bits(cols[s:e]), e - s, e - s)
+        else:
+            group.rows.append(rows[s])
+            group.cells += e - s
+
+    for g in by_cols.values():
+        g.cost = cost(len(g.rows), g.ncols)
+
+    # neighbours in column set order, or everyone for few groups
+    groups = sorted(by_cols.values(), key=lambda g: ((g.cols & -g.cols).bit_length(), g.cols.bit_length(), g.ncols))
+    if len(groups) <= FULL_PAIRS_MAX:
+        for g in groups:
+            g.neighbours = set(groups) - {g}
+    else:
+        for i, g in enumerate(groups):
+            for h in groups[i + 1:i + 1 + WINDOW]:
+                g.neighbours.add(h)
+                h.neighbours.add(g)
+
+    def gain(a, b):
+        nrows = len(a.rows) + len(b.rows)
+        # union has at least the wider column set, skip counting bits when that already costs more
+        if cost_model.element_cost * nrows * max(a.ncols, b.ncols) >= a.cost + b.cost:
+            return 0.
+        return a.cost + b.cost - cost(nrows, bin(a.cols | b.cols).count('1'))
+
+    heap = []
+    seq = 0
+    for g in groups:
+        for h in g.neighbours:
+            if id(g) < id(h):
+                saving = gain(g, h)
+                if saving > 0:
+                    heap.append((-saving, seq, g, h))
+                    seq += 1
+    heapq.heapify(heap)
+
+    while heap:
+        _, _, a, b = heapq.heappop(heap)
+        if not (a.alive and b.alive):
+            continue
+
+        merged = _Group(a.rows + b.rows, a.cols | b.cols, bin(a.cols | b.cols).count('1'), a.cells + b.cells)
+        merged.cost = cost(len(merged.rows), merged.ncols)
+        a.alive = b.alive = False
+        merged.neighbours = {g for g in a.neighbours | b.neighbours if g.alive}
+
+        for g in merged.neighbours:
+            g.neighbours.add(merged)
+            saving = gain(merged, g)
+            if saving > 0:
+                heapq.heappush(heap, (-saving, seq, merged, g))
+                seq += 1
+
+        groups.append(merged)
+
+    plan = Plan()
+    for g in groups:
+        if not g.alive:
+            continue
+        block_rows = np.array(sorted(g.rows), dtype=np.int64)
+        block_cols = _bit_positions(g.cols)
+
+        plan.blocks.append((block_rows, block_cols))
+        plan.cells += g.cells
+        plan.elements += len(block_rows) * len(block_cols)
+        plan.requests += count_requests(len(block_rows), len(block_cols), area_max, factor_max)
+        plan.cost += g.cost
+
+    return plan
+
+
+def plan_cells(missing, dlen, area_max, factor_max, cost_model=None) -> Plan:
+    """
+    Blocks of origin, destination positions covering missing cell codes.
+    Plans grouping by origin rows and by destination columns, keeps the cheaper.
+    """
+    oidx, didx = split_cells(np.asarray(missing, dtype=np.int64), dlen)
+
+    by_origin = plan_rows(oidx, didx, area_max, factor_max, cost_model)
+    by_destination = plan_rows(didx, oidx, area_max, factor_max, cost_model)
+
+    if by_destination.cost < by_origin.cost:
+        by_destination.blocks = [(o, d) for d, o in by_destination.blocks]
+        return by_destination
+
+    return by_origin
+
+
+def _bits(positions) -> int:
+    flags = np.zeros(positions.max() + 1, dtype=bool)
+    flags[positions] = True
+    return int.from_bytes(np.packbits(flags, bitorder='little').tobytes(), 'little')
+
+
+def _bit_positions(bits) -> np.ndarray:
+    nbytes = (bits.bit_length() + 7) // 8
+    flags = np.unpackbits(np.frombuffer(bits.to_bytes(nbytes, 'little'), dtype=np.uint8), bitorder='little')
+    return np.flatnonzero(flags).astype(np.int64)
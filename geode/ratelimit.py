@@ -0,0 +1,203 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Optional
+
+
+async def wait(charges) -> float:
+    """
+    Reserve on all buckets at once, then wait on the slowest.
+    :param charges: (bucket, tokens) pairs
+    :return: seconds waited
+    """
+    delay = max([bucket.reserve(n) for bucket, n in charges], default=0.)
+    if delay > 0:
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            for bucket, n in charges:
+                bucket.refund(n)
+            raise
+    return delay
+
+
+class TokenBucket:
+    """
+    Refills rate tokens per second up to capacity.
+    Callers take their tokens up front and sleep off any debt, so waits are served in call order
+    and a charge larger than capacity still goes through, just later.
+    Uses a monotonic clock instead of a loop, one bucket can be shared across event loops.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """
+        :param rate: Tokens per second
+        :param capacity: Max burst, defaults to one second of tokens
+        """
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, n=1) -> float:
+        """
+        Take n tokens.
+        :return: seconds to wait before using them
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        self.tokens -= n
+        return max(0., -self.tokens / self.rate)
+
+    def refund(self, n=1):
+        self.tokens += n
+
+    async def acquire(self, n=1) -> float:
+        return await wait([(self, n)])
+
+
+class RateLimiter:
+    """
+    Request and element budgets of a provider, either can be left unlimited.
+    """
+
+    def __init__(self, requests_per_second: Optional[float] = None, elements_per_second: Optional[float] = None):
+        self.requests = TokenBucket(requests_per_second) if requests_per_second else None
+        self.elements = TokenBucket(elements_per_second) if elements_per_second else None
+        # seconds spent waiting on the budget
+        self.waited = 0.
+
+    async def acquire(self, elements=0):
+        """
+        Charge one request and its elements, waiting until both budgets allow it.
+        """
+        charges = [(self.requests, 1), (self.elements, elements)]
+        self.waited += await wait([(b, n) for b, n in charges if b is not None and n])
+
+
+@dataclass
+class ConcurrencyMetrics:
+    requests: int = 0
+    throttles: int = 0
+    latency_spikes: int = 0
+    decreases: int = 0
+    peak_limit: float = 0.
+
+
+class Slot:
+    """Held for one request, mark throttled when the provider pushed back."""
+    throttled = False
+
+
+class AdaptiveConcurrency:
+    """
+    Limit on requests in flight, additive increase, multiplicative decrease.
+    Every ok response grows limit by 1 / limit, about +1 per round of limit requests.
+    A throttled response or a latency spike cuts limit by decrease, at most once per round trip,
+    responses to the same burst count as one signal.
+    Latency is judged per element requested, spikes still feed the smoothed latency,
+    so a lasting shift becomes the new normal instead of cutting limit down to min_limit.
+    Failed requests leave limit alone.
+    """
+
+    def __init__(self, initial=10, min_limit=1, max_limit=100, decrease=0.5, latency_factor=3., warmup=20):
+        """
+        :param latency_factor: Latency over this multiple of smoothed ok latency is a spike
+        :param warmup: Ok responses needed before latency spikes are judged
+        """
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.warmup = warmup
+
+        self.inflight = 0
+        self.latency = None  # smoothed seconds per element of responses not throttled
+        self.round_trip = 0.  # smoothed seconds per response, decreases are spaced by it
+        self.samples = 0
+        self.last_decrease = 0.
+        self.waiters = deque()
+        self.metrics = ConcurrencyMetrics(peak_limit=self.limit)
+
+    async def acquire(self):
+        if self.inflight < int(self.limit) and not self.waiters:
+            self.inflight += 1
+            return
+
+        fut = asyncio.get_running_loop().create_future()
+        self.waiters.append(fut)
+        try:
+            # slot is handed over by _wake
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.inflight -= 1
+                self._wake()
+            raise
+
+    def release(self, latency, throttled=False, elements=1, failed=False):
+        """
+        :param latency: Seconds the request took
+        :param elements: Size of the request, latency is compared per element
+        :param failed: Request raised, no signal either way
+        """
+        self.inflight -= 1
+        self.metrics.requests += 1
+
+        if failed:
+            pass
+        elif throttled:
+            self.metrics.throttles += 1
+            self._decrease()
+        else:
+            self.round_trip = latency if self.latency is None else 0.9 * self.round_trip + 0.1 * latency
+            latency = latency / max(elements, 1)
+            spike = self.samples >= self.warmup and latency > self.latency_factor * self.latency
+
+            self.latency = latency if self.latency is None else 0.9 * self.latency + 0.1 * latency
+            self.samples += 1
+
+            if spike:
+                self.metrics.latency_spikes += 1
+                self._decrease()
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                self.metrics.peak_limit = max(self.metrics.peak_limit, self.limit)
+
+        self._wake()
+
+    @asynccontextmanager
+    async def slot(self, elements=1):
+        await self.acquire()
+        slot = Slot()
+        start = time.monotonic()
+        try:
+            yield slot
+        except BaseException:
+            self.release(time.monotonic() - start, elements=elements, failed=True)
+            raise
+        else:
+            self.release(time.monotonic() - start, slot.throttled, elements=elements)
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self.last_decrease < self.round_trip:
+            return
+
+        self.last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.decrease)
+        self.metrics.decreases += 1
+
+    def _wake(self):
+        while self.waiters and self.inflight < int(self.limit):
+            fut = self.waiters.popleft()
+            # waiters of a finished sync call's loop are gone
+            if fut.done() or fut.get_loop().is_closed():
+                continue
+            self.inflight += 1
+            fut.set_result(None)
@@ -0,0 +1,95 @@
+import os
+import numpy as np
+from typing import Dict, List, Optional, Sequence
+
+import geode.models as m
+from geode.models.geocoding import Precision
+from geode.cache import dump_geocode_results, load_geocode_results
+from geode.spatial import PointIndex
+from geode.utils import point_keys, replace_file
+
+
+class ReverseIndex:
+    """
+    Geocoded addresses by location, answers reverse geocodes near a known address without a provider request.
+    One point index per precision, so lookups can ask for results of at least min_precision.
+    Saved as a json list of its results, points are indexed again on load.
+    """
+
+    def __init__(self, radius=25., min_precision=Precision.RANGE_INTERPOLATED, path=None):
+        """
+        :param radius: Meters from a known address a point is answered with it
+        :param min_precision: Coarsest precision of results used for answers
+        :param path: File the index is loaded from if it exists, and saved to
+        """
+        self.radius = radius
+        self.min_precision = Precision[min_precision] if isinstance(min_precision, str) else min_precision
+        self.path = path
+
+        self.tiers: Dict[Precision, PointIndex] = {p: PointIndex() for p in Precision}
+        self.results: Dict[Precision, List[m.geocoding.Result]] = {p: [] for p in Precision}
+        # quantized points per tier, a point geocoded again is not indexed twice
+        self.keys: Dict[Precision, set] = {p: set() for p in Precision}
+        self.hits = 0
+        self.misses = 0
+
+        if path and os.path.exists(path):
+            self.load(path)
+
+    def __len__(self):
+        return sum(map(len, self.results.values()))
+
+    def add(self, results: Sequence[Optional[m.geocoding.Result]]):
+        """Index results with a point, others are skipped."""
+        for precision in Precision:
+            tier = [r for r in results if r is not None and r.point is not None and r.precision == precision]
+            if not tier:
+                continue
+
+            keys = point_keys([r.point for r in tier]).tolist()
+            known = self.keys[precision]
+            new = []
+            for key, r in zip(keys, tier):
+                if key not in known:
+                    known.add(key)
+                    new.append(r)
+
+            if new:
+                self.tiers[precision].add([r.point for r in new])
+                self.results[precision].extend(new)
+
+    def lookup(self, points, radius=None, min_precision=None) -> List[Optional[m.geocoding.Result]]:
+        """
+        :return: nearest known result within radius for each point, None where there is none
+        """
+        radius = self.radius if radius is None else radius
+        min_precision = self.min_precision if min_precision is None else min_precision
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+
+        best = np.full(len(points), np.inf)
+        found: List[Optional[m.geocoding.Result]] = [None] * len(points)
+        for precision in Precision:
+            if precision.value < min_precision.value or not len(self.tiers[precision]):
+                continue
+
+            pos, meters = self.tiers[precision].nearest(points, radius)
+            results = self.results[precision]
+            for i in np.flatnonzero(meters < best).tolist():
+                found[i] = results[pos[i]]
+            np.minimum(best, meters, out=best)
+
+        hits = int(np.isfinite(best).sum())
+        self.hits += hits
+        self.misses += len(points) - hits
+        return found
+
+    def save(self, path=None):
+        path = path or self.path
+        results = [r for p in Precision for r in self.results[p]]
+
+        with replace_file(path) as f:
+            f.write(dump_geocode_results(results))
+
+    def load(self, path):
+        with open(path) as f:
+            self.add(load_geocode_results(f.read()))
@@ -0,0 +1,50 @@
+import asyncio
+from typing import Dict, Hashable, List, Sequence, Tuple
+
+
+class SingleFlight:
+    """
+    In flight work registered by key, so concurrent callers asking for the same keys
+    await one shared task instead of repeating the work.
+    Callers shield the flights they await, so cancelling one never cancels work others wait on.
+    Errors of the shared task are raised to every caller.
+    """
+
+    def __init__(self):
+        self.flights: Dict[Hashable, asyncio.Future] = {}
+        # keys served by a flight someone else started
+        self.joined = 0
+
+    def split(self, keys: Sequence[Hashable]) -> Tuple[List[int], List[asyncio.Future]]:
+        """
+        :return: positions of keys not in flight, distinct flights covering the rest
+        """
+        free = []
+        flights = {}
+        for i, key in enumerate(keys):
+            flight = self.flights.get(key)
+            if flight is None:
+                free.append(i)
+            else:
+                flights[id(flight)] = flight
+
+        self.joined += len(keys) - len(free)
+        return free, list(flights.values())
+
+    def launch(self, keys: Sequence[Hashable], coro) -> asyncio.Future:
+        """Run coro as a task registered under keys until it finishes."""
+        task = asyncio.ensure_future(coro)
+        for key in keys:
+            self.flights[key] = task
+
+        task.add_done_callback(lambda t: self._land(keys, t))
+        return task
+
+    def _land(self, keys, task):
+        for key in keys:
+            if self.flights.get(key) is task:
+                del self.flights[key]
+
+        # mark error seen, waiters may all be gone
+        if not task.cancelled():
+            task.exception()
@@ -1,48 +1,109 @@
 import asyncio
-import datetime
+import dataclasses
 import logging
-from dataclasses import dataclass
-from typing import List, Sequence, Optional
+from typing import List, Sequence
+from tenacity import retry, wait_random_exponential, retry_if_result
 
 import geode.models as m
-from geode.utils import marshall_to, point_to_str
+from geode.ratelimit import AdaptiveConcurrency, RateLimiter
+from geode.utils import marshall_to
 from .geocoding import map_from_address
-from .models import SmartyGeocodingResponse
+from .models import SmartyGeocodingResponse, SmartyLookup
 
 logger = logging.getLogger()
 
-@dataclass
-class Client(m.distance_matrix.Client, m.geocoding.Client):
-    type_: str = 'smartys'
-    base_url = 'https://maps.googleapis.com/'
-    geocoding_path = 'maps/api/geocode/json'
-    distance_matrix_path = 'maps/api/distancematrix/json'
-    point_sep = '|'
-    key: str = ''
-    area_max: int = 625
-    factor_max: int = 380
-    # client_id: str
-    # secret: str
-
-    async def request(self, path, params, session=None):
-        logger.info(f'sent request at {(datetime.datetime.now())}')
-
-        return await session.get(
+TOO_MANY_REQUESTS = 429
+
+
+def is_over_query_limit(x):
+    return x[0] == TOO_MANY_REQUESTS
+
+
+# random wait alleviates retry bursts
+GEOCODE_RETRY = retry(
+    wait=wait_random_exponential(multiplier=0.1, min=0.1, max=2, exp_base=1.5),
+    retry=retry_if_result(is_over_query_limit),
+)
+
+
+class Client(m.geocoding.Client):
+    """
+    US street address API, geocodes up to batch_max addresses per POST.
+    """
+    type_: str
+    base_url: str
+    geocoding_path = 'street-address'
+    auth_id: str
+    auth_token: str
+    batch_max: int
+
+    def __init__(
+            self,
+            type_='smarty',
+            base_url='https://us-street.api.smartystreets.com/',
+            auth_id='',
+            auth_token='',
+            batch_max=100,
+            geocode_retry=GEOCODE_RETRY,
+            requests_per_second=None,
+            initial_concurrency=10,
+            max_concurrency=100
+    ):
+        self.type_ = type_
+        self.base_url = base_url
+        self.auth_id = auth_id
+        self.auth_token = auth_token
+        self.batch_max = batch_max
+        self.limiter = RateLimiter(requests_per_second)
+        self.concurrency = AdaptiveConcurrency(initial=initial_concurrency, max_limit=max_concurrency)
+        self._batch_geocode = geocode_retry(self._batch_geocode)
+
+    async def request(self, path, lookups, session=None):
+        return await session.post(
             self.base_url + path,
-            params=dict(
-                key=self.key,
-                **params
-            )
+            params={'auth-id': self.auth_id, 'auth-token': self.auth_token},
+            json=lookups
         )
 
-    async def geocode(self, location: m.Location, session=None) -> Optional[m.geocoding.Result]:
-        if isinstance(location, str):
-            res = await self.request(self.geocoding_path, dict(address=location), session=session)
-        else:
-            res = await self.request(self.geocoding_path, dict(address=point_to_str(location)), session=session)
+    async def _batch_geocode(self, addresses: Sequence[str], session=None):
+        """
+        One POST of at most batch_max addresses.
+        :return: http status, candidates
+        """
+        await self.limiter.acquire()
+
+        lookups = [dataclasses.asdict(SmartyLookup(street=a, input_id=str(i))) for i, a in enumerate(addresses)]
+        async with self.concurrency.slot(len(lookups)) as slot:
+            res = await self.request(self.geocoding_path, lookups, session=session)
+            slot.throttled = res.status == TOO_MANY_REQUESTS
+            if res.status != 200:
+                res.release()
+                return res.status, []
+            data = marshall_to(List[SmartyGeocodingResponse], await res.json())
+
+        return res.status, data
+
+    async def batch_geocode(self, locations: Sequence[m.Location], session=None) -> List[List[m.geocoding.Result]]:
+        """
+        Points are not looked up, the API geocodes addresses only.
+        :return: results for each location, empty when none found
+        """
+        positions = [i for i, loc in enumerate(locations) if isinstance(loc, str)]
+        addresses: List[str] = [loc for loc in locations if isinstance(loc, str)]
+
+        starts = range(0, len(addresses), self.batch_max)
+        responses = await asyncio.gather(*[
+            self._batch_geocode(addresses[i:i + self.batch_max], session) for i in starts
+        ])
+
+        results: List[List[m.geocoding.Result]] = [[] for _ in locations]
+        for start, (status, candidates) in zip(starts, responses):
+            if status != 200:
+                raise m.geocoding.GeocodeError(f'http {status}')
+            for c in candidates:
+                results[positions[start + c.input_index]].append(map_from_address(c))
 
-        data = marshall_to(SmartyGeocodingResponse, await res.json())
-        return next(map(map_from_address, data.results), None)
+        return results
 
-    async def batch_geocode(self, locations: List[m.Location], session=None) -> Sequence[Optional[m.geocoding.Result]]:
-        return await asyncio.gather(*[self.geocode(loc, session=session) for loc in locations])
+    async def geocode(self, location: m.Location, session=None) -> Sequence[m.geocoding.Result]:
+        return (await self.batch_geocode([location], session=session))[0]
@@ -1,28 +1,47 @@
 import geode.models as m
 from .models import SmartyGeocodingResponse, SmartyComponents
-# from .models import GoogleAddress, GoogleAddressComponent, GooglePoint, GoogleLocationType
+
+# metadata.precision, finest to coarsest
+PRECISION_MAP = {
+    'Rooftop': m.geocoding.Precision.ROOFTOP,
+    'Parcel': m.geocoding.Precision.ROOFTOP,
+    'Structure': m.geocoding.Precision.ROOFTOP,
+    'Zip9': m.geocoding.Precision.RANGE_INTERPOLATED,
+    'Zip8': m.geocoding.Precision.RANGE_INTERPOLATED,
+    'Zip7': m.geocoding.Precision.RANGE_INTERPOLATED,
+    'Zip6': m.geocoding.Precision.GEOMETRIC_CENTER,
+}
+
+# analysis.dpv_match_code, whether USPS confirmed the address as a delivery point
+CONFIDENCE_MAP = {
+    'Y': m.geocoding.Confidence.EXACT,
+    'S': m.geocoding.Confidence.PARTIAL,  # secondary number not confirmed
+    'D': m.geocoding.Confidence.PARTIAL,  # secondary number missing
+}
+
 
 def from_address_components(c: SmartyComponents) -> m.Address:
     return m.Address(
-        unit=c.secondary_number,
-        street=c.street_name,
-        number=c.primary_number,
-        locality=c.city_name,
-        state=c.state_abbreviation,
-        postcode=c.zipcode,
-        postcode_ext=c.plus4_code
+        unit=c.secondary_number or '',
+        street=' '.join(filter(None, [c.street_name, c.street_suffix])),
+        number=c.primary_number or '',
+        locality=c.city_name or '',
+        state=c.state_abbreviation or '',
+        postcode=c.zipcode or '',
+        postcode_ext=c.plus4_code or ''
     )
 
-def from_response(resp: SmartyGeocodingResponse) -> m.geocoding.Result:
+
+def map_from_address(resp: SmartyGeocodingResponse) -> m.geocoding.Result:
     addr = from_address_components(resp.components)
 
     addr.formatted = ', '.join(filter(None, [resp.delivery_line_1, resp.last_line]))
-    addr.county = resp.metadata.county_name
+    addr.county = resp.metadata.county_name or ''
 
     point = m.GeoPoint(lat=resp.metadata.latitude, lon=resp.metadata.longitude)
 
-    prec = m.geocoding.Precision.GEOMETRIC_CENTER
-    conf = m.geocoding.Confidence.LOW
+    prec = PRECISION_MAP.get(resp.metadata.precision, m.geocoding.Precision.APPROXIMATE)
+    conf = CONFIDENCE_MAP.get(resp.analysis.dpv_match_code if resp.analysis else '', m.geocoding.Confidence.LOW)
 
     res = m.geocoding.Result(
         address=addr,
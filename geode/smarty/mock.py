@@ -0,0 +1,114 @@
+"""
+Local stand-in for the Smarty US street address API, for tests and dry runs without credentials.
+Addresses starting with a house number are found, at a point hashed from the canonical address.
+
+    python -m geode.smarty.mock --port 8081
+"""
+import argparse
+import zlib
+import usaddress
+from aiohttp import web
+from typing import Dict, List
+
+from geode.address import canonical_address
+
+
+def candidate(street: str, index: int, input_id: str = ''):
+    """Candidate for one lookup, None when it is not an address."""
+    parts: Dict[str, List[str]] = {}
+    for token, label in usaddress.parse(street):
+        parts.setdefault(label, []).append(token.strip(','))
+
+    if 'AddressNumber' not in parts:
+        return None
+
+    part = lambda label: ' '.join(parts.get(label, []))
+    seed = zlib.crc32(canonical_address(street).encode())
+
+    delivery_line = ' '.join(filter(None, [
+        part('AddressNumber'), part('StreetNamePreDirectional'), part('StreetName'), part('StreetNamePostType')
+    ]))
+    last_line = ' '.join(filter(None, [part('PlaceName'), part('StateName'), part('ZipCode')]))
+
+    return {
+        'input_id': input_id,
+        'input_index': index,
+        'candidate_index': 0,
+        'delivery_line_1': delivery_line,
+        'last_line': last_line,
+        'components': {
+            'primary_number': part('AddressNumber'),
+            'street_name': part('StreetName'),
+            'street_suffix': part('StreetNamePostType'),
+            'city_name': part('PlaceName'),
+            'default_city_name': part('PlaceName'),
+            'state_abbreviation': part('StateName'),
+            'zipcode': part('ZipCode')[:5],
+            'plus4_code': '',
+            'delivery_point': '',
+            'delivery_point_check_digit': '',
+            'secondary_number': part('OccupancyIdentifier'),
+        },
+        'metadata': {
+            'county_name': '',
+            # inside the contiguous US
+            'latitude': round(25 + (seed % 24_000) / 1000, 5),
+            'longitude': round(-124 + (seed // 24_000 % 57_000) / 1000, 5),
+            'precision': 'Zip9',
+        },
+        'analysis': {
+            'dpv_match_code': 'Y',
+            'footnotes': '',
+        },
+    }
+
+
+class SmartyMock:
+    def __init__(self, auth_id='test', auth_token='test', batch_max=100, throttle_every=0):
+        """
+        :param throttle_every: Answer every nth request with 429, 0 never
+        """
+        self.auth_id = auth_id
+        self.auth_token = auth_token
+        self.batch_max = batch_max
+        self.throttle_every = throttle_every
+        # counters for tests
+        self.requests = 0
+        self.lookups = 0
+
+    async def street_address(self, request: web.Request):
+        self.requests += 1
+
+        query = request.query
+        if query.get('auth-id') != self.auth_id or query.get('auth-token') != self.auth_token:
+            return web.Response(status=401)
+
+        if self.throttle_every and self.requests % self.throttle_every == 0:
+            return web.Response(status=429)
+
+        lookups = await request.json()
+        if len(lookups) > self.batch_max:
+            return web.Response(status=413)
+
+        self.lookups += len(lookups)
+        candidates = [candidate(x.get('street', ''), i, x.get('input_id', '')) for i, x in enumerate(lookups)]
+        return web.json_response([c for c in candidates if c is not None])
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/street-address', self.street_address)
+        return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--auth-id', default='test')
+    parser.add_argument('--auth-token', default='test')
+    parser.add_argument('--throttle-every', type=int, default=0)
+    args = parser.parse_args()
+
+    web.run_app(
+        SmartyMock(args.auth_id, args.auth_token, throttle_every=args.throttle_every).app(),
+        port=args.port
+    )
@@ -1,4 +1,13 @@
 from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass
+class SmartyLookup:
+    """One address of a street-address POST body."""
+    street: str
+    input_id: str = ''
+    candidates: int = 1
 
 
 @dataclass
@@ -22,14 +31,25 @@ class SmartyMetadata:
     longitude: float
     latitude: float
     precision: str
-    
 
+
+@dataclass
+class SmartyAnalysis:
+    dpv_match_code: str = ''
+    footnotes: str = ''
+
+
+# one candidate, a POST answers with a flat list of candidates for all its lookups
 @dataclass
 class SmartyGeocodingResponse:
     delivery_line_1: str
     last_line: str
     components: SmartyComponents
     metadata: SmartyMetadata
+    analysis: Optional[SmartyAnalysis] = None
+    input_id: str = ''
+    input_index: int = 0  # position of the lookup in the POST body
+    candidate_index: int = 0
 
 SAMPLE_RESULTS = """{
   "input_id": "0",
@@ -0,0 +1,138 @@
+import numpy as np
+from scipy.spatial import cKDTree
+from typing import Any, Dict, List, Tuple
+
+from geode.dist_metrics import R_EARTH
+from geode.utils import key_points
+
+# points added since the last build are kept in a small side tree until they reach this share of the main tree
+REBUILD_RATIO = 0.25
+
+
+def to_xyz(points) -> np.ndarray:
+    """Lat, lon degrees to unit sphere xyz, where straight line distance grows with great circle distance."""
+    p = np.radians(np.asarray(points, dtype=float).reshape(-1, 2))
+    cos_lat = np.cos(p[:, 0])
+    return np.column_stack((cos_lat * np.cos(p[:, 1]), cos_lat * np.sin(p[:, 1]), np.sin(p[:, 0])))
+
+
+def meters_to_chord(meters, r=R_EARTH):
+    return 2 * np.sin(np.minimum(np.asarray(meters, dtype=float) / (2 * r), np.pi / 2))
+
+
+def chord_to_meters(chord, r=R_EARTH):
+    chord = np.asarray(chord, dtype=float)
+    # inf marks no point found and stays inf
+    return np.where(np.isinf(chord), np.inf, 2 * r * np.arcsin(np.minimum(chord / 2, 1)))
+
+
+class PointIndex:
+    """
+    Nearest known point within a radius, for lat, lon points.
+    Inserts go to a side tree rebuilt on the next query, the main tree is rebuilt once they outgrow rebuild_ratio.
+    """
+
+    def __init__(self, points=None, rebuild_ratio=REBUILD_RATIO):
+        self.rebuild_ratio = rebuild_ratio
+        self.xyz = np.empty((0, 3))
+        self.tree = None
+        self.built = 0  # points in tree, the rest are in side_tree
+        self.side_tree = None
+
+        if points is not None:
+            self.add(points)
+
+    def __len__(self):
+        return len(self.xyz)
+
+    def add(self, points) -> np.ndarray:
+        """:return: positions of the added points"""
+        xyz = to_xyz(points)
+        start = len(self.xyz)
+        self.xyz = np.vstack((self.xyz, xyz))
+        self.side_tree = None
+        return np.arange(start, len(self.xyz))
+
+    def nearest(self, points, radius):
+        """
+        :param radius: Meters
+        :return: position of the nearest point within radius or -1, great circle meters or inf
+        """
+        self._build()
+        xyz = to_xyz(points)
+        bound = meters_to_chord(radius)
+
+        chord = np.full(len(xyz), np.inf)
+        pos = np.full(len(xyz), -1, dtype=np.int64)
+        if not len(xyz):
+            return pos, chord
+
+        for tree, offset in ((self.tree, 0), (self.side_tree, self.built)):
+            if tree is None:
+                continue
+            # upper bound is exclusive, radius is not
+            d, i = tree.query(xyz, k=1, distance_upper_bound=np.nextafter(bound, np.inf))
+            closer = d < chord
+            chord[closer] = d[closer]
+            pos[closer] = i[closer] + offset
+
+        return pos, chord_to_meters(chord)
+
+    def _build(self):
+        n = len(self.xyz)
+        if n - self.built > self.rebuild_ratio * self.built:
+            self.tree = cKDTree(self.xyz) if n else None
+            self.built = n
+            self.side_tree = None
+        elif n > self.built and self.side_tree is None:
+            self.side_tree = cKDTree(self.xyz[self.built:])
+
+
+# snap result of points with no indexed location near, no valid point packs to it
+NO_KEY = -1
+
+
+class SnapIndex:
+    """
+    Locations with cached distances per provider, origins and destinations apart.
+    Query points within radius of one are moved onto it, so its cached distances answer for them.
+    """
+
+    def __init__(self, radius=25.):
+        """
+        :param radius: Meters a point may move
+        """
+        self.radius = radius
+        # provider -> side -> (index, packed keys by position, known keys)
+        self.sides: Dict[Any, Dict[str, Tuple[PointIndex, List[int], set]]] = {}
+
+    def __contains__(self, provider):
+        return provider in self.sides
+
+    def add(self, provider, okeys, dkeys):
+        """Index packed keys not indexed yet, see geode.utils.pack_keys."""
+        sides = self.sides.setdefault(provider, {side: (PointIndex(), [], set()) for side in 'od'})
+
+        for side, keys in (('o', okeys), ('d', dkeys)):
+            index, by_position, known = sides[side]
+            new = [k for k in dict.fromkeys(np.asarray(keys, dtype=np.int64).tolist()) if k not in known]
+            if new:
+                known.update(new)
+                by_position.extend(new)
+                index.add(key_points(new))
+
+    def snap(self, provider, points, side) -> np.ndarray:
+        """
+        :param side: 'o' for origins, 'd' for destinations
+        :return: packed key of the nearest indexed location within radius, NO_KEY where there is none.
+            Keys south of the equator are negative too.
+        """
+        keys = np.full(len(points), NO_KEY, dtype=np.int64)
+        if provider not in self.sides or not len(points):
+            return keys
+
+        index, by_position, _ = self.sides[provider][side]
+        pos, _ = index.nearest(points, self.radius)
+        found = pos >= 0
+        keys[found] = np.asarray(by_position, dtype=np.int64)[pos[found]]
+        return keys
@@ -1,9 +1,13 @@
 import dataclasses
 import enum
+import os
+import re
+import typing
 import numpy as np
 import pandas as pd
+from contextlib import contextmanager
 from itertools import zip_longest
-from typing import Any, Optional, Union
+from typing import Any, Callable, Dict, Optional, Union
 
 
 def point_to_str(point: np.ndarray, precision=4):
@@ -13,19 +17,119 @@ def point_to_str(point: np.ndarray, precision=4):
     return f"""{point[0]:.{precision}f},{point[1]:.{precision}f}"""
 
 
+# decimal places kept for coordinates, matches decimal(7, 4) cache columns
+PRECISION = 4
+
+# lon is biased into the low 32 bits so packed keys sort like (lat, lon) rows
+LON_BIAS = 1 << 31
+LAT_SHIFT = 32
+
+
+def quantize(points, precision=PRECISION) -> np.ndarray:
+    """
+    :param points: Locations like format [[42.3, -88.7], [40.1, -89.5], ...]
+    :return: int32 lat, lon grid units of 10^-precision degrees
+    """
+    return np.rint(np.asarray(points, dtype=float).reshape(-1, 2) * 10 ** precision).astype(np.int32)
+
+
+def dequantize(grid, precision=PRECISION) -> np.ndarray:
+    return np.asarray(grid, dtype=np.int64) / 10 ** precision
+
+
+def pack_keys(grid) -> np.ndarray:
+    """Pack int32 lat, lon grid rows into single int64 keys."""
+    grid = np.asarray(grid, dtype=np.int64).reshape(-1, 2)
+    return (grid[:, 0] << LAT_SHIFT) + (grid[:, 1] + LON_BIAS)
+
+
+def unpack_keys(keys) -> np.ndarray:
+    keys = np.asarray(keys, dtype=np.int64)
+    return np.column_stack((keys >> LAT_SHIFT, (keys & 0xFFFFFFFF) - LON_BIAS)).astype(np.int32)
+
+
+def point_keys(points, precision=PRECISION) -> np.ndarray:
+    return pack_keys(quantize(points, precision))
+
+
+def key_points(keys, precision=PRECISION) -> np.ndarray:
+    return dequantize(unpack_keys(keys), precision)
+
+
+def unique_points(points, precision=PRECISION):
+    """
+    Hash based dedup of locations on quantized keys.
+    :return: unique points sorted by lat, lon, their keys, inverse positions of input points
+    """
+    inv, keys = pd.factorize(point_keys(points, precision), sort=True)
+    return key_points(keys, precision), keys, inv
+
+
 O_COLS = ['olat', 'olon']
 D_COLS = ['dlat', 'dlon']
 KEY_COLS = O_COLS + D_COLS
 
 
-def create_dist_index(origins, destinations):
-    df = pd.DataFrame(origins, columns=O_COLS).assign(k=0).merge(
-        pd.DataFrame(destinations, columns=D_COLS).assign(k=0),
-        on='k'
-    ).drop('k', 1)
-    df.set_index(KEY_COLS, drop=True, inplace=True)
+def cell_codes(oidx, didx, dlen) -> np.ndarray:
+    """
+    Flat int64 address of origin x destination cells.
+    :param oidx: Positions into origins array
+    :param didx: Positions into destinations array
+    :param dlen: Number of destinations
+    """
+    return np.asarray(oidx, dtype=np.int64) * dlen + np.asarray(didx, dtype=np.int64)
+
+
+def split_cells(codes, dlen):
+    """Inverse of cell_codes, gives back origin and destination positions."""
+    return np.divmod(np.asarray(codes, dtype=np.int64), dlen)
 
-    return df
+
+def cell_positions(cells, codes):
+    """
+    :param cells: Sorted unique cell codes
+    :param codes: Cell codes to find
+    :return: positions of codes in cells, mask of codes found
+    """
+    pos = np.searchsorted(cells, codes)
+    pos[pos == len(cells)] = 0
+    found = (cells[pos] == codes) if len(cells) else np.zeros(len(codes), dtype=bool)
+    return pos, found
+
+
+def lookup_cells(okeys, dkeys, row_okeys, row_dkeys) -> np.ndarray:
+    """
+    :param okeys: Unique origin keys
+    :param dkeys: Unique destination keys
+    :param row_okeys: Origin key of each row to find
+    :param row_dkeys: Destination key of each row to find
+    :return: cell codes of rows, -1 where a key is not in origins or destinations
+    """
+    oidx = pd.Index(okeys).get_indexer(np.asarray(row_okeys, dtype=np.int64))
+    didx = pd.Index(dkeys).get_indexer(np.asarray(row_dkeys, dtype=np.int64))
+
+    codes = cell_codes(oidx, didx, len(dkeys))
+    codes[(oidx < 0) | (didx < 0)] = -1
+
+    return codes
+
+
+def create_cell_index(origins, destinations, codes=None) -> pd.MultiIndex:
+    """
+    Materialize olat, olon, dlat, dlon index for cell codes, full cross product if no codes given.
+    """
+    dlen = len(destinations)
+    if codes is None:
+        codes = np.arange(len(origins) * dlen, dtype=np.int64)
+
+    oidx, didx = split_cells(codes, dlen)
+
+    return pd.MultiIndex.from_arrays([
+        origins[oidx, 0],
+        origins[oidx, 1],
+        destinations[didx, 0],
+        destinations[didx, 1]
+    ], names=KEY_COLS)
 
 
 def grouper(iterable, n, fillvalue=None):
@@ -36,35 +140,50 @@ def grouper(iterable, n, fillvalue=None):
         return zip_longest(*args, fillvalue=fillvalue)
 
 
+@contextmanager
+def replace_file(path, mode='w'):
+    """
+    Open a file written next to path, moved over path once the block completes.
+    A crash or error never leaves a half written file at path.
+    """
+    tmp = f'{path}.tmp'
+    try:
+        with open(tmp, mode) as f:
+            yield f
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
 class UnionParseException(Exception):
     def __init__(self, wrapped: Exception = None):
         self.wrapped = wrapped
 
 
-# TODO: extract to separate library and directly parse json string to dataclass
-def marshall_to(cls: Any, data: Optional[Any]):
+def marshall_to_reflective(cls: Any, data: Optional[Any]):
+    """Walks cls on every call, kept for debugging compiled marshallers."""
     if data is None:
         return data
 
     if dataclasses.is_dataclass(cls):
         params = {}
         for field in dataclasses.fields(cls):
-            params[field.name] = marshall_to(field.type, data.get(field.name))
+            params[field.name] = marshall_to_reflective(field.type, data.get(field.name))
         return cls(**params)
 
     elif hasattr(cls, '__origin__'):
         if cls.__origin__ == list:
-            fn = lambda x: marshall_to(cls.__args__[0], x)
+            fn = lambda x: marshall_to_reflective(cls.__args__[0], x)
             return list(map(fn, data))
 
         elif cls.__origin__ == Union:
             types = cls.__args__
 
             last_err = UnionParseException()
-            # TODO:more efficient matching
             for t in types:
                 try:
-                    return marshall_to(t, data)
+                    return marshall_to_reflective(t, data)
                 except Exception as err:
                     last_err = UnionParseException(err)
 
@@ -78,6 +197,161 @@ def marshall_to(cls: Any, data: Optional[Any]):
     return cls(data)
 
 
+def marshall_to(cls: Any, data: Optional[Any]):
+    """Build cls from json data, with a marshaller compiled once per type."""
+    return compile_marshaller(cls)(data)
+
+
+# compiled marshaller per target type
+MARSHALLERS: Dict[Any, Callable[[Any], Any]] = {}
+
+
+def compile_marshaller(cls: Any) -> Callable[[Any], Any]:
+    fn = MARSHALLERS.get(cls)
+    if fn is None:
+        fn = _compile(cls)
+    return fn
+
+
+def _compile(cls):
+    if dataclasses.is_dataclass(cls):
+        return _compile_dataclass(cls)
+
+    origin = getattr(cls, '__origin__', None)
+    if origin is list:
+        item = compile_marshaller(cls.__args__[0])
+        fn = lambda data: None if data is None else [item(x) for x in data]
+
+    elif origin is Union:
+        fn = _compile_union(cls.__args__)
+
+    elif origin is not None:
+        fn = lambda data: data
+
+    elif issubclass(cls, enum.Enum):
+        members = cls.__members__
+        fn = lambda data: None if data is None else members[data]
+
+    elif isinstance(cls, type) and issubclass(cls, tuple) and hasattr(cls, '_fields'):
+        fn = lambda data: None if data is None else cls(*data)
+
+    else:
+        fn = lambda data: None if data is None else cls(data)
+
+    MARSHALLERS[cls] = fn
+    return fn
+
+
+PRIMITIVES = (str, int, float, bool)
+
+
+def _compile_dataclass(cls):
+    """
+    Generate one function per dataclass, primitive, enum and list fields converted inline,
+    nested types through their own compiled marshaller.
+    """
+    fields = dataclasses.fields(cls)
+    try:
+        hints = typing.get_type_hints(cls)
+    except Exception:
+        hints = {}
+
+    # plain dataclasses skip __init__ and get attributes set directly
+    direct = (
+        not hasattr(cls, '__post_init__') and
+        not cls.__dataclass_params__.frozen and
+        all(field.init for field in fields)
+    )
+
+    scope = {'cls': cls, 'new': object.__new__}
+    lines = [
+        'def marshall(data):',
+        '    if data is None:',
+        '        return None',
+        '    get = data.get',
+    ]
+    if direct:
+        lines.append('    o = new(cls)')
+
+    nested = []
+    for i, field in enumerate(fields):
+        t = hints.get(field.name, field.type)
+        target = f'o.{field.name}' if direct else f'a{i}'
+        lines.append(f'    v = get({field.name!r})')
+
+        if t in PRIMITIVES:
+            scope[f't{i}'] = t
+            lines.append(f'    {target} = None if v is None else t{i}(v)')
+        elif isinstance(t, type) and issubclass(t, enum.Enum):
+            scope[f't{i}'] = t.__members__
+            lines.append(f'    {target} = None if v is None else t{i}[v]')
+        elif getattr(t, '__origin__', None) is list:
+            nested.append((f'f{i}', t.__args__[0]))
+            lines.append(f'    {target} = None if v is None else [f{i}(x) for x in v]')
+        else:
+            nested.append((f'f{i}', t))
+            lines.append(f'    {target} = f{i}(v)')
+
+    if direct:
+        lines.append('    return o')
+    else:
+        lines.append(f'    return cls({", ".join(f"{field.name}=a{i}" for i, field in enumerate(fields))})')
+
+    exec('\n'.join(lines) + '\n', scope)
+    fn = scope['marshall']
+
+    # registered before nested types compile, so self referencing types resolve to it
+    MARSHALLERS[cls] = fn
+    for name, t in nested:
+        scope[name] = compile_marshaller(t)
+
+    return fn
+
+
+def _union_predicate(t):
+    """Cheap check whether data is shaped like t, picks the Union member instead of trying each."""
+    if dataclasses.is_dataclass(t):
+        required = frozenset(
+            f.name for f in dataclasses.fields(t)
+            if f.default is dataclasses.MISSING and f.default_factory is dataclasses.MISSING
+        )
+        return lambda data: isinstance(data, dict) and required <= data.keys()
+
+    if getattr(t, '__origin__', None) is list:
+        return lambda data: isinstance(data, list)
+
+    if isinstance(t, type) and issubclass(t, enum.Enum):
+        return lambda data: isinstance(data, str) and data in t.__members__
+
+    if isinstance(t, type) and issubclass(t, tuple) and hasattr(t, '_fields'):
+        return lambda data: isinstance(data, (list, tuple)) and len(data) == len(t._fields)
+
+    if t is float:
+        return lambda data: isinstance(data, (int, float)) and not isinstance(data, bool)
+
+    if t in (str, int, bool):
+        return lambda data: isinstance(data, t)
+
+    return lambda data: True
+
+
+def _compile_union(types):
+    options = [(_union_predicate(t), compile_marshaller(t)) for t in types if t is not type(None)]
+
+    if len(options) == 1:
+        return options[0][1]
+
+    def marshall(data):
+        if data is None:
+            return None
+        for matches, fn in options:
+            if matches(data):
+                return fn(data)
+        raise UnionParseException(TypeError(f'{type(data).__name__} matches none of {types}'))
+
+    return marshall
+
+
 def addresses_to_df(addresses):
     df = pd.concat(map(pd.io.json.json_normalize, map(dataclasses.asdict, addresses)))
     df.reset_index(drop=True, inplace=True)
@@ -89,3 +363,8 @@ def addresses_to_df(addresses):
 
 def first_or_none(arr):
     return next(iter(arr), None)
+
+
+def normalize_address(address: str) -> str:
+    """Case and whitespace folded address, for matching repeat requests."""
+    return re.sub(r'\s+', ' ', re.sub(r'\s*,\s*', ', ', address.strip())).casefold()
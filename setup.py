@@ -19,5 +19,6 @@ setup(
         'ujson',
         'asyncpg',
         'pyyaml',
-        'tenacity'
+        'tenacity',
+        'usaddress'
     ])
@@ -1,8 +1,15 @@
 import pytest
+import pytest_asyncio
 import urllib3
 import subprocess
 import time
 
+from geode.dispatcher import AsyncDispatcher
+from tests.fakes import FakeMatrix
+
+# dispatcher config of make_dispatcher unless given one
+MEMORY_CONFIG = {'providers': {}, 'caching': {'memory': {}}}
+
 
 class MockServer:
     def __init__(self):
@@ -43,3 +50,24 @@ def test_client_config():
             }
         }
     }
+
+
+@pytest_asyncio.fixture
+async def make_dispatcher():
+    """
+    Factory of dispatchers answering provider 'fake' with client, a new FakeMatrix by default.
+    Every dispatcher made is closed after the test.
+    """
+    made = []
+
+    async def make(config=None, client=None):
+        dispatcher = await AsyncDispatcher.init(MEMORY_CONFIG if config is None else config)
+        if dispatcher.cache:
+            await dispatcher.cache.init(['fake'])
+        dispatcher.providers = {'fake': client or FakeMatrix()}
+        made.append(dispatcher)
+        return dispatcher
+
+    yield make
+    for dispatcher in made:
+        await dispatcher.close()
@@ -0,0 +1,68 @@
+import asyncio
+
+import numpy as np
+import pandas as pd
+
+import geode.models as m
+from geode import dist_metrics
+from geode.utils import point_keys
+
+ORIGS = np.array([[37.1, -88.1],
+                  [37.2, -88.2]])
+
+DESTS = np.array([[37.1, -86.1],
+                  [41.9, -97.2],
+                  [45.5, -97.5]])
+
+
+def distances(origins, destinations, meters, seconds=None):
+    """Cache rows of origins x destinations, seconds default to meters / 10."""
+    okeys = point_keys(origins)
+    dkeys = point_keys(destinations)
+    return pd.DataFrame({
+        'okey': np.repeat(okeys, len(dkeys)),
+        'dkey': np.tile(dkeys, len(okeys)),
+        'meters': meters,
+        'seconds': np.asarray(meters) / 10 if seconds is None else seconds,
+    })
+
+
+class FakeMatrix(m.distance_matrix.Client):
+    """Drives 1.3x haversine at 25 m/s, counts elements requested."""
+    area_max = 625
+    factor_max = 380
+
+    def __init__(self):
+        self.elements = 0
+
+    @m.distance_matrix.partition
+    async def distance_matrix(self, origins, destinations, session=None):
+        self.elements += len(origins) * len(destinations)
+        d = dist_metrics.matrix('haversine', origins, destinations) * 1.3
+        res = np.recarray(d.shape, dtype=m.distance_matrix.RECORD)
+        res.meters = d.round()
+        res.seconds = (d / 25).round()
+        return m.distance_matrix.Result(origins=origins, destinations=destinations, distances=res)
+
+
+RESULT = m.geocoding.Result(
+    address=m.Address(formatted='1600 Amphitheatre Pkwy, Mountain View, CA', number='1600', state='CA'),
+    point=m.GeoPoint(37.4225, -122.0842),
+    confidence=m.geocoding.Confidence.EXACT,
+    precision=m.geocoding.Precision.ROOFTOP
+)
+
+
+class FakeGeocoder(m.geocoding.Client):
+    """Answers RESULT, nothing for 'nowhere' and fails on 'broken'."""
+    def __init__(self):
+        self.calls = []
+
+    async def geocode(self, location, session=None):
+        self.calls.append(location)
+        await asyncio.sleep(0)
+        if location == 'broken':
+            raise m.geocoding.GeocodeError('REQUEST_DENIED')
+        if location == 'nowhere':
+            return []
+        return [RESULT]
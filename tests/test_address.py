@@ -0,0 +1,47 @@
+import pytest
+
+import geode.models as m
+from geode.address import canonical_address, dedup_locations
+from tests.fakes import FakeGeocoder, RESULT
+
+
+def test_canonical():
+    assert canonical_address('500 Rutherford Ave., Boston, MA 02129') == '500 rutherford ave boston ma 02129'
+    assert canonical_address('500 rutherford  avenue boston massachusetts 02129-1234') == \
+        '500 rutherford ave boston ma 02129'
+    assert canonical_address('123 North Main St., Apartment 4B, New York, New York') == \
+        canonical_address('123 N. Main Street Apt 4B, New York, NY')
+
+    # different places stay apart
+    assert canonical_address('500 Rutherford Ave, Boston') != canonical_address('500 Rutherford St, Boston')
+    assert canonical_address('1 Main St Apt 4B') != canonical_address('1 Main St Apt 5B')
+    # street named after a direction
+    assert canonical_address('North Ave, Chicago IL') == 'north ave chicago il'
+
+
+def test_dedup():
+    locations = [
+        '500 Rutherford Ave., Boston, MA',
+        m.GeoPoint(42.3601, -71.0589),
+        '500 rutherford avenue boston ma',
+        (42.36012, -71.05891),
+        '500 Rutherford Ave., Boston, MA',
+    ]
+    keys, unique, inverse = dedup_locations(locations)
+
+    assert keys == ['500 rutherford ave boston ma', '42.3601,-71.0589']
+    assert unique == locations[:2]
+    assert inverse.tolist() == [0, 1, 0, 1, 0]
+
+
+@pytest.mark.asyncio
+async def test_batch_geocode(make_dispatcher):
+    client = FakeGeocoder()
+    dispatcher = await make_dispatcher({'providers': {}}, client)
+
+    res = await dispatcher.batch_geocode(
+        ['1600 Amphitheatre Parkway', 'nowhere', '1600 amphitheatre pkwy.', 'Nowhere'], provider='fake')
+
+    assert res == [RESULT, None, RESULT, None]
+    assert client.calls == ['1600 Amphitheatre Parkway', 'nowhere']
+    assert dispatcher.geocode_dedup.dedup_ratio == 0.5
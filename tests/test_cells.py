@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+
+from geode.models.distance_matrix import Cells
+from geode.utils import (
+    cell_codes, cell_positions, create_cell_index, lookup_cells, split_cells,
+    quantize, pack_keys, unpack_keys, point_keys, key_points, unique_points
+)
+
+ORIGS = np.array([[37.1, -88.1],
+                  [37.2, -88.2]])
+
+DESTS = np.array([[37.1, -88.1],
+                  [41.9, -97.2],
+                  [45.5, -97.5]])
+
+
+def test_codes_roundtrip():
+    oidx, didx = np.meshgrid(range(len(ORIGS)), range(len(DESTS)), indexing='ij')
+    codes = cell_codes(oidx.ravel(), didx.ravel(), len(DESTS))
+
+    np.testing.assert_array_equal(codes, np.arange(6))
+
+    o, d = split_cells(codes, len(DESTS))
+    np.testing.assert_array_equal(o, oidx.ravel())
+    np.testing.assert_array_equal(d, didx.ravel())
+
+
+def test_create_cell_index():
+    pd.testing.assert_index_equal(
+        create_cell_index(ORIGS, DESTS, np.array([1, 3])),
+        pd.MultiIndex.from_tuples([
+            (37.1, -88.1, 41.9, -97.2),
+            (37.2, -88.2, 37.1, -88.1),
+        ], names=['olat', 'olon', 'dlat', 'dlon'])
+    )
+
+    assert len(create_cell_index(ORIGS, DESTS)) == 6
+
+
+def test_lookup_cells():
+    rows = np.array([
+        (37.2, -88.2, 45.5, -97.5),
+        (37.1, -88.1, 37.1, -88.1),
+        (37.1, -88.1, 10.0, 10.0),
+    ])
+
+    np.testing.assert_array_equal(
+        lookup_cells(point_keys(ORIGS), point_keys(DESTS), point_keys(rows[:, 0:2]), point_keys(rows[:, 2:4])),
+        [5, 0, -1]
+    )
+
+
+def test_keys_roundtrip():
+    grid = np.array([[-900000, -1800000], [0, 0], [371000, -881000], [900000, 1800000]])
+
+    np.testing.assert_array_equal(unpack_keys(pack_keys(grid)), grid)
+    np.testing.assert_array_equal(quantize([[37.10004, -88.09996]]), [[371000, -881000]])
+    np.testing.assert_array_equal(key_points(point_keys(ORIGS)), ORIGS)
+
+
+def test_unique_points():
+    points = np.array([[37.1, -88.1],
+                       [-33.9, 151.2],
+                       [37.10001, -88.09999],
+                       [0., -180.]])
+
+    uniq, keys, inv = unique_points(points)
+
+    # same order as np.unique on rounded rows
+    np.testing.assert_array_equal(uniq, np.unique(points.round(4), axis=0))
+    np.testing.assert_array_equal(uniq[inv], points.round(4))
+    assert np.all(np.diff(keys) > 0)
+
+
+def test_cell_positions():
+    pos, found = cell_positions(np.array([1, 4, 5]), np.array([4, 6, 0, 1]))
+
+    np.testing.assert_array_equal(found, [True, False, False, True])
+    np.testing.assert_array_equal(pos[found], [1, 0])
+
+
+def test_cells_frame_sources():
+    cells = Cells(
+        origins=ORIGS, destinations=DESTS, cells=np.arange(2, dtype=np.int64),
+        meters=np.array([1., 2.]), seconds=np.array([3., 4.]), source=np.array([0, 1], dtype=np.int8),
+        sources=['gc_manhattan', None]
+    )
+    assert cells.to_frame().source.tolist() == ['gc_manhattan', np.nan]
+
+    cells.sources = ['google', 'google']
+    assert cells.to_frame().source.tolist() == ['google', 'google']
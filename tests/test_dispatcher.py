@@ -0,0 +1,136 @@
+import asyncio
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from geode.dispatcher import TILE_CELLS, Dispatcher, origin_tiles
+from tests.fakes import FakeMatrix
+
+CONFIG: dict = {'providers': {}}
+
+# around Chicago, all within provider range of each other
+ORIGS = np.array([[41.8, -87.6], [41.9, -87.7], [42.0, -87.8], [41.7, -87.9], [41.6, -88.0]])
+DESTS = np.array([[41.5, -87.5], [42.1, -88.1], [41.95, -87.65]])
+
+
+async def running_loop():
+    return asyncio.get_running_loop()
+
+
+def test_lifecycle():
+    with Dispatcher(CONFIG) as client:
+        session = client.run(client.get_session())
+
+        # one loop and session for every call
+        assert client.run(client.get_session()) is session
+        assert client.run(running_loop()) is client.run(running_loop()) is client.loop
+        assert client.thread.is_alive()
+
+    assert session.closed
+    assert client.loop.is_closed()
+    assert not client.thread.is_alive()
+
+    # closing again is a no-op
+    client.close()
+
+
+def test_unthreaded():
+    client = Dispatcher(CONFIG, threaded=False)
+
+    assert client.thread is None
+    assert client.run(running_loop()) is client.loop
+
+    client.close()
+    assert client.loop.is_closed()
+
+
+def test_origin_tiles():
+    assert origin_tiles(5, 3, tile_size=2) == [slice(0, 2), slice(2, 4), slice(4, 6)]
+    assert origin_tiles(4, 3, tile_size=2) == [slice(0, 2), slice(2, 4)]
+    assert origin_tiles(0, 3, tile_size=2) == []
+
+    # default fits TILE_CELLS, at least one origin per tile
+    assert origin_tiles(5, TILE_CELLS // 2) == [slice(0, 2), slice(2, 4), slice(4, 6)]
+    assert origin_tiles(2, TILE_CELLS * 2) == [slice(0, 1), slice(1, 2)]
+
+
+@pytest.mark.asyncio
+async def test_stream(make_dispatcher):
+    dispatcher = await make_dispatcher(CONFIG)
+    client = dispatcher.providers['fake']
+
+    blocks = [b async for b in dispatcher.distance_matrix_stream(ORIGS, DESTS, tile_size=2, provider='fake')]
+
+    # ragged last tile
+    assert [len(b) for b in blocks] == [2 * len(DESTS), 2 * len(DESTS), len(DESTS)]
+    assert [b.index.get_level_values(0).nunique() for b in blocks] == [2, 2, 1]
+    assert client.elements == len(ORIGS) * len(DESTS)
+
+    full = await dispatcher.distance_matrix(ORIGS, DESTS, provider='fake')
+    pd.testing.assert_frame_equal(pd.concat(blocks).sort_index(), full.sort_index())
+
+    cells = [b async for b in dispatcher.distance_matrix_stream(ORIGS, DESTS, tile_size=2, provider='fake', as_frame=False)]
+    assert [len(c.origins) for c in cells] == [2, 2, 1]
+    assert all(len(c.destinations) == len(DESTS) for c in cells)
+    np.testing.assert_array_equal(
+        np.concatenate([c.meters for c in cells]),
+        (await dispatcher.distance_matrix(ORIGS, DESTS, provider='fake', as_frame=False)).meters
+    )
+
+
+@pytest.mark.asyncio
+async def test_stream_prefetch(make_dispatcher):
+    dispatcher = await make_dispatcher(CONFIG)
+    client = dispatcher.providers['fake']
+
+    stream = dispatcher.distance_matrix_stream(ORIGS, DESTS, tile_size=2, provider='fake')
+    await stream.__anext__()
+    await asyncio.sleep(0.01)
+
+    # next tile fetched while the first is consumed, no further
+    assert client.elements == 4 * len(DESTS)
+
+    await stream.aclose()
+
+
+def test_sync_stream():
+    with Dispatcher(CONFIG) as client:
+        client.dispatcher.providers = {'fake': FakeMatrix()}
+
+        blocks = list(client.distance_matrix_stream(ORIGS, DESTS, tile_size=2, provider='fake'))
+        assert [len(b) for b in blocks] == [2 * len(DESTS), 2 * len(DESTS), len(DESTS)]
+        pd.testing.assert_frame_equal(
+            pd.concat(blocks).sort_index(),
+            client.distance_matrix(ORIGS, DESTS, provider='fake').sort_index()
+        )
+
+        # stopping early leaves nothing running
+        stream = client.distance_matrix_stream(ORIGS, DESTS, tile_size=2, provider='fake')
+        next(stream)
+        stream.close()
+
+
+@pytest.mark.asyncio
+async def test_session_deprecated(make_dispatcher):
+    async with await make_dispatcher(CONFIG) as dispatcher:
+        with pytest.deprecated_call():
+            res = await dispatcher.distance_matrix(ORIGS, DESTS, provider='fake', session=object())
+
+        # requests ran on the dispatcher session
+        assert len(res) == len(ORIGS) * len(DESTS)
+        assert dispatcher.session is not None
+
+    assert dispatcher.session is None
+
+
+def test_no_provider():
+    # every cell beyond max_meters, estimates need no provider
+    far = np.array([[25.8, -80.2], [29.8, -95.4]])
+    with Dispatcher(CONFIG) as client:
+        res = client.distance_matrix(ORIGS, far)
+        assert len(res) == len(ORIGS) * len(far)
+        assert (res.source == 'gc_manhattan').all()
+
+        res = client.distance_pairs(ORIGS[:2], far)
+        assert (res.source == 'gc_manhattan').all()
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from geode import dist_metrics
+
+ORIGS = np.array([[37.1, -88.1],
+                  [37.2, -88.2],
+                  [42.5, -97.5],
+                  [-33.9, 151.2]])
+
+DESTS = np.array([[37.1, -88.1],
+                  [37.1, -86.1],
+                  [41.9, -97.2],
+                  [45.5, -97.5],
+                  [51.5, -0.1]])
+
+
+@pytest.mark.parametrize('metric, scalar', [
+    ('haversine', dist_metrics.haversine),
+    ('gc_manhattan', dist_metrics.gc_manhattan),
+])
+def test_matrix_matches_scalar(metric, scalar):
+    expected = [[scalar(o, d) for d in DESTS] for o in ORIGS]
+
+    # chunk smaller than a row still covers every origin
+    for chunk_size in [1, 7, dist_metrics.CHUNK_SIZE]:
+        np.testing.assert_allclose(
+            dist_metrics.matrix(metric, ORIGS, DESTS, chunk_size=chunk_size),
+            expected,
+            atol=1e-6
+        )
+
+
+@pytest.mark.parametrize('metric', list(dist_metrics.METRICS))
+def test_pairwise_matches_matrix(metric):
+    dests = DESTS[:len(ORIGS)]
+
+    np.testing.assert_allclose(
+        dist_metrics.pairwise(metric, ORIGS, dests, chunk_size=3),
+        np.diag(dist_metrics.matrix(metric, ORIGS, dests)),
+        atol=1e-6
+    )
+
+
+def test_empty():
+    assert dist_metrics.matrix('gc_manhattan', np.empty((0, 2)), DESTS).shape == (0, len(DESTS))
+    assert dist_metrics.pairwise('gc_manhattan', np.empty((0, 2)), np.empty((0, 2))).shape == (0,)
+
+
+def test_unknown_metric():
+    with pytest.raises(ValueError):
+        dist_metrics.matrix('vincenty', ORIGS, DESTS)
@@ -48,16 +48,16 @@ def test_main(mock_server, test_client_config):
     expected_meters = [
         0.,
         444779.,
-        1143293.274236,
-        1400881.808377,
+        1313364.776256,
+        1717819.586708,
 
         44477.,
         489257.,
-        1128289.345949,
-        1385191.366365,
+        1293132.527215,
+        1697774.795888,
 
-        1204670.037841,
-        1401763.032474,
+        1402236.876427,
+        1572698.165443,
         200150.,
         667169.
     ]
@@ -124,9 +124,9 @@ def test_pairs(mock_server, test_client_config):
 
     expected_meters = [
         0.,
-        1143293.274236,
-        1385191.366365,
-        1401763.032474
+        1313364.776256,
+        1697774.795888,
+        1572698.165443
     ]
 
     np.testing.assert_array_almost_equal(
@@ -0,0 +1,129 @@
+import numpy as np
+import pytest
+
+from geode import dist_metrics
+from geode.cache import MemoryCache
+from geode.estimator import Estimator
+from tests.fakes import distances
+
+rng = np.random.default_rng(0)
+
+# around Chicago, FakeMatrix drives 1.3x straight line at 25 m/s
+ORIGS = rng.random((30, 2)) * [0.6, 0.6] + [41.6, -87.9]
+DESTS = rng.random((40, 2)) * [0.6, 0.6] + [41.6, -87.9]
+
+
+def driven(origins, destinations):
+    """Rows as FakeMatrix answers them."""
+    line = dist_metrics.matrix('haversine', origins, destinations).ravel()
+    return distances(origins, destinations, line * 1.3, line * 1.3 / 25)
+
+
+def test_unfit():
+    meters, seconds, confidence = Estimator().pairwise(ORIGS[:3], DESTS[:3])
+    np.testing.assert_allclose(meters, dist_metrics.pairwise('haversine', ORIGS[:3], DESTS[:3]))
+    np.testing.assert_allclose(seconds, meters / 30)
+    assert (confidence == 0).all()
+
+
+def test_fit():
+    estimator = Estimator().fit(driven(ORIGS, DESTS))
+    assert len(estimator) == len(ORIGS) * len(DESTS)
+
+    u = ORIGS + 0.01
+    meters, seconds, confidence = estimator.matrix(u, DESTS)
+    line = dist_metrics.matrix('haversine', u, DESTS)
+    np.testing.assert_allclose(meters, line * 1.3, rtol=5e-3)
+    np.testing.assert_allclose(seconds, line * 1.3 / 25, rtol=5e-3)
+    assert confidence.shape == line.shape
+
+    # samples agree, confidence only grows with their count
+    _, _, confidence = estimator.matrix(ORIGS, DESTS)
+    line = dist_metrics.matrix('haversine', ORIGS, DESTS)
+    assert (confidence[line > 2000] > 0.7).mean() > 0.95
+
+    # pairwise agrees with the matrix diagonal
+    pm, ps, pc = estimator.pairwise(u[:5], DESTS[:5])
+    np.testing.assert_allclose(pm, np.diag(meters)[:5])
+    np.testing.assert_allclose(pc, np.diag(confidence)[:5])
+
+    # nothing fit in Dallas
+    _, _, confidence = estimator.pairwise([[32.8, -96.8]], [[32.9, -96.7]])
+    assert confidence.tolist() == [0.]
+
+
+def test_spread():
+    rows = driven(ORIGS, DESTS)
+    noisy = rows.assign(meters=rows.meters * rng.uniform(0.5, 2, len(rows)))
+
+    calm = Estimator().fit(rows).matrix(ORIGS, DESTS)[2]
+    rough = Estimator().fit(noisy).matrix(ORIGS, DESTS)[2]
+    assert (rough < calm).all()
+
+
+def test_save_load(tmp_path):
+    path = str(tmp_path / 'estimator.json')
+    estimator = Estimator(grid=0.5).fit(driven(ORIGS, DESTS))
+    estimator.save(path)
+
+    loaded = Estimator(path=path)
+    assert loaded.grid == 0.5
+    for a, b in zip(loaded.matrix(ORIGS, DESTS), estimator.matrix(ORIGS, DESTS)):
+        np.testing.assert_allclose(a, b)
+
+
+@pytest.mark.asyncio
+async def test_fit_cache():
+    cache = MemoryCache()
+    await cache.set_distances(driven(ORIGS[:10], DESTS[:10]), 'google')
+    # tier rows are of rounded locations, not fit
+    await cache.set_distances(driven(ORIGS[10:15], DESTS[:10]), 'google', precision=2)
+
+    estimator = await Estimator().fit_cache(cache, 'google', chunk_rows=30)
+    assert len(estimator) == 100
+
+
+@pytest.mark.asyncio
+async def test_fit_cache_chunks():
+    rows = driven(ORIGS, DESTS)
+    rows = rows.assign(meters=rows.meters * rng.uniform(0.5, 2, len(rows)))
+    cache = MemoryCache()
+    await cache.set_distances(rows, 'google')
+
+    # stats pooled chunk by chunk match a fit of all rows at once
+    whole = Estimator().fit(rows)
+    chunked = await Estimator().fit_cache(cache, 'google', chunk_rows=70)
+    np.testing.assert_array_equal(chunked.codes, whole.codes)
+    np.testing.assert_allclose(chunked.buckets, whole.buckets)
+    np.testing.assert_allclose(chunked.band_stats, whole.band_stats)
+
+    empty = await Estimator().fit_cache(MemoryCache(), 'google')
+    assert len(empty) == 0
+
+
+@pytest.mark.asyncio
+async def test_dispatcher(make_dispatcher, tmp_path):
+    path = str(tmp_path / 'estimator.json')
+    Estimator().fit(driven(ORIGS, DESTS)).save(path)
+
+    dispatcher = await make_dispatcher({
+        'providers': {}, 'caching': {'memory': {}}, 'estimator': {'path': path, 'min_confidence': 0.95}
+    })
+    client = dispatcher.providers['fake']
+
+    # confident cells are estimated, the rest fetched
+    u, v = ORIGS[:10], DESTS[:10]
+    res = await dispatcher.distance_matrix(u, v, provider='fake')
+    _, _, confidence = dispatcher.estimator.matrix(u, v)
+    low = (confidence < 0.95) & (dist_metrics.matrix('haversine', u, v) >= 100)
+    assert 0 < low.sum() < 100
+    # extra cells of planned blocks are cached too
+    assert len(dispatcher.cache.memory) == client.elements >= low.sum()
+    assert (res.source == 'fake').sum() == low.sum()
+    assert (res.source == 'estimator').sum() == 100 - low.sum()
+
+    # nothing fit in Dallas, fetched
+    fetched = client.elements
+    await dispatcher.distance_matrix(np.array([[32.8, -96.8]]), np.array([[32.9, -96.7]]), provider='fake')
+    assert client.elements == fetched + 1
+    assert len(dispatcher.cache.memory) == client.elements
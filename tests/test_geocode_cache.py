@@ -0,0 +1,70 @@
+import time
+
+import pytest
+
+import geode.models as m
+from geode.cache import GeocodeCache, SqliteCache, create_geocode_cache
+from geode.dispatcher import AsyncDispatcher
+from geode.address import geocode_key
+from tests.fakes import FakeGeocoder, RESULT
+
+
+def test_keys():
+    assert geocode_key(' 1600 Amphitheatre Pkwy ,Mountain  View ') == '1600 amphitheatre pkwy mountain view'
+    assert geocode_key(m.GeoPoint(37.42249, -122.08421)) == '37.4225,-122.0842'
+
+
+@pytest.mark.asyncio
+async def test_memory(monkeypatch):
+    cache = GeocodeCache(max_entries=2, ttl=100, negative_ttl=10)
+    await cache.set({'a': [RESULT], 'b': []}, 'google')
+
+    assert await cache.get(['a', 'b', 'c'], 'google') == {'a': [RESULT], 'b': []}
+    assert await cache.get(['a'], 'bing') == {}
+
+    # negative results expire first
+    now = time.time()
+    monkeypatch.setattr('time.time', lambda: now + 50)
+    assert await cache.get(['a', 'b'], 'google') == {'a': [RESULT]}
+
+    await cache.set({'c': [RESULT], 'd': [RESULT]}, 'google')
+    assert list(await cache.get(['a', 'c', 'd'], 'google')) == ['c', 'd']
+
+
+@pytest.mark.asyncio
+async def test_persistent(tmp_path):
+    opts = {'type_': 'sqlite', 'path': str(tmp_path / 'cache.sqlite'), 'geocode': {'negative_ttl': None}}
+
+    backend = await SqliteCache(opts['path']).init(['google'])
+    cache = create_geocode_cache(opts, backend)
+    await cache.set({'a': [RESULT], 'b': []}, 'google')
+    await backend.close()
+
+    backend = await SqliteCache(opts['path']).init(['google'])
+    cache = create_geocode_cache(opts, backend)
+    assert await cache.get(['a', 'b', 'c'], 'google') == {'a': [RESULT], 'b': []}
+    # filled memory on the way out
+    assert len(cache.entries) == 2
+    await backend.close()
+
+
+@pytest.mark.asyncio
+async def test_dispatcher(tmp_path):
+    dispatcher = await AsyncDispatcher.init({
+        'providers': {},
+        'caching': {'type_': 'sqlite', 'path': str(tmp_path / 'cache.sqlite'), 'geocode': {}},
+    })
+    client = FakeGeocoder()
+    dispatcher.providers = {'fake': client}
+    await dispatcher.cache.init(['fake'])
+
+    addresses = ['1600 Amphitheatre Pkwy', '1600 amphitheatre pkwy ', 'nowhere', 'broken']
+    assert await dispatcher.batch_geocode(addresses, provider='fake') == [RESULT, RESULT, None, None]
+    assert client.calls == ['1600 Amphitheatre Pkwy', 'nowhere', 'broken']
+
+    # failures are asked again, misses are not
+    assert await dispatcher.batch_geocode(addresses, provider='fake') == [RESULT, RESULT, None, None]
+    assert await dispatcher.geocode('NOWHERE', provider='fake') == []
+    assert client.calls == ['1600 Amphitheatre Pkwy', 'nowhere', 'broken', 'broken']
+
+    await dispatcher.close()
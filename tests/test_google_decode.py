@@ -0,0 +1,43 @@
+import json
+
+import numpy as np
+
+from geode.google.distance_matrix import decode_distance_matrix_response, map_from_distance_matrix_response
+from geode.google.models import GoogleDistanceMatrixResponse, GoogleStatus
+from geode.utils import marshall_to
+
+
+def element(meters, seconds):
+    return {
+        'distance': {'text': f'{meters / 1000} km', 'value': meters},
+        'duration': {'text': f'{seconds // 60} mins', 'value': seconds},
+        'status': 'OK'
+    }
+
+
+RESPONSE = {
+    'destination_addresses': ['a', 'b', 'c'],
+    'origin_addresses': ['d', 'e'],
+    'rows': [
+        {'elements': [element(1000, 60), {'status': 'NOT_FOUND'}, element(3000, 180)]},
+        {'elements': [{'status': 'ZERO_RESULTS'}, element(5000, 300), element(6000, 360)]},
+    ],
+    'status': 'OK'
+}
+
+
+def test_same_as_dataclasses():
+    decoded = decode_distance_matrix_response(json.dumps(RESPONSE).encode())
+    expected = map_from_distance_matrix_response(marshall_to(GoogleDistanceMatrixResponse, RESPONSE))
+
+    assert decoded.status == GoogleStatus.OK
+    np.testing.assert_array_equal(decoded.distances.meters, expected.meters)
+    np.testing.assert_array_equal(decoded.distances.seconds, expected.seconds)
+    np.testing.assert_array_equal(decoded.element_status, [[1, 2, 1], [3, 1, 1]])
+
+
+def test_over_query_limit():
+    decoded = decode_distance_matrix_response(b'{"rows": [], "status": "OVER_QUERY_LIMIT", "error_message": "slow down"}')
+
+    assert decoded.status == GoogleStatus.OVER_QUERY_LIMIT
+    assert decoded.distances.shape == (0, 0)
@@ -0,0 +1,97 @@
+import enum
+from dataclasses import dataclass, field
+from typing import List, Optional, Union
+
+import pytest
+
+from geode.google.models import GoogleGeocodingResponse, GoogleLocationType, GoogleStatus
+from geode.models import GeoPoint
+from geode.utils import UnionParseException, compile_marshaller, marshall_to, marshall_to_reflective
+
+GEOCODE = {
+    'results': [{
+        'address_components': [
+            {'long_name': '1600', 'short_name': '1600', 'types': ['street_number']},
+            {'long_name': 'Amphitheatre Parkway', 'short_name': 'Amphitheatre Pkwy', 'types': ['route']},
+        ],
+        'formatted_address': '1600 Amphitheatre Parkway, Mountain View, CA 94043, USA',
+        'geometry': {
+            'location': {'lat': 37.4224764, 'lng': -122.0842499},
+            'location_type': 'ROOFTOP',
+            'viewport': {
+                'northeast': {'lat': 37.42, 'lng': -122.08},
+                'southwest': {'lat': 37.41, 'lng': -122.09},
+            },
+        },
+        'partial_match': False,
+        'place_id': 'abc',
+        'types': ['street_address'],
+    }],
+    'status': 'OK'
+}
+
+
+class Shape(enum.Enum):
+    SQUARE = 1
+    CIRCLE = 2
+
+
+@dataclass
+class Square:
+    side: float
+    shape: Shape = Shape.SQUARE
+
+
+@dataclass
+class Circle:
+    radius: float
+    shape: Shape = Shape.CIRCLE
+
+
+@dataclass
+class Node:
+    name: str
+    children: List['Node'] = field(default_factory=list)
+    shape: Optional[Union[Square, Circle]] = None
+    point: Optional[Union[GeoPoint, str]] = None
+
+
+@dataclass(frozen=True)
+class Frozen:
+    value: int
+
+
+def test_same_as_reflective():
+    res = marshall_to(GoogleGeocodingResponse, GEOCODE)
+
+    assert res == marshall_to_reflective(GoogleGeocodingResponse, GEOCODE)
+    assert res.status == GoogleStatus.OK
+    assert res.results[0].geometry.location_type == GoogleLocationType.ROOFTOP
+    assert res.results[0].geometry.bounds is None
+
+    assert compile_marshaller(GoogleGeocodingResponse) is compile_marshaller(GoogleGeocodingResponse)
+
+
+def test_union_discriminator():
+    node = marshall_to(Node, {
+        'name': 'root',
+        'shape': {'radius': 2},
+        'children': [
+            {'name': 'a', 'shape': {'side': 1, 'shape': 'SQUARE'}, 'point': [37.1, -88.1]},
+            {'name': 'b', 'point': '123 Main St', 'children': []},
+        ]
+    })
+
+    assert node.shape == Circle(radius=2., shape=None)
+    assert node.children[0].shape == Square(side=1., shape=Shape.SQUARE)
+    assert node.children[0].point == GeoPoint(37.1, -88.1)
+    assert node.children[1].point == '123 Main St'
+    assert node.children[1].shape is None
+
+    with pytest.raises(UnionParseException):
+        marshall_to(Node, {'name': 'c', 'shape': {'width': 1}})
+
+
+def test_frozen():
+    assert marshall_to(Frozen, {'value': '3'}) == Frozen(3)
+    assert marshall_to(List[Frozen], None) is None
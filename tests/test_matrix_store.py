@@ -0,0 +1,49 @@
+import numpy as np
+
+from geode.matrix_store import MatrixStore
+
+ORIGS = np.array([[37.1, -88.1],
+                  [37.2, -88.2]])
+
+DESTS = np.array([[37.1, -86.1],
+                  [41.9, -97.2],
+                  [45.5, -97.5]])
+
+
+def test_create_update_open(tmp_path):
+    path = str(tmp_path / 'store')
+    store = MatrixStore.create(path, ORIGS, DESTS)
+
+    assert store.shape == (2, 3)
+    assert np.isnan(store.meters).all()
+
+    store.update(ORIGS, DESTS, np.arange(6.).reshape(2, 3), np.arange(6.).reshape(2, 3) / 10)
+    store.flush()
+
+    store = MatrixStore(path)
+    assert isinstance(store.meters, np.memmap)
+
+    meters, seconds = store.submatrix(ORIGS[::-1], np.vstack((DESTS[[2]], [[10., 10.]])))
+    np.testing.assert_array_equal(meters, [[5., np.nan], [2., np.nan]])
+    np.testing.assert_allclose(seconds[:, 0], [.5, .2])
+
+
+def test_extend(tmp_path):
+    path = str(tmp_path / 'store')
+    store = MatrixStore.create(path, ORIGS, DESTS[:2])
+    store.update(ORIGS, DESTS[:2], [[1., 2.], [3., 4.]], [[1., 2.], [3., 4.]])
+
+    # new destination rewrites, new origin appends
+    more = np.array([[30., -90.]])
+    store.extend(more, DESTS)
+    assert store.shape == (3, 3)
+
+    store.set_cells(more, DESTS, np.array([0]), np.array([2]), [9.], [9.])
+    store.flush()
+
+    store = MatrixStore(path)
+    meters, _ = store.submatrix(np.vstack((ORIGS, more)), DESTS)
+    np.testing.assert_array_equal(meters, [[1., 2., np.nan], [3., 4., np.nan], [np.nan, np.nan, 9.]])
+
+    meters, _ = store.get_cells(ORIGS, DESTS, np.array([1, 0]), np.array([0, 2]))
+    np.testing.assert_array_equal(meters, [3., np.nan])
@@ -0,0 +1,151 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from geode.cache import ENTRY_BYTES, MemoryCache, TieredCache, DISTANCE_COLS
+from geode.utils import point_keys
+from tests.fakes import ORIGS, DESTS, distances
+
+
+class DictBackend:
+    def __init__(self):
+        self.rows = pd.DataFrame(columns=DISTANCE_COLS)
+        self.reads = []
+
+    async def get_distances(self, origins, destinations, provider=None, pair=False, precision=4):
+        self.reads.append((len(origins), len(destinations)))
+        return self.rows[
+            self.rows.okey.isin(point_keys(origins)) & self.rows.dkey.isin(point_keys(destinations))
+        ]
+
+    async def set_distances(self, distances, provider, precision=4):
+        self.rows = pd.concat([self.rows, distances], ignore_index=True)
+
+
+@pytest.mark.asyncio
+async def test_lru_eviction():
+    cache = MemoryCache(max_entries=4)
+    await cache.set_distances(distances(ORIGS, DESTS, np.arange(6.)), 'google')
+
+    assert len(cache) == 4
+
+    res = await cache.get_distances(ORIGS, DESTS, provider='google')
+    # oldest two inserted cells are gone
+    assert sorted(res.meters) == [2., 3., 4., 5.]
+
+    # other providers never hit
+    assert (await cache.get_distances(ORIGS, DESTS, provider='bing')).empty
+
+
+@pytest.mark.asyncio
+async def test_reads_refresh_recency():
+    cache = MemoryCache(max_entries=6)
+    await cache.set_distances(distances(ORIGS, DESTS, np.arange(6.)), 'google')
+
+    # first origin read last, its cells outlive the second's
+    await cache.get_distances(ORIGS[:1], DESTS, provider='google')
+    await cache.set_distances(distances(ORIGS + 1, DESTS[:1], [6., 7.]), 'google')
+
+    res = await cache.get_distances(np.vstack((ORIGS, ORIGS + 1)), DESTS, provider='google')
+    assert sorted(res.meters) == [0., 1., 2., 5., 6., 7.]
+
+
+@pytest.mark.asyncio
+async def test_expired_reads_refresh_recency():
+    cache = MemoryCache(max_entries=6)
+    await cache.set_distances(distances(ORIGS[:1], DESTS, [0., 1., 2.]), 'google')
+    await cache.set_distances(distances(ORIGS[1:], DESTS, [3., 4., 5.]), 'google')
+    table = cache.tables[('google', 4)]
+    table.expires[table.meters == 3.] = 0
+
+    # one expired cell in the batch, the first origin's cells are still read
+    origins = np.vstack((np.repeat(ORIGS[:1], len(DESTS), axis=0), ORIGS[1:]))
+    destinations = np.vstack((DESTS, DESTS[:1]))
+    assert len(await cache.get_distances(origins, destinations, provider='google', pair=True)) == 3
+
+    await cache.set_distances(distances(ORIGS + 1, DESTS[:1], [6., 7.]), 'google')
+    res = await cache.get_distances(np.vstack((ORIGS, ORIGS + 1)), DESTS, provider='google')
+    assert sorted(res.meters) == [0., 1., 2., 5., 6., 7.]
+
+
+@pytest.mark.asyncio
+async def test_eviction_drops_locations():
+    cache = MemoryCache(max_entries=6)
+    for i in range(20):
+        await cache.set_distances(distances(ORIGS + i, DESTS + i, np.arange(6.) + 10 * i), 'google')
+
+    table = cache.tables[('google', 4)]
+    assert len(table.locations) == len(np.union1d(table.okey, table.dkey)) < 10
+
+    res = await cache.get_distances(ORIGS + 19, DESTS + 19, provider='google')
+    assert sorted(res.meters) == list(np.arange(6.) + 190)
+
+
+@pytest.mark.asyncio
+async def test_byte_budget_and_ttl():
+    assert MemoryCache(max_bytes=10 * ENTRY_BYTES).capacity == 10
+
+    cache = MemoryCache(ttl=-1)
+    await cache.set_distances(distances(ORIGS, DESTS, np.arange(6.)), 'google')
+
+    assert (await cache.get_distances(ORIGS, DESTS, provider='google')).empty
+    assert not len(cache)
+    assert not len((await cache.get_locations('google'))[0])
+
+
+@pytest.mark.asyncio
+async def test_iter_distances():
+    cache = MemoryCache()
+    await cache.set_distances(distances(ORIGS, DESTS, np.arange(6.)), 'google')
+    await cache.set_distances(distances(ORIGS, DESTS, np.arange(6.) + 100), 'google', precision=2)
+
+    chunks = [rows async for rows in cache.iter_distances('google', chunk_rows=4)]
+    assert [len(rows) for rows in chunks] == [4, 2]
+    assert sorted(pd.concat(chunks).meters) == list(np.arange(6.))
+    assert [rows async for rows in cache.iter_distances('bing')] == []
+
+    # scans are not lookups
+    assert cache.hits == cache.misses == 0
+
+
+@pytest.mark.asyncio
+async def test_pair_lookup():
+    cache = MemoryCache()
+    await cache.set_distances(distances(ORIGS, DESTS, np.arange(6.)), 'google')
+
+    res = await cache.get_distances(ORIGS, DESTS[[2, 0]], provider='google', pair=True)
+
+    assert res.meters.tolist() == [2., 3.]
+
+
+@pytest.mark.asyncio
+async def test_tiered_read_through():
+    backend = DictBackend()
+    await backend.set_distances(distances(ORIGS, DESTS, np.arange(6.)), 'google')
+
+    cache = TieredCache(MemoryCache(), backend)
+
+    res = await cache.get_distances(ORIGS, DESTS, provider='google')
+    assert sorted(res.meters) == list(np.arange(6.))
+    assert len(backend.reads) == 1
+
+    # second read served from memory
+    res = await cache.get_distances(ORIGS, DESTS, provider='google')
+    assert sorted(res.meters) == list(np.arange(6.))
+    assert len(backend.reads) == 1
+
+    # only the missing origin goes to backend
+    more = np.array([[30.0, -90.0]])
+    await cache.get_distances(np.vstack((ORIGS, more)), DESTS, provider='google')
+    assert backend.reads[-1] == (1, 3)
+
+
+@pytest.mark.asyncio
+async def test_tiered_write_through():
+    backend = DictBackend()
+    cache = TieredCache(MemoryCache(), backend)
+
+    await cache.set_distances(distances(ORIGS, DESTS, np.arange(6.)), 'google')
+
+    assert len(backend.rows) == 6
+    assert len(cache.memory) == 6
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from geode.dispatcher import AsyncDispatcher
+from geode.models.distance_matrix import partition_matrix
+from geode.planner import CostModel, count_requests, plan_cells
+
+
+def covered(plan, dlen):
+    return np.concatenate([(o[:, None] * dlen + d[None, :]).ravel() for o, d in plan.blocks])
+
+
+def test_count_requests():
+    for olen, dlen in [(1, 1), (25, 25), (10, 100), (40, 40), (100, 1), (1, 1000)]:
+        assert count_requests(olen, dlen, 625, 380) == len(list(partition_matrix(dlen, olen, 625, 380)))
+
+    assert count_requests(0, 10, 625, 380) == 0
+
+
+def test_full():
+    plan = plan_cells(np.arange(12), 4, 625, 380)
+
+    assert len(plan.blocks) == 1
+    assert plan.elements == plan.cells == 12
+    assert plan.waste == 0
+
+
+def test_new_rows_and_columns():
+    # cached matrix grew by 2 origins and 3 destinations
+    mask = np.zeros((40, 30), dtype=bool)
+    mask[38:, :] = True
+    mask[:, 27:] = True
+    missing = np.flatnonzero(mask.ravel())
+
+    plan = plan_cells(missing, 30, 625, 380)
+
+    assert len(plan.blocks) == 2
+    assert plan.waste == 0
+    assert sorted(covered(plan, 30).tolist()) == missing.tolist()
+
+
+def test_cost_model_tradeoff():
+    # [x _ x
+    #  _ x _
+    #  x _ x]
+    missing = np.array([0, 2, 4, 6, 8])
+
+    exact = plan_cells(missing, 3, 625, 380, CostModel(request_cost=0.1))
+    assert exact.waste == 0
+    assert exact.requests == 2
+
+    packed = plan_cells(missing, 3, 625, 380, CostModel(request_cost=10))
+    assert packed.requests == 1
+    assert packed.elements == 9
+    assert packed.waste == 1 - 5 / 9
+    assert set(missing) <= set(covered(packed, 3))
+
+
+@pytest.mark.asyncio
+async def test_empty_planner_config():
+    # a bare planner: block in yaml loads as None
+    dispatcher = AsyncDispatcher({'providers': {}, 'planner': None})
+    assert dispatcher.cost_model == CostModel()
+    await dispatcher.close()
+
+
+@pytest.mark.asyncio
+async def test_extra_cells_cached(make_dispatcher):
+    dispatcher = await make_dispatcher()
+    client = dispatcher.providers['fake']
+
+    origins = np.array([[41.8, -87.6], [41.9, -87.7], [42.0, -87.8]])
+    destinations = np.array([[41.5, -87.5], [42.1, -88.1], [41.6, -87.9]])
+
+    # every cell but the center, one 3 x 3 request is cheaper than going around it
+    oidx, didx = np.divmod(np.array([0, 1, 2, 3, 5, 6, 7, 8]), 3)
+    res = await dispatcher.distance_pairs(origins[oidx], destinations[didx], provider='fake')
+
+    assert client.elements == 9
+    assert len(res) == 8
+    assert len(dispatcher.cache.memory) == 9
+
+    # billed center cell answered from cache
+    res = await dispatcher.distance_pairs(origins[1:2], destinations[1:2], provider='fake')
+    assert client.elements == 9
+    assert (res.source == 'fake').all()
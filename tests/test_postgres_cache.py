@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+
+from geode import cache as cache_module
+from geode.cache import PostgresCache
+
+
+class FakePool:
+    def __init__(self):
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.mark.asyncio
+async def test_one_pool_for_concurrent_callers(monkeypatch):
+    created = []
+
+    async def create_pool(**kwargs):
+        await asyncio.sleep(0.01)
+        created.append(FakePool())
+        return created[-1]
+
+    monkeypatch.setattr(cache_module.asyncpg, 'create_pool', create_pool)
+    cache = PostgresCache(host='localhost', user='geode', password='', database='geode')
+
+    pools = await asyncio.gather(*[cache.get_pool() for _ in range(5)])
+    assert len(created) == 1
+    assert all(p is created[0] for p in pools)
+
+    await cache.close()
+    assert created[0].closed
+
+
+@pytest.mark.asyncio
+async def test_failed_creation_is_retried(monkeypatch):
+    calls = []
+
+    async def create_pool(**kwargs):
+        calls.append(kwargs)
+        if len(calls) == 1:
+            raise ConnectionError('down')
+        return FakePool()
+
+    monkeypatch.setattr(cache_module.asyncpg, 'create_pool', create_pool)
+    cache = PostgresCache(host='localhost', user='geode', password='', database='geode')
+
+    with pytest.raises(ConnectionError):
+        await cache.get_pool()
+    assert isinstance(await cache.get_pool(), FakePool)
+    assert len(calls) == 2
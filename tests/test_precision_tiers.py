@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from geode.cache import MemoryCache, SqliteCache
+from geode.dist_metrics import PrecisionTiers
+from geode.utils import point_keys
+
+ORIGS = np.array([[41.8781, -87.6298]])
+# about 13, 390, 780 and 1330 km south
+DESTS = np.array([[41.7612, -87.6298], [38.3724, -87.6231], [34.8741, -87.6407], [29.8802, -87.6266]])
+
+
+def test_precision():
+    u = np.zeros((5, 2))
+    v = np.array([[0, 1], [0, 3], [0, 6], [0, 12], [0, 25]])
+    assert PrecisionTiers().precision(u, v).tolist() == [4, 3, 2, 1, 1]
+    assert PrecisionTiers(coarsest=3).precision(u, v).tolist() == [4, 3, 3, 3, 3]
+    assert PrecisionTiers(thresholds=[]).precision(u, v).tolist() == [4] * 5
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('cache', [MemoryCache(), None])
+async def test_tiers_apart(cache, tmp_path):
+    cache = cache or await SqliteCache(path=str(tmp_path / 'cache.sqlite')).init(['google'])
+    rows = pd.DataFrame({'okey': point_keys(ORIGS[:1]), 'dkey': point_keys(DESTS[:1]), 'meters': [1.], 'seconds': [1.]})
+    await cache.set_distances(rows, 'google', precision=2)
+
+    assert (await cache.get_distances(ORIGS[:1], DESTS[:1], provider='google', pair=True)).empty
+    res = await cache.get_distances(ORIGS[:1], DESTS[:1], provider='google', pair=True, precision=2)
+    assert res.meters.tolist() == [1.]
+    res = await cache.get_distances(ORIGS[:1], DESTS[:1], provider='google', precision=2)
+    assert res.meters.tolist() == [1.]
+
+
+@pytest.mark.asyncio
+async def test_dispatcher(make_dispatcher):
+    dispatcher = await make_dispatcher({'providers': {}, 'caching': {'memory': {}}, 'precision_tiers': {}})
+    client = dispatcher.providers['fake']
+
+    exact = await dispatcher.distance_matrix(ORIGS, DESTS, max_meters=2_000_000, provider='fake')
+    assert client.elements == 4
+    assert (exact.source == 'fake').all()
+
+    cache = dispatcher.cache.memory
+    assert {precision: len(table) for (_, precision), table in cache.tables.items()} == {1: 1, 2: 1, 3: 1, 4: 1}
+
+    # same points at their tier, only the short cell is fetched again
+    near = await dispatcher.distance_matrix(ORIGS + 0.0002, DESTS, max_meters=2_000_000, provider='fake')
+    assert client.elements == 5
+    assert (near.source == 'fake').all()
+    # shortest cell first
+    near_meters, exact_meters = np.sort(near.meters.values), np.sort(exact.meters.values)
+    np.testing.assert_array_equal(near_meters[1:], exact_meters[1:])
+    assert near_meters[0] != exact_meters[0]
+
+    # a tier 3 cell rounding elsewhere is fetched
+    await dispatcher.distance_matrix(ORIGS + 0.0002, DESTS[1:2] + 0.001, max_meters=2_000_000, provider='fake')
+    assert client.elements == 6
+
+
+@pytest.mark.asyncio
+async def test_shared_tier_pair(make_dispatcher, tmp_path):
+    dispatcher = await make_dispatcher({
+        'providers': {}, 'caching': {'type_': 'sqlite', 'path': str(tmp_path / 'cache.sqlite'), 'memory': {}},
+        'precision_tiers': {}
+    })
+    client = dispatcher.providers['fake']
+
+    # 11 m apart, both round onto one tier 1 pair with the far destination
+    origins = np.vstack((ORIGS, ORIGS + [0.0001, 0]))
+    res = await dispatcher.distance_matrix(origins, DESTS[3:], max_meters=2_000_000, provider='fake')
+    assert client.elements == 2
+    assert (res.source == 'fake').all()
+
+    res = await dispatcher.distance_matrix(origins + 0.0002, DESTS[3:], max_meters=2_000_000, provider='fake')
+    assert client.elements == 2
+    assert (res.source == 'fake').all()
+
+
+@pytest.mark.asyncio
+async def test_off(make_dispatcher):
+    dispatcher = await make_dispatcher()
+    client = dispatcher.providers['fake']
+
+    await dispatcher.distance_matrix(ORIGS, DESTS, max_meters=2_000_000, provider='fake')
+    await dispatcher.distance_matrix(ORIGS + 0.0002, DESTS, max_meters=2_000_000, provider='fake')
+    assert client.elements == 8
+    assert {precision for _, precision in dispatcher.cache.memory.tables} == {4}
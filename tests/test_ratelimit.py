@@ -0,0 +1,140 @@
+import asyncio
+import time
+
+import pytest
+
+from geode.ratelimit import AdaptiveConcurrency, TokenBucket, RateLimiter
+
+
+def test_reserve():
+    bucket = TokenBucket(rate=10, capacity=2)
+
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    # third token is owed, a tenth of a second away
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    # bigger than capacity still goes through after its debt
+    assert bucket.reserve(5) == pytest.approx(0.6, abs=0.01)
+
+    bucket.refund(7)
+    assert bucket.reserve() == 0
+
+
+@pytest.mark.asyncio
+async def test_rate():
+    limiter = RateLimiter(requests_per_second=100, elements_per_second=1000)
+    limiter.requests.tokens = limiter.elements.tokens = 0
+
+    s = time.monotonic()
+    await asyncio.gather(*[limiter.acquire(elements=25) for _ in range(8)])
+    elapsed = time.monotonic() - s
+
+    # elements bound, 200 elements at 1000/s
+    assert 0.18 <= elapsed < 0.5
+    assert limiter.waited > 0
+
+
+@pytest.mark.asyncio
+async def test_unlimited():
+    limiter = RateLimiter()
+
+    await asyncio.wait_for(asyncio.gather(*[limiter.acquire(elements=10 ** 6) for _ in range(100)]), 0.1)
+    assert limiter.waited == 0
+
+
+@pytest.mark.asyncio
+async def test_aimd():
+    ac = AdaptiveConcurrency(initial=4, max_limit=5)
+
+    for _ in range(8):
+        async with ac.slot():
+            pass
+
+    # +1 / limit per ok response, capped
+    assert ac.limit == 5
+
+    async with ac.slot() as slot:
+        slot.throttled = True
+    assert ac.limit == 2.5
+
+    # same burst, no second cut within a round trip
+    ac.round_trip = 10.
+    async with ac.slot() as slot:
+        slot.throttled = True
+    assert ac.limit == 2.5
+    assert ac.metrics.throttles == 2
+    assert ac.metrics.decreases == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrency_limit():
+    ac = AdaptiveConcurrency(initial=2)
+    peak = 0
+
+    async def request():
+        nonlocal peak
+        async with ac.slot():
+            peak = max(peak, ac.inflight)
+            await asyncio.sleep(0.01)
+
+    waiting = asyncio.ensure_future(request())
+    await asyncio.gather(*[request() for _ in range(6)])
+    await waiting
+
+    assert peak <= 3
+    assert ac.inflight == 0 and not ac.waiters
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter():
+    ac = AdaptiveConcurrency(initial=1)
+
+    await ac.acquire()
+    waiter = asyncio.ensure_future(ac.acquire())
+    await asyncio.sleep(0)
+
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+
+    ac.release(0.01)
+    assert ac.inflight == 0
+
+
+def test_latency_shift():
+    ac = AdaptiveConcurrency(initial=8, warmup=5)
+    for _ in range(5):
+        ac.release(0.1)
+
+    # a lasting slowdown cuts once, then becomes the baseline
+    ac.inflight = 100
+    for _ in range(50):
+        ac.release(1.)
+    assert ac.metrics.latency_spikes <= 3
+    assert ac.metrics.decreases == 1
+    assert ac.limit > 8
+
+
+def test_latency_per_element():
+    ac = AdaptiveConcurrency(initial=8, warmup=5)
+    for _ in range(5):
+        ac.release(0.1, elements=1)
+
+    # a 25 x 25 chunk takes longer, not slower per element
+    ac.inflight = 100
+    ac.release(2., elements=625)
+    assert ac.metrics.latency_spikes == 0
+    assert ac.metrics.decreases == 0
+
+
+@pytest.mark.asyncio
+async def test_failed_request():
+    ac = AdaptiveConcurrency(initial=4)
+
+    with pytest.raises(ConnectionError):
+        async with ac.slot():
+            raise ConnectionError('reset')
+
+    assert ac.limit == 4
+    assert ac.samples == 0
+    assert ac.inflight == 0
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+import geode.models as m
+from geode.dispatcher import AsyncDispatcher
+from geode.reverse_index import ReverseIndex
+from geode.spatial import PointIndex
+from tests.fakes import FakeGeocoder, RESULT
+
+Precision = m.geocoding.Precision
+
+
+def result(lat, lon, precision=Precision.ROOFTOP, number='1'):
+    return m.geocoding.Result(address=m.Address(number=number), point=m.GeoPoint(lat, lon), precision=precision)
+
+
+def test_point_index():
+    index = PointIndex([[37.1, -88.1], [37.2, -88.2]])
+    # second point lands in the side tree
+    index.add([[37.1003, -88.1]])
+
+    pos, meters = index.nearest([[37.1, -88.1002], [37.1004, -88.1], [38, -88]], radius=30)
+    assert pos.tolist() == [0, 2, -1]
+    assert meters[0] == pytest.approx(17.8, abs=0.1)
+    assert meters[1] == pytest.approx(11.1, abs=0.1)
+    assert np.isinf(meters[2])
+
+    # past rebuild ratio everything goes to the main tree
+    index.add(np.column_stack((np.linspace(30, 31, 10), np.full(10, -90))))
+    pos, _ = index.nearest([[37.1004, -88.1], [30 + 5 / 9, -90]], radius=30)
+    assert pos.tolist() == [2, 8]
+    assert index.built == len(index)
+
+
+def test_lookup(tmp_path):
+    index = ReverseIndex(radius=50)
+    index.add([
+        result(37.1, -88.1, number='1'),
+        result(37.1, -88.1, number='dup'),
+        result(37.1002, -88.1, Precision.GEOMETRIC_CENTER, number='2'),
+        None,
+    ])
+    assert len(index) == 2
+
+    points = [[37.1002, -88.1001], [37.101, -88.1]]
+    assert [r and r.address.number for r in index.lookup(points)] == ['1', None]
+    assert [r and r.address.number for r in index.lookup(points, min_precision=Precision.GEOMETRIC_CENTER)] == \
+        ['2', None]
+    assert [r and r.address.number for r in index.lookup(points, radius=150)] == ['1', '1']
+    assert (index.hits, index.misses) == (4, 2)
+
+    path = str(tmp_path / 'reverse.json')
+    index.save(path)
+    loaded = ReverseIndex(radius=50, min_precision='GEOMETRIC_CENTER', path=path)
+    assert len(loaded) == 2
+    assert loaded.lookup(points) == index.lookup(points, min_precision=Precision.GEOMETRIC_CENTER)
+
+
+@pytest.mark.asyncio
+async def test_dispatcher(tmp_path):
+    path = str(tmp_path / 'reverse.json')
+    dispatcher = AsyncDispatcher({'providers': {}, 'reverse_index': {'radius': 20, 'path': path}})
+    client = FakeGeocoder()
+    dispatcher.providers = {'fake': client}
+
+    # pings around the known address
+    ping = np.array(RESULT.point)
+    pings = [m.GeoPoint(*(ping + offset)) for offset in [[0.0001, 0], [-0.0001, 0.0001], [0, -0.0001]]]
+
+    assert await dispatcher.geocode(pings[0], provider='fake') == [RESULT]
+    assert await dispatcher.batch_geocode(pings + [m.GeoPoint(38, -120)], provider='fake') == [RESULT] * 4
+    # only the first ping and the far point went out
+    assert client.calls == [pings[0], m.GeoPoint(38, -120)]
+
+    await dispatcher.close()
+    assert len(ReverseIndex(path=path)) == 1
@@ -0,0 +1,139 @@
+import asyncio
+import numpy as np
+import pytest
+
+import geode.models as m
+from geode.singleflight import SingleFlight
+
+
+class GatedMatrix(m.distance_matrix.Client):
+    area_max = 625
+    factor_max = 380
+
+    def __init__(self):
+        self.gate = asyncio.Event()
+        self.sessions = []
+
+    async def distance_matrix(self, origins, destinations, session=None):
+        self.sessions.append(session)
+        await self.gate.wait()
+        assert not session.closed
+
+        res = np.recarray((len(origins), len(destinations)), dtype=m.distance_matrix.RECORD)
+        res.meters = 1000.
+        res.seconds = 100.
+        return m.distance_matrix.Result(origins=origins, destinations=destinations, distances=res)
+
+
+async def join(flights, key, fn):
+    """Await the flight for key, starting fn() if there is none, the way the dispatcher does."""
+    free, inflight = flights.split([key])
+    if free:
+        inflight = [flights.launch([key], fn())]
+    return await asyncio.shield(inflight[0])
+
+
+@pytest.mark.asyncio
+async def test_shared_flight():
+    flights = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'done'
+
+    res = await asyncio.gather(*[join(flights, 'a', work) for _ in range(3)])
+
+    assert res == ['done'] * 3
+    assert len(calls) == 1
+    assert flights.joined == 2
+    assert not flights.flights
+
+    free, inflight = flights.split(['a', 'b'])
+    assert free == [0, 1] and inflight == []
+
+
+@pytest.mark.asyncio
+async def test_split_keys():
+    flights = SingleFlight()
+    gate = asyncio.Event()
+
+    async def work():
+        await gate.wait()
+        return {'a': 1, 'b': 2}
+
+    task = flights.launch(['a', 'b'], work())
+    free, inflight = flights.split(['b', 'c', 'a'])
+
+    assert free == [1]
+    assert inflight == [task]
+
+    gate.set()
+    assert (await task)['b'] == 2
+    assert not flights.flights
+
+
+@pytest.mark.asyncio
+async def test_errors_reach_all_waiters():
+    flights = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.01)
+        raise ValueError('provider down')
+
+    res = await asyncio.gather(*[join(flights, 'a', work) for _ in range(2)], return_exceptions=True)
+
+    assert all(isinstance(r, ValueError) for r in res)
+    assert not flights.flights
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_keeps_flight():
+    flights = SingleFlight()
+    gate = asyncio.Event()
+
+    async def work():
+        await gate.wait()
+        return 'done'
+
+    first = asyncio.ensure_future(join(flights, 'a', work))
+    second = asyncio.ensure_future(join(flights, 'a', work))
+    await asyncio.sleep(0)
+
+    first.cancel()
+    gate.set()
+
+    assert await second == 'done'
+    with pytest.raises(asyncio.CancelledError):
+        await first
+
+
+@pytest.mark.asyncio
+async def test_cancelled_initiator(make_dispatcher):
+    client = GatedMatrix()
+    dispatcher = await make_dispatcher({'providers': {}}, client)
+    origins = np.array([[37.1, -88.1]])
+    destinations = np.array([[37.2, -88.2], [37.3, -88.3]])
+
+    async def call():
+        return await dispatcher.distance_matrix(origins, destinations, provider='fake')
+
+    first = asyncio.ensure_future(call())
+    await asyncio.sleep(0.01)
+    second = asyncio.ensure_future(call())
+    await asyncio.sleep(0.01)
+
+    # the initiator gives up, the shared request goes on for the waiter
+    first.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await first
+    client.gate.set()
+
+    res = await second
+    assert (res.source == 'fake').all()
+    assert len(client.sessions) == 1
+    assert dispatcher.flights.joined == 2
+
+    await dispatcher.close()
+    assert client.sessions[0].closed
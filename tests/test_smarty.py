@@ -0,0 +1,115 @@
+import aiohttp
+import pytest
+from aiohttp.test_utils import TestServer
+
+import geode.models as m
+from geode import smarty
+from geode.dispatcher import AsyncDispatcher
+from geode.smarty.mock import SmartyMock
+from geode.smarty.models import SAMPLE_RESULTS, SmartyGeocodingResponse
+from geode.utils import marshall_to
+
+
+def addresses(n):
+    return [f'{100 + i} Main St, Springfield, IL 62701' for i in range(n)]
+
+
+async def serve(**kwargs):
+    mock = SmartyMock(**kwargs)
+    server = TestServer(mock.app())
+    await server.start_server()
+    server.mock = mock
+    return server
+
+
+def client(server, **kwargs):
+    return smarty.Client(base_url=str(server.make_url('/')), auth_id='test', auth_token='test', **kwargs)
+
+
+def test_map_from_address():
+    import ujson
+    res = smarty.geocoding.map_from_address(marshall_to(SmartyGeocodingResponse, ujson.loads(SAMPLE_RESULTS)))
+
+    assert res.point == m.GeoPoint(42.38228, -71.07244)
+    assert res.address.street == 'Rutherford Ave'
+    assert res.address.formatted == '500 Rutherford Ave, Charlestown MA 02129-1647'
+    assert res.precision == m.geocoding.Precision.RANGE_INTERPOLATED
+    assert res.confidence == m.geocoding.Confidence.PARTIAL
+
+
+@pytest.mark.asyncio
+async def test_batches():
+    server = await serve()
+    locations = addresses(250)
+    # not an address, no candidate
+    locations[120] = 'Springfield'
+
+    async with aiohttp.ClientSession() as session:
+        results = await client(server).batch_geocode(locations, session=session)
+
+    assert server.mock.requests == 3
+    assert server.mock.lookups == 250
+
+    assert results[120] == []
+    assert [len(r) for r in results].count(1) == 249
+    assert results[249][0].address.number == '349'
+    assert results[0][0].address.formatted == '100 Main St, Springfield IL 62701'
+
+    await server.close()
+
+
+@pytest.mark.asyncio
+async def test_errors():
+    server = await serve(throttle_every=2)
+
+    async with aiohttp.ClientSession() as session:
+        # throttled requests are retried
+        assert len(await client(server).batch_geocode(addresses(300), session=session)) == 300
+        assert server.mock.requests > 3
+
+        with pytest.raises(m.geocoding.GeocodeError):
+            await smarty.Client(base_url=str(server.make_url('/'))).geocode('1 Main St', session=session)
+
+    await server.close()
+
+
+@pytest.mark.asyncio
+async def test_points_skipped():
+    server = await serve()
+    locations = [*addresses(5), m.GeoPoint(37.1, -88.1)]
+
+    async with aiohttp.ClientSession() as session:
+        results = await client(server).batch_geocode(locations, session=session)
+        assert await client(server).geocode(m.GeoPoint(37.1, -88.1), session=session) == []
+
+    assert [len(r) for r in results] == [1] * 5 + [0]
+    assert server.mock.requests == 1
+    assert server.mock.lookups == 5
+
+    # a point in a dispatcher chunk costs only its own result
+    dispatcher = AsyncDispatcher({'providers': {'smarty': {
+        'type_': 'smarty', 'base_url': str(server.make_url('/')), 'auth_id': 'test', 'auth_token': 'test'
+    }}})
+    results = await dispatcher.batch_geocode(locations, provider='smarty')
+    await dispatcher.close()
+    assert [r is not None for r in results] == [True] * 5 + [False]
+
+    await server.close()
+
+
+@pytest.mark.asyncio
+async def test_dispatcher():
+    server = await serve()
+    dispatcher = AsyncDispatcher({'providers': {'smarty': {
+        'type_': 'smarty', 'base_url': str(server.make_url('/')), 'auth_id': 'test', 'auth_token': 'test'
+    }}})
+
+    locations = addresses(150) * 2
+    results = await dispatcher.batch_geocode(locations, provider='smarty')
+    await dispatcher.close()
+
+    assert results[:150] == results[150:]
+    assert all(r is not None for r in results)
+    assert server.mock.requests == 2
+
+    await server.close()
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from geode.spatial import SnapIndex
+from geode.utils import point_keys
+
+ORIGS = np.array([[37.1, -88.1], [37.5, -88.6]])
+DESTS = np.array([[37.9, -87.1], [38.4, -86.2], [36.2, -89.9]])
+
+
+def test_snap_index():
+    index = SnapIndex(radius=30)
+    index.add('fake', point_keys(ORIGS), point_keys(DESTS))
+
+    assert 'fake' in index and 'other' not in index
+    keys = index.snap('fake', np.array([[37.1002, -88.1], [37.5, -88.6], [37.2, -88.1]]), 'o')
+    assert keys.tolist() == [*point_keys(ORIGS).tolist(), -1]
+    # destinations are a separate set
+    assert index.snap('fake', ORIGS, 'd').tolist() == [-1, -1]
+    assert index.snap('other', ORIGS, 'o').tolist() == [-1, -1]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('hemisphere', [1, -1])
+async def test_dispatcher(make_dispatcher, hemisphere):
+    # packed keys of southern points are negative
+    flip = np.array([hemisphere, 1])
+    dispatcher = await make_dispatcher({'providers': {}, 'caching': {'memory': {}}, 'snapping': {'radius': 30}})
+    client = dispatcher.providers['fake']
+
+    exact = await dispatcher.distance_matrix(ORIGS * flip, DESTS * flip, provider='fake')
+    assert client.elements == 6
+    assert not exact.snapped.any()
+
+    # within 30m of cached origins and destinations, plus one far origin
+    near = np.vstack((ORIGS + [0.0002, 0], [[38.0, -88.0]])) * flip
+    res = await dispatcher.distance_matrix(near, (DESTS + [0, 0.0002]) * flip, provider='fake')
+    assert client.elements == 6 + 3
+
+    snapped = res[res.snapped]
+    assert len(snapped) == 6
+    np.testing.assert_array_equal(snapped.meters.values, exact.meters.values)
+    assert (res.source == 'fake').all()
+    assert not res.snapped.loc[38.0 * hemisphere].any()
+
+    # fetched locations are indexed too
+    res = await dispatcher.distance_pairs(np.array([[38.0002, -88.0]]) * flip, (DESTS[:1] + [0, 0.0002]) * flip, provider='fake')
+    assert res.snapped.all()
+    assert client.elements == 9
+
+
+@pytest.mark.asyncio
+async def test_off(make_dispatcher):
+    dispatcher = await make_dispatcher()
+
+    res = await dispatcher.distance_matrix(ORIGS, DESTS, provider='fake')
+    assert 'snapped' not in res
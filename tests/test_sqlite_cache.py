@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from geode.cache import SqliteCache, TieredCache, create_cache
+from tests.fakes import distances
+
+# one origin south and east of the equator and meridian
+ORIGS = np.array([[37.1, -88.1],
+                  [-33.9, 151.2]])
+
+DESTS = np.array([[37.1, -86.1],
+                  [41.9, -97.2],
+                  [-45.5, -97.5]])
+
+
+@pytest.mark.asyncio
+async def test_roundtrip(tmp_path):
+    cache = await SqliteCache(path=str(tmp_path / 'cache.sqlite')).init(['google'])
+
+    rows = distances(ORIGS, DESTS, np.arange(6.))
+    await cache.set_distances(rows, 'google')
+    # existing cells are kept
+    await cache.set_distances(distances(ORIGS, DESTS, np.arange(6.) + 100), 'google')
+
+    res = await cache.get_distances(ORIGS, DESTS, provider='google')
+    pd.testing.assert_frame_equal(
+        res.sort_values(['okey', 'dkey']).reset_index(drop=True),
+        rows.sort_values(['okey', 'dkey']).reset_index(drop=True)
+    )
+
+    res = await cache.get_distances(ORIGS[:1], DESTS[1:], provider='google')
+    assert sorted(res.meters) == [1., 2.]
+
+    res = await cache.get_distances(ORIGS, DESTS[[2, 0]], provider='google', pair=True)
+    assert sorted(res.meters) == [2., 3.]
+
+    await cache.close()
+
+    # persisted to file
+    cache = await SqliteCache(path=str(tmp_path / 'cache.sqlite')).init(['google'])
+    assert len(await cache.get_distances(ORIGS, DESTS, provider='google')) == 6
+    await cache.close()
+
+
+@pytest.mark.asyncio
+async def test_iter_distances(tmp_path):
+    cache = await SqliteCache(path=str(tmp_path / 'cache.sqlite')).init(['google'])
+    await cache.set_distances(distances(ORIGS, DESTS, np.arange(6.)), 'google')
+    await cache.set_distances(distances(ORIGS, DESTS, np.arange(6.) + 100), 'google', precision=2)
+
+    chunks = [rows async for rows in cache.iter_distances('google', chunk_rows=4)]
+    assert [len(rows) for rows in chunks] == [4, 2]
+    assert sorted(pd.concat(chunks).meters) == list(np.arange(6.))
+
+    chunks = [rows async for rows in cache.iter_distances('google', precision=2)]
+    assert sorted(pd.concat(chunks).meters) == list(np.arange(6.) + 100)
+
+    await cache.close()
+
+
+def test_create_cache(tmp_path):
+    cache = create_cache({'type_': 'sqlite', 'path': str(tmp_path / 'cache.sqlite'), 'memory': {}})
+
+    assert isinstance(cache, TieredCache)
+    assert isinstance(cache.backend, SqliteCache)
@@ -0,0 +1,162 @@
+import asyncio
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from geode.cache import WriteBehindCache, DISTANCE_COLS
+from tests.fakes import ORIGS, DESTS, distances
+
+
+class ListBackend:
+    def __init__(self, fail=False):
+        self.batches = []
+        self.fail = fail
+        self.closed = False
+
+    async def get_distances(self, origins, destinations, provider=None, pair=False, precision=4):
+        return pd.DataFrame(columns=DISTANCE_COLS)
+
+    async def iter_distances(self, provider, precision=4, chunk_rows=100):
+        for batch in self.batches:
+            yield batch
+
+    async def set_distances(self, distances, provider, precision=4):
+        if self.fail:
+            raise ConnectionError('down')
+        self.batches.append(distances)
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.mark.asyncio
+async def test_batches_by_size():
+    backend = ListBackend()
+    cache = WriteBehindCache(backend, batch_rows=6, flush_interval=60)
+
+    await cache.set_distances(distances(ORIGS[:1], DESTS, np.arange(3.)), 'google')
+    await asyncio.sleep(0)
+    assert not backend.batches
+
+    # queued rows are readable before they are persisted
+    res = await cache.get_distances(ORIGS, DESTS, provider='google')
+    assert sorted(res.meters) == [0., 1., 2.]
+
+    await cache.set_distances(distances(ORIGS[1:], DESTS, np.arange(3., 6.)), 'google')
+    await asyncio.sleep(0.01)
+
+    assert [len(b) for b in backend.batches] == [6]
+    assert cache.metrics.flushed_rows == 6
+    assert cache.pending_rows == 0
+
+    await cache.close()
+
+
+@pytest.mark.asyncio
+async def test_flush_on_close_and_failures():
+    backend = ListBackend()
+    cache = WriteBehindCache(backend, flush_interval=60)
+
+    await cache.set_distances(distances(ORIGS, DESTS, np.arange(6.)), 'google')
+    await cache.close()
+
+    assert [len(b) for b in backend.batches] == [6]
+    assert backend.closed
+
+    cache = WriteBehindCache(ListBackend(fail=True), flush_interval=60)
+    await cache.set_distances(distances(ORIGS, DESTS, np.arange(6.)), 'google')
+    await cache.flush()
+
+    assert cache.metrics.failed_batches == 1
+    assert cache.metrics.failed_rows == 6
+    assert isinstance(cache.metrics.last_error, ConnectionError)
+
+
+@pytest.mark.asyncio
+async def test_retry_until_backend_recovers():
+    backend = ListBackend(fail=True)
+    cache = WriteBehindCache(backend, flush_interval=60)
+
+    await cache.set_distances(distances(ORIGS, DESTS, np.arange(6.)), 'google')
+    assert not await cache.flush()
+    assert cache.pending_rows == 6
+
+    # queued again and still readable
+    res = await cache.get_distances(ORIGS, DESTS, provider='google')
+    assert sorted(res.meters) == list(np.arange(6.))
+
+    # rows written since the failure win
+    await cache.set_distances(distances(ORIGS[:1], DESTS, [10., 11., 12.]), 'google')
+
+    backend.fail = False
+    assert await cache.flush()
+    assert [sorted(b.meters) for b in backend.batches] == [[3., 4., 5., 10., 11., 12.]]
+    assert cache.pending_rows == 0
+    assert cache.metrics.dropped_rows == 0
+
+    await cache.close()
+
+
+@pytest.mark.asyncio
+async def test_drop_after_max_attempts():
+    cache = WriteBehindCache(ListBackend(fail=True), flush_interval=60, max_attempts=3)
+    await cache.set_distances(distances(ORIGS, DESTS, np.arange(6.)), 'google')
+
+    for _ in range(3):
+        await cache.flush()
+
+    assert cache.metrics.failed_batches == 3
+    assert cache.metrics.dropped_rows == 6
+    assert cache.pending_rows == 0
+    await cache.close()
+
+
+@pytest.mark.asyncio
+async def test_iter_distances():
+    backend = ListBackend()
+    cache = WriteBehindCache(backend, flush_interval=60)
+
+    await cache.set_distances(distances(ORIGS[:1], DESTS, np.arange(3.)), 'google')
+    await cache.flush()
+    # queued rows replace persisted ones
+    await cache.set_distances(distances(ORIGS, DESTS, np.arange(10., 16.)), 'google')
+
+    chunks = [rows async for rows in cache.iter_distances('google', chunk_rows=4)]
+    assert [len(rows) for rows in chunks] == [4, 2]
+    assert sorted(pd.concat(chunks).meters) == list(np.arange(10., 16.))
+
+    await cache.close()
+
+
+@pytest.mark.asyncio
+async def test_backpressure():
+    backend = ListBackend()
+    cache = WriteBehindCache(backend, batch_rows=100, flush_interval=60, max_pending_rows=6)
+
+    await cache.set_distances(distances(ORIGS, DESTS, np.arange(6.)), 'google')
+    # full queue, writer waits on a flush
+    await cache.set_distances(distances(ORIGS, DESTS, np.arange(6.)), 'bing')
+
+    assert cache.metrics.backpressure_waits == 1
+    assert [len(b) for b in backend.batches] == [6]
+    assert cache.pending_rows == 6
+
+    await cache.close()
+
+
+@pytest.mark.asyncio
+async def test_worker_retries():
+    backend = ListBackend(fail=True)
+    cache = WriteBehindCache(backend, batch_rows=1, flush_interval=0.01)
+
+    await cache.set_distances(distances(ORIGS, DESTS, np.arange(6.)), 'google')
+    await asyncio.sleep(0.005)
+    assert cache.metrics.failed_batches == 1
+
+    backend.fail = False
+    await asyncio.sleep(0.05)
+    assert [len(b) for b in backend.batches] == [6]
+    assert cache.pending_rows == 0
+
+    await cache.close()